@@ -0,0 +1,190 @@
+"""
+Replay the EMA crossover strategy of refinedmain.py over a stored bar history
+
+    python backtest.py GBPUSD_M15.csv --point 0.00001 --trades trades.csv
+
+Signals are evaluated on every bar close: an EMA_Close_10 / EMA_Median_23 crossover
+confirmed by validate_trend opens a position at the close with the SL/TP of
+place_market_order, and an open position is closed at a bar close when validate_trend
+turns against it, as in the position management of start_mt5_bot.
+"""
+import argparse
+
+import numpy as np
+
+from rates import load_rates
+from signals import crossover_signals, validate_trends
+
+TRADE_DTYPE = np.dtype([
+    ('entry_time', '<i8'),
+    ('exit_time', '<i8'),
+    ('direction', 'i1'),
+    ('entry_price', '<f8'),
+    ('exit_price', '<f8'),
+    ('sl', '<f8'),
+    ('tp', '<f8'),
+    ('reason', '<U5'),
+    ('pnl_points', '<f8'),
+    ('pnl', '<f8'),
+])
+
+
+def ema(values, span):
+    """
+    Whole-array ewm(span=span, adjust=False).mean()
+    """
+    import pandas as pd
+
+    return pd.Series(values, copy=False).ewm(span=span, adjust=False).mean().to_numpy()
+
+
+def crossover_entries(ema_close, ema_median, trend_period=5, trend_ratio=0.6):
+    """
+    Long and short entry masks and the trend reversal exit masks of the crossover strategy
+    """
+    signals = crossover_signals(ema_close, ema_median)
+    bullish = validate_trends(ema_close, 'bullish', trend_period, trend_ratio)
+    bearish = validate_trends(ema_close, 'bearish', trend_period, trend_ratio)
+    # start_mt5_bot only validates a signal once it has trend_period + 1 bars
+    enough_bars = np.arange(len(ema_close)) >= trend_period
+    long_entries = (signals == 1) & bullish & enough_bars
+    short_entries = (signals == -1) & bearish & enough_bars
+    return long_entries, short_entries, bearish, bullish
+
+
+def _first_exit(low, high, exit_rule, sl, tp, direction, start):
+    """
+    First bar from start whose range reaches sl or tp or that has an exit signal
+    Scans in growing chunks so short trades do not touch the rest of the history
+    Returns the bar index and the reason, (-1, 'end') when the position is never closed
+    """
+    size = 64
+    while start < len(low):
+        end = min(len(low), start + size)
+        if direction == 1:
+            sl_hit = low[start:end] <= sl
+            tp_hit = high[start:end] >= tp
+        else:
+            sl_hit = high[start:end] >= sl
+            tp_hit = low[start:end] <= tp
+        hits = sl_hit | tp_hit | exit_rule[start:end]
+        if hits.any():
+            k = int(hits.argmax())
+            if sl_hit[k]:
+                return start + k, 'sl'
+            if tp_hit[k]:
+                return start + k, 'tp'
+            return start + k, 'trend'
+        start = end
+        size *= 2
+    return -1, 'end'
+
+
+def simulate_trades(rates, long_entries, short_entries, exit_long, exit_short,
+                    sl_points=100, tp_points=200, lot_size=0.01, point=0.00001, contract_size=100000):
+    """
+    Fill every entry at its bar close and walk it forward to its SL, TP or exit signal
+    Buys fill at the ask (close + spread) and close at the bid, sells the other way round.
+    When SL and TP are both inside one bar the SL is assumed to be hit first.
+    """
+    close = rates['close'].astype(float)
+    low = rates['low'].astype(float)
+    high = rates['high'].astype(float)
+    spread = rates['spread'] * point
+    ask_low = low + spread
+    ask_high = high + spread
+    entries = np.flatnonzero(long_entries | short_entries)
+    trades = np.zeros(len(entries), dtype=TRADE_DTYPE)
+
+    for n, i in enumerate(entries):
+        direction = 1 if long_entries[i] else -1
+        if direction == 1:
+            entry_price = close[i] + spread[i]
+            sl = entry_price - sl_points * point
+            tp = entry_price + tp_points * point
+            j, reason = _first_exit(low, high, exit_long, sl, tp, direction, i + 1)
+        else:
+            entry_price = close[i]
+            sl = entry_price + sl_points * point
+            tp = entry_price - tp_points * point
+            j, reason = _first_exit(ask_low, ask_high, exit_short, sl, tp, direction, i + 1)
+
+        if reason == 'sl':
+            exit_price = sl
+        elif reason == 'tp':
+            exit_price = tp
+        else:
+            # Still open at the end of the history, marked to the last close
+            j = len(rates) - 1 if j == -1 else j
+            exit_price = close[j] if direction == 1 else close[j] + spread[j]
+
+        trades[n] = (rates['time'][i], rates['time'][j], direction, entry_price, exit_price, sl, tp, reason,
+                     direction * (exit_price - entry_price) / point,
+                     direction * (exit_price - entry_price) * lot_size * contract_size)
+    return trades
+
+
+def summarize(trades):
+    """
+    Trade count, hit rate, total PnL, profit factor and max drawdown of a trade list
+    """
+    pnl = trades['pnl']
+    wins = pnl[pnl > 0]
+    losses = pnl[pnl < 0]
+    equity = np.cumsum(pnl[np.argsort(trades['exit_time'], kind='stable')])
+    drawdown = np.maximum.accumulate(np.concatenate([[0.0], equity]))[1:] - equity if len(equity) else equity
+    return {
+        'trades': len(trades),
+        'wins': len(wins),
+        'hit_rate': len(wins) / len(trades) if len(trades) else 0.0,
+        'total_pnl': float(pnl.sum()),
+        'total_points': float(trades['pnl_points'].sum()),
+        'profit_factor': float(wins.sum() / -losses.sum()) if len(losses) else float('inf'),
+        'max_drawdown': float(drawdown.max()) if len(drawdown) else 0.0,
+    }
+
+
+def run_backtest(rates, fast_span=10, slow_span=23, sl_points=100, tp_points=200, lot_size=0.01,
+                 point=0.00001, contract_size=100000, trend_period=5, trend_ratio=0.6):
+    """
+    Backtest the refinedmain.py strategy on a copy_rates_from_pos shaped array
+    Returns the trades and their summary
+    """
+    ema_close = ema(rates['close'], fast_span)
+    ema_median = ema((rates['high'] + rates['low']) / 2, slow_span)
+    long_entries, short_entries, exit_long, exit_short = crossover_entries(ema_close, ema_median,
+                                                                           trend_period, trend_ratio)
+    trades = simulate_trades(rates, long_entries, short_entries, exit_long, exit_short,
+                             sl_points, tp_points, lot_size, point, contract_size)
+    return trades, summarize(trades)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest the refinedmain.py EMA crossover strategy")
+    parser.add_argument('history', help="bar history (.csv, .parquet or .npy)")
+    parser.add_argument('--fast-span', type=int, default=10)
+    parser.add_argument('--slow-span', type=int, default=23)
+    parser.add_argument('--sl-points', type=float, default=100)
+    parser.add_argument('--tp-points', type=float, default=200)
+    parser.add_argument('--lot-size', type=float, default=0.01)
+    parser.add_argument('--point', type=float, default=0.00001, help="symbol_info(symbol).point")
+    parser.add_argument('--contract-size', type=float, default=100000)
+    parser.add_argument('--trend-period', type=int, default=5)
+    parser.add_argument('--trend-ratio', type=float, default=0.6)
+    parser.add_argument('--trades', help="write the trade list to this CSV file")
+    args = parser.parse_args()
+
+    rates = load_rates(args.history)
+    trades, summary = run_backtest(rates, args.fast_span, args.slow_span, args.sl_points, args.tp_points,
+                                   args.lot_size, args.point, args.contract_size, args.trend_period, args.trend_ratio)
+    for name, value in summary.items():
+        print(f"{name}: {value}")
+    if args.trades:
+        import pandas as pd
+
+        pd.DataFrame(trades).to_csv(args.trades, index=False)
+        print(f"Trades written to {args.trades}")
+
+
+if __name__ == '__main__':
+    main()
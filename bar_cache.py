@@ -0,0 +1,135 @@
+import os
+
+import numpy as np
+
+from rates import RATES_DTYPE
+
+# Far enough ahead for copy_rates_range to return everything after the last cached bar
+_RANGE_AHEAD = 366 * 24 * 60 * 60
+
+
+class BarCache:
+    """
+    Ring buffer of the last `capacity` bars of one symbol and timeframe
+    The first refresh loads a full window with copy_rates_from_pos, later ones only
+    fetch bars from the last cached (possibly still forming) bar onwards with
+    copy_rates_range. With a path the buffer is a memory-mapped .npy file that
+    survives restarts, so a restarted bot only fetches the bars it missed.
+    """
+
+    def __init__(self, symbol, timeframe, capacity=500, path=None):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.capacity = capacity
+        if path is None:
+            self.data = np.zeros(capacity, dtype=RATES_DTYPE)
+            self.meta = np.zeros(2, dtype='<i8')
+        else:
+            self.data = self._open(path, RATES_DTYPE, capacity)
+            self.meta = self._open(path[:-len('.npy')] + '.meta.npy', np.dtype('<i8'), 2)
+            if self.data.shape[0] != capacity:
+                raise ValueError(f"{path} holds {self.data.shape[0]} bars, expected {capacity}")
+
+    @staticmethod
+    def _open(path, dtype, size):
+        if os.path.exists(path):
+            return np.load(path, mmap_mode='r+')
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(size,))
+
+    # meta holds the ring start index and the number of cached bars
+    @property
+    def start(self):
+        return int(self.meta[0])
+
+    @property
+    def count(self):
+        return int(self.meta[1])
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def last_time(self):
+        if self.count == 0:
+            return None
+        return int(self.data[(self.start + self.count - 1) % self.capacity]['time'])
+
+    def extend(self, rates):
+        """
+        Add bars in time order, the bar matching the last cached one replaces it
+        (its close, high, low and volume keep changing until it closes)
+        Returns the number of bars that were added or updated
+        """
+        updated = 0
+        last_time = self.last_time
+        if last_time is not None:
+            rates = rates[rates['time'] >= last_time]
+            if len(rates) and rates[0]['time'] == last_time:
+                self.data[(self.start + self.count - 1) % self.capacity] = rates[0]
+                rates = rates[1:]
+                updated = 1
+
+        rates = rates[-self.capacity:]
+        positions = (self.start + self.count + np.arange(len(rates))) % self.capacity
+        self.data[positions] = rates
+        overflow = max(0, self.count + len(rates) - self.capacity)
+        self.meta[0] = (self.start + overflow) % self.capacity
+        self.meta[1] = self.count + len(rates) - overflow
+        return updated + len(rates)
+
+    def latest(self, count=None):
+        """
+        The last count bars in time order, as a copy_rates_from_pos shaped array
+        """
+        count = self.count if count is None else min(count, self.count)
+        first = (self.start + self.count - count) % self.capacity
+        if first + count <= self.capacity:
+            return np.array(self.data[first:first + count])
+        return np.concatenate([self.data[first:], self.data[:first + count - self.capacity]])
+
+    def refresh(self, source):
+        """
+        Bring the cache up to date from a MetaTrader5 module (or anything with the same calls)
+        Returns the number of bars added or updated
+        """
+        if self.count == 0:
+            rates = source.copy_rates_from_pos(self.symbol, self.timeframe, 0, self.capacity)
+        else:
+            rates = source.copy_rates_range(self.symbol, self.timeframe, self.last_time,
+                                            self.last_time + _RANGE_AHEAD)
+            if rates is None:
+                rates = source.copy_rates_from_pos(self.symbol, self.timeframe, 0, self.capacity)
+        if rates is None:
+            return None
+        return self.extend(rates)
+
+    def flush(self):
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+            self.meta.flush()
+
+
+class BarCacheStore:
+    """
+    One BarCache per symbol and timeframe, persisted under directory when it is given
+    """
+
+    def __init__(self, directory=None, capacity=500):
+        self.directory = directory
+        self.capacity = capacity
+        self.caches = {}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, symbol, timeframe):
+        key = (symbol, timeframe)
+        if key not in self.caches:
+            path = None
+            if self.directory is not None:
+                path = os.path.join(self.directory, f"{symbol}_{timeframe}.npy")
+            self.caches[key] = BarCache(symbol, timeframe, self.capacity, path)
+        return self.caches[key]
+
+    def flush(self):
+        for cache in self.caches.values():
+            cache.flush()
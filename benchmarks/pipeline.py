@@ -0,0 +1,258 @@
+"""
+Stage timings and peak memory of the signal pipeline on seeded synthetic bars
+
+Run from the repository root, no MetaTrader5 package or terminal needed:
+    python -m benchmarks.pipeline --output results.json
+    python -m benchmarks.pipeline --baseline results.json --threshold 0.2
+
+Every stage runs on synthetic_rates() arrays, the exact copy_rates_from_pos layout:
+frame (the DataFrame main.py builds), pandas and streaming indicators, validate_trend,
+analyze_trend_strength, signal generation, and the end-to-end cycle of many symbols.
+With --baseline the exit status is 1 when a stage got slower or bigger than the
+threshold allows, so a CI job can gate on it.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from indicators import IndicatorGraph
+from rates import synthetic_rates
+from signals import (analyze_trend_strength, crossover_signals, generate_signals, trend_strength,
+                     validate_trend, validate_trends)
+from strategies import CrossoverStrategy, TrendStrengthStrategy
+
+
+def make_frame(rates):
+    """
+    The DataFrame main.py builds from copy_rates_from_pos
+    """
+    frame = pd.DataFrame(rates)
+    frame['time'] = pd.to_datetime(frame['time'], unit='s')
+    frame.set_index('time', inplace=True)
+    return frame
+
+
+def pandas_indicators(frame):
+    """
+    The indicator columns of refinedmain.py and newtest.py, computed with pandas
+    """
+    close = frame['close']
+    frame['Median_Price'] = (frame['high'] + frame['low']) / 2
+    frame['EMA_Median_23'] = frame['Median_Price'].ewm(span=23, adjust=False).mean()
+    frame['EMA_Close_10'] = close.ewm(span=10, adjust=False).mean()
+    frame['EMA_10'] = frame['EMA_Close_10']
+    frame['EMA_20'] = close.ewm(span=20, adjust=False).mean()
+    frame['EMA_50'] = close.ewm(span=50, adjust=False).mean()
+    delta = close.diff()
+    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
+    frame['RSI'] = 100 - (100 / (1 + gain / loss))
+    frame['MACD'] = close.ewm(span=12, adjust=False).mean() - close.ewm(span=26, adjust=False).mean()
+    frame['Signal_Line'] = frame['MACD'].ewm(span=9, adjust=False).mean()
+    frame['ATR'] = (frame['high'] - frame['low']).rolling(window=14).mean()
+    return frame
+
+
+def streaming_indicators(rates):
+    # Both strategies on one graph, as the runner shares them per symbol
+    graph = IndicatorGraph()
+    CrossoverStrategy(graph=graph)
+    TrendStrengthStrategy(graph=graph)
+    graph.update_many(rates)
+    return graph
+
+
+def measure(func, repeat):
+    """
+    Run times in seconds and the peak traced memory of one extra run
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return times, peak
+
+
+def result(stage, bars, symbols, times, peak, **extra):
+    return dict({
+        'stage': stage,
+        'bars': bars,
+        'symbols': symbols,
+        'runs': len(times),
+        'best_s': min(times),
+        'median_s': statistics.median(times),
+        'p99_s': float(np.percentile(times, 99)),
+        'peak_kib': peak / 1024,
+    }, **extra)
+
+
+def bench_stages(bars, args):
+    """
+    Single symbol stages over a series of `bars` bars
+    """
+    rates = synthetic_rates(bars, seed=args.seed)
+    frame = pandas_indicators(make_frame(rates))
+    ema = frame['EMA_10'].to_numpy()
+    strength = trend_strength(frame)
+    stages = [
+        ('frame', lambda: make_frame(rates)),
+        ('indicators_pandas', lambda: pandas_indicators(make_frame(rates))),
+        ('validate_trend', lambda: (validate_trends(ema, 'bullish'), validate_trends(ema, 'bearish'))),
+        ('trend_strength', lambda: trend_strength(frame)),
+        ('signals', lambda: (generate_signals(strength),
+                             crossover_signals(frame['EMA_Close_10'], frame['EMA_Median_23']))),
+    ]
+    if bars <= args.streaming_max:
+        stages.append(('indicators_streaming', lambda: streaming_indicators(rates)))
+    if bars <= args.row_wise_max:
+        stages.append(('analyze_trend_strength', lambda: frame.apply(analyze_trend_strength, axis=1)))
+    results = []
+    for stage, func in stages:
+        times, peak = measure(func, args.repeat)
+        results.append(result(stage, bars, 1, times, peak))
+    return results
+
+
+def bench_cycle(symbols, args):
+    """
+    End-to-end latency of one bar close over `symbols` symbols: fetch-sized window in,
+    indicators, signal and exit decision out, with the streaming strategies
+    """
+    warm_up = 200
+    count = warm_up + args.cycles + 1
+    series = [synthetic_rates(count, seed=args.seed + n) for n in range(symbols)]
+    strategies = []
+    for rates in series:
+        graph = IndicatorGraph()
+        pair = (CrossoverStrategy(graph=graph), TrendStrengthStrategy(graph=graph))
+        for strategy in pair:
+            strategy.update(rates[:warm_up + 1], closed_only=True)
+        strategies.append(pair)
+
+    def cycle(end):
+        for rates, pair in zip(series, strategies):
+            window = rates[max(0, end - 100):end + 1]
+            for strategy in pair:
+                strategy.update(window, closed_only=True)
+                strategy.exit_sides()
+
+    times = []
+    for end in range(warm_up + 1, count - 1):
+        start = time.perf_counter()
+        cycle(end)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    cycle(count - 1)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result('cycle', 100, symbols, times, peak, per_symbol_s=statistics.median(times) / symbols)
+
+
+def bench_cycle_pandas(symbols, args):
+    """
+    The same bar close the way main.py / newtest.py compute it, a DataFrame per symbol
+    """
+    series = [synthetic_rates(60, seed=args.seed + n) for n in range(symbols)]
+
+    def cycle():
+        for rates in series:
+            frame = pandas_indicators(make_frame(rates[:-1]))
+            latest = frame.iloc[-1]
+            analyze_trend_strength(latest)
+            validate_trend(frame['EMA_Close_10'].iloc[-5:].tolist(), 'bullish')
+
+    times, peak = measure(cycle, max(1, min(args.repeat, args.cycles)))
+    return result('cycle_pandas', 60, symbols, times, peak, per_symbol_s=statistics.median(times) / symbols)
+
+
+def compare(results, baseline, threshold, min_delta):
+    """
+    Print every stage against the baseline, returns the regressions
+    """
+    previous = {(row['stage'], row['bars'], row['symbols']): row for row in baseline['results']}
+    # Best of the runs, the least noisy figure on a busy machine
+    regressions = []
+    print(f"\n{'stage':<24}{'bars':>10}{'symbols':>9}{'baseline ms':>14}{'now ms':>12}{'change':>9}")
+    for row in results:
+        key = (row['stage'], row['bars'], row['symbols'])
+        before = previous.get(key)
+        if before is None:
+            continue
+        change = row['best_s'] / before['best_s'] - 1 if before['best_s'] else 0.0
+        print(f"{key[0]:<24}{key[1]:>10}{key[2]:>9}{before['best_s'] * 1000:>14.3f}"
+              f"{row['best_s'] * 1000:>12.3f}{change:>+9.0%}")
+        if change > threshold and row['best_s'] - before['best_s'] > min_delta:
+            regressions.append(f"{key}: {change:+.0%} time")
+        memory = row['peak_kib'] / before['peak_kib'] - 1 if before['peak_kib'] else 0.0
+        if memory > threshold and row['peak_kib'] - before['peak_kib'] > 1024:
+            regressions.append(f"{key}: {memory:+.0%} peak memory")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--bars', type=int, nargs='+', default=[60, 1000, 100_000, 1_000_000])
+    parser.add_argument('--symbols', type=int, nargs='+', default=[1, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--cycles', type=int, default=20, help="bar closes timed per symbol count")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--streaming-max', type=int, default=200_000,
+                        help="largest series fed bar by bar to the streaming indicators")
+    parser.add_argument('--row-wise-max', type=int, default=10_000,
+                        help="largest series scored row by row with analyze_trend_strength")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="results JSON of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown, 0.2 is 20%%")
+    parser.add_argument('--min-delta', type=float, default=0.0001,
+                        help="seconds a stage must slow down by to count as a regression")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'stage':<24}{'bars':>10}{'symbols':>9}{'median ms':>12}{'p99 ms':>10}{'peak KiB':>12}")
+    runs = [(bench_stages, bars) for bars in args.bars]
+    runs += [(bench_cycle, symbols) for symbols in args.symbols]
+    runs += [(bench_cycle_pandas, symbols) for symbols in args.symbols]
+    for bench, size in runs:
+        rows = bench(size, args)
+        for row in rows if isinstance(rows, list) else [rows]:
+            results.append(row)
+            print(f"{row['stage']:<24}{row['bars']:>10}{row['symbols']:>9}{row['median_s'] * 1000:>12.3f}"
+                  f"{row['p99_s'] * 1000:>10.3f}{row['peak_kib']:>12.0f}")
+
+    report = {
+        'created': time.time(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'arguments': vars(args),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+        if regressions:
+            print("\nRegressions:\n" + "\n".join(regressions))
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == '__main__':
+    main()
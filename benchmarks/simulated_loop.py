@@ -0,0 +1,62 @@
+"""
+Drive the full runner loop against the simulated broker, no terminal needed
+
+Run from the repository root:
+    python -m benchmarks.simulated_loop --symbols 1000 --bars 50 --slippage 2 --latency 0.2
+"""
+import argparse
+import time
+
+import numpy as np
+
+from broker import SimulatedBroker
+from rates import synthetic_rates
+from runner import BotRunner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--symbols', type=int, default=1000)
+    parser.add_argument('--bars', type=int, default=50, help="bars to replay after the warm-up window")
+    parser.add_argument('--strategy', default='crossover')
+    parser.add_argument('--slippage', type=float, default=0, help="points")
+    parser.add_argument('--latency', type=float, default=0, help="seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    warm_up = 600
+    bars = {f"SIM{n:05d}": synthetic_rates(warm_up + args.bars + 1, seed=args.seed + n)
+            for n in range(args.symbols)}
+    broker = SimulatedBroker(bars, slippage=args.slippage, random_slippage=True, latency=args.latency,
+                             start=warm_up, seed=args.seed)
+    runner = BotRunner(0, None, broker=broker)
+    for symbol in bars:
+        runner.add(symbol, args.strategy)
+    runner.connect()
+
+    cycle_times = []
+    for _ in range(args.bars):
+        broker.step()
+        start = time.perf_counter()
+        for job in runner.jobs:
+            runner.evaluate(job)
+        cycle_times.append(time.perf_counter() - start)
+        # Orders of this bar fill before the clock moves on
+        runner.orders.join()
+    runner.orders.stop()
+
+    cycle_times = np.array(cycle_times[1:]) if len(cycle_times) > 1 else np.array(cycle_times)
+    evaluations = len(cycle_times) * args.symbols
+    orders = sum(1 for deal in broker.deals if deal['entry'] == 'in')
+    slippage = [abs(deal['price'] - deal['requested']) / broker.point for deal in broker.deals if deal['entry'] == 'in']
+    print(f"symbols: {args.symbols}, bars replayed: {args.bars}")
+    print(f"cycle p50: {np.percentile(cycle_times, 50) * 1000:.1f} ms, p99: {np.percentile(cycle_times, 99) * 1000:.1f} ms")
+    print(f"per symbol evaluation: {cycle_times.sum() / evaluations * 1e6:.0f} us")
+    print(f"orders filled: {orders}, mean slippage: {np.mean(slippage) if slippage else 0:.2f} points")
+    print(f"order latency: {runner.orders.stats()}")
+    print(f"account: {broker.account_info()}")
+    runner.metrics.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Row-wise analyze_trend_strength apply vs the vectorized trend_strength in signals.py
+
+Run from the repository root:
+    python -m benchmarks.trend_strength --sizes 100 10000 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from signals import analyze_trend_strength, generate_signal, generate_signals, trend_strength
+
+
+def make_frame(bars, seed=0):
+    """
+    Random walk closes with the indicator columns newtest.py computes
+    """
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({'close': 1.25 + np.cumsum(rng.normal(0, 0.0005, bars))})
+    frame['EMA_10'] = frame['close'].ewm(span=10, adjust=False).mean()
+    frame['EMA_20'] = frame['close'].ewm(span=20, adjust=False).mean()
+    frame['EMA_50'] = frame['close'].ewm(span=50, adjust=False).mean()
+    delta = frame['close'].diff()
+    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
+    frame['RSI'] = 100 - (100 / (1 + gain / loss))
+    frame['MACD'] = frame['close'].ewm(span=12, adjust=False).mean() - frame['close'].ewm(span=26, adjust=False).mean()
+    frame['Signal_Line'] = frame['MACD'].ewm(span=9, adjust=False).mean()
+    return frame
+
+
+def best_time(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def row_wise(frame):
+    strength = frame.apply(analyze_trend_strength, axis=1).to_numpy()
+    signals = [0] + [generate_signal(strength[i], strength[i - 1]) for i in range(1, len(strength))]
+    return strength, np.array(signals)
+
+
+def vectorized(frame):
+    strength = trend_strength(frame)
+    return strength, generate_signals(strength)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'bars':>10} {'apply (s)':>12} {'vectorized (s)':>15} {'speedup':>10}")
+    for bars in args.sizes:
+        frame = make_frame(bars)
+        # The row-wise version takes seconds on large frames, one run is enough there
+        slow, expected = best_time(lambda: row_wise(frame), 1 if bars > 100_000 else args.repeat)
+        fast, result = best_time(lambda: vectorized(frame), args.repeat)
+        if not (np.array_equal(expected[0], result[0]) and np.array_equal(expected[1], result[1])):
+            raise SystemExit(f"Vectorized scores differ from analyze_trend_strength at {bars} bars")
+        print(f"{bars:>10} {slow:>12.6f} {fast:>15.6f} {slow / fast:>9.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,228 @@
-from fastapi import FastAPI
+"""
+Control plane for the trading bots
+
+    uvicorn bot_api:app
+
+Every account gets a runner.BotRunner on its own thread, bots are symbol jobs added to
+and removed from it. The MetaTrader5 calls an endpoint needs go through the runner's
+terminal lock on a worker thread, so the event loop never waits on the terminal, and
+signals, fills and errors are pushed to /ws clients as they happen. Every runner also
+writes to the journal (JOURNAL_PATH, pipbot.db by default) that /journal/* queries.
+"""
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import BaseModel
+
+from broker import Broker
+from journal import Journal
+from runner import BotRunner
+from strategies import STRATEGIES
+load_dotenv()
+
+
+class BotConfig(BaseModel):
+    account: int
+    symbol: str
+    password: Optional[str] = None
+    server: str = "MetaQuotes-Demo"
+    strategy: str = "crossover"
+    timeframe: str = "M15"
+    lot_size: float = 0.01
+    sl_points: float = 100
+    tp_points: float = 200
+    dry_run: bool = True
+
+
+class EventHub:
+    """
+    Fans runner events out to the connected WebSocket clients
+    A client that falls behind loses its oldest events instead of slowing the others
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.clients = set()
+        self.loop = None
+
+    def subscribe(self):
+        queue = asyncio.Queue(self.size)
+        self.clients.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.clients.discard(queue)
+
+    def publish(self, event):
+        """
+        Called from the runner threads
+        """
+        if self.loop is not None and self.clients:
+            self.loop.call_soon_threadsafe(self._deliver, event)
+
+    def _deliver(self, event):
+        for queue in self.clients:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+
+class BotManager:
+    """
+    One BotRunner per account, started on the first bot and stopped with the last one
+    The MetaTrader5 package keeps one terminal session per process and a second login
+    replaces the first, so without a broker_factory only one account runs at a time;
+    broker_factory(account) supplies the broker of each runner otherwise.
+    """
+
+    def __init__(self, hub, broker_factory=None, workers=4, cache_dir=None, journal=None):
+        self.hub = hub
+        self.journal = journal
+        self.broker_factory = broker_factory
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self.runners = {}
+        self.threads = {}
+        self.bots = {}
+        # Account -> the runner logging in, connect() runs outside the lock
+        self.starting = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(account, symbol, timeframe="M15", strategy="crossover"):
+        return f"{account}:{symbol}:{timeframe}:{strategy}"
+
+    def start(self, config):
+        """
+        Add the bot, logging its account in first when it is the account's first bot
+        Blocks on the terminal, call it off the event loop
+        """
+        key = self.key(config.account, config.symbol, config.timeframe, config.strategy)
+        if config.strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy {config.strategy}")
+        timeframe = getattr(Broker, f"TIMEFRAME_{config.timeframe}", None)
+        if timeframe is None:
+            raise ValueError(f"Unknown timeframe {config.timeframe}")
+
+        with self.lock:
+            if key in self.bots:
+                raise KeyError(f"{key} is already running")
+            if config.account in self.starting:
+                raise KeyError(f"Account {config.account} is still logging in")
+            runner = self.runners.get(config.account)
+            if runner is not None:
+                job = runner.add(config.symbol, config.strategy, timeframe, lot_size=config.lot_size,
+                                 sl_points=config.sl_points, tp_points=config.tp_points, trade=not config.dry_run)
+                self.bots[key] = (runner, job)
+                return key
+            if self.broker_factory is None and (self.runners or self.starting):
+                account = next(iter(self.runners or self.starting))
+                raise KeyError(f"The terminal is logged in to account {account}, "
+                               f"stop its bots before starting account {config.account}")
+            broker = self.broker_factory(config.account) if self.broker_factory else None
+            runner = BotRunner(config.account, config.password or os.getenv("PASSWORD"), config.server,
+                               workers=self.workers, cache_dir=self.cache_dir, broker=broker)
+            job = runner.add(config.symbol, config.strategy, timeframe, lot_size=config.lot_size,
+                             sl_points=config.sl_points, tp_points=config.tp_points, trade=not config.dry_run)
+            self.starting[config.account] = runner
+
+        # The login blocks on the terminal, the other accounts' bots are served meanwhile
+        connected = False
+        try:
+            connected = runner.connect()
+        finally:
+            if not connected:
+                runner.orders.stop()
+                with self.lock:
+                    self.starting.pop(config.account, None)
+        if not connected:
+            raise ConnectionError(f"Login to account {config.account} on {config.server} failed")
+
+        runner.listeners.append(self.hub.publish)
+        if self.journal is not None:
+            runner.listeners.append(self.journal.record)
+        with self.lock:
+            del self.starting[config.account]
+            self.runners[config.account] = runner
+            thread = threading.Thread(target=runner.run, kwargs={'connect': False},
+                                      name=f"runner-{config.account}", daemon=True)
+            self.threads[config.account] = thread
+            thread.start()
+            self.bots[key] = (runner, job)
+        return key
+
+    def get(self, key):
+        bot = self.bots.get(key)
+        if bot is None:
+            raise KeyError(f"{key} is not running")
+        return bot
+
+    def stop(self, key):
+        thread = None
+        with self.lock:
+            runner, job = self.bots.pop(key, (None, None))
+            if runner is None:
+                raise KeyError(f"{key} is not running")
+            runner.remove(job)
+            if not any(other is runner for other, _ in self.bots.values()):
+                thread = self._stop_runner(runner)
+        # The terminal is shut down before another runner can log in to it
+        if thread is not None:
+            thread.join(timeout=10)
+
+    def _stop_runner(self, runner):
+        runner.stop()
+        self.runners.pop(runner.account_number, None)
+        thread = self.threads.pop(runner.account_number, None)
+        return thread
+
+    def stop_all(self):
+        with self.lock:
+            threads = [self._stop_runner(runner) for runner in list(self.runners.values())]
+            self.bots.clear()
+        for thread in threads:
+            if thread is not None:
+                thread.join(timeout=10)
+
+    def status(self):
+        return [
+            {
+                'bot': key,
+                'job': job.name,
+                'running': runner.running and job.active,
+                'last_bar_time': job.last_bar_time,
+                'signal': job.strategy.signal,
+                'failures': job.failures,
+                'last_error': job.last_error,
+            }
+            for key, (runner, job) in list(self.bots.items())
+        ]
+
+
+hub = EventHub()
+journal = Journal(os.getenv("JOURNAL_PATH", "pipbot.db"))
+manager = BotManager(hub, journal=journal)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    hub.loop = asyncio.get_running_loop()
+    journal.start()
+    yield
+    await asyncio.to_thread(manager.stop_all)
+    await asyncio.to_thread(journal.close)
 
 
 app = FastAPI(
     title="PipBot Version 1.0",
     version="1.0.0",
-    description="Forex Trading Bot API - authored by seyiadel"
+    description="Forex Trading Bot API - authored by seyiadel",
+    lifespan=lifespan,
 )
 
 @app.get("/")
@@ -12,5 +230,120 @@ def intro():
     return "Welcome to Pipbot Trading Bot API v1.0"
 
 
+def _plain(value):
+    # numpy scalars and MetaTrader5 named tuples to JSON friendly values
+    if hasattr(value, '_asdict'):
+        return {name: _plain(item) for name, item in value._asdict().items()}
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+@app.get("/bots")
+async def list_bots():
+    return manager.status()
+
+
+@app.post("/bots", status_code=201)
+async def start_bot(config: BotConfig):
+    try:
+        key = await asyncio.to_thread(manager.start, config)
+    except KeyError as e:
+        raise HTTPException(status_code=409, detail=str(e.args[0]))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ConnectionError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    return {'bot': key}
+
+
+@app.delete("/bots/{account}/{symbol}")
+async def stop_bot(account: int, symbol: str, timeframe: str = "M15", strategy: str = "crossover"):
+    key = manager.key(account, symbol, timeframe, strategy)
+    try:
+        await asyncio.to_thread(manager.stop, key)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return {'stopped': key}
+
+
+@app.get("/bots/{account}/{symbol}/indicators")
+async def bot_indicators(account: int, symbol: str, timeframe: str = "M15", strategy: str = "crossover"):
+    try:
+        _, job = manager.get(manager.key(account, symbol, timeframe, strategy))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    values = job.strategy.values() if job.strategy.bar_time is not None else {}
+    return {
+        'bar_time': job.strategy.bar_time,
+        'signal': job.strategy.signal,
+        'values': {name: _plain(value) for name, value in (values or {}).items()},
+    }
+
+
+@app.get("/bots/{account}/{symbol}/positions")
+async def bot_positions(account: int, symbol: str, timeframe: str = "M15", strategy: str = "crossover"):
+    try:
+        runner, _ = manager.get(manager.key(account, symbol, timeframe, strategy))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    positions = await asyncio.to_thread(runner.call, runner.broker.positions_get, symbol=symbol)
+    return [_plain(position) for position in positions or ()]
+
+
+@app.get("/metrics")
+async def metrics():
+    return {account: runner.metrics.summary() for account, runner in list(manager.runners.items())}
+
+
+def _journal_query(query, account, symbol, start, end, by):
+    if by not in (None, 'account', 'symbol'):
+        raise HTTPException(status_code=400, detail=f"Cannot group by {by}")
+    return asyncio.to_thread(query, account=account, symbol=symbol, start=start, end=end, by=by)
+
+
+@app.get("/journal/pnl")
+async def journal_pnl(account: Optional[int] = None, symbol: Optional[str] = None, start: Optional[float] = None,
+                      end: Optional[float] = None, by: Optional[str] = None):
+    """
+    Realized profit of the positions closed in [start, end), epoch seconds in server time
+    """
+    return await _journal_query(journal.pnl, account, symbol, start, end, by)
+
+
+@app.get("/journal/hit-rate")
+async def journal_hit_rate(account: Optional[int] = None, symbol: Optional[str] = None,
+                           start: Optional[float] = None, end: Optional[float] = None, by: Optional[str] = None):
+    return await _journal_query(journal.hit_rate, account, symbol, start, end, by)
+
+
+@app.get("/journal/slippage")
+async def journal_slippage(account: Optional[int] = None, symbol: Optional[str] = None,
+                           start: Optional[float] = None, end: Optional[float] = None, by: Optional[str] = None):
+    return await _journal_query(journal.slippage, account, symbol, start, end, by)
+
+
+@app.get("/journal/trades/{ticket}")
+async def journal_trade(ticket: int, account: Optional[int] = None):
+    trade = await asyncio.to_thread(journal.trade, ticket, account)
+    if not trade['orders'] and not trade['closes']:
+        raise HTTPException(status_code=404, detail=f"No journal rows for ticket {ticket}")
+    return trade
+
+
+@app.websocket("/ws")
+async def feed(websocket: WebSocket):
+    await websocket.accept()
+    queue = hub.subscribe()
+    try:
+        while True:
+            event = await queue.get()
+            await websocket.send_json({name: _plain(value) for name, value in event.items()})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(queue)
+
+
 def bot_api():
-    return
\ No newline at end of file
+    return app
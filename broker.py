@@ -0,0 +1,469 @@
+"""
+Broker interface used by the bot: the subset of the MetaTrader5 API it calls
+
+MT5Broker forwards to the MetaTrader5 package (Windows, needs a terminal).
+SimulatedBroker replays recorded bars/ticks in process, so the full loop can run
+and be load-tested on any machine.
+"""
+import collections
+import time
+
+import numpy as np
+
+from orders import close_position
+from rates import TIMEFRAME_SECONDS
+
+# MetaTrader5 result and record types, same fields as the terminal returns
+SymbolInfo = collections.namedtuple('SymbolInfo', [
+    'name', 'point', 'digits', 'spread', 'trade_contract_size', 'filling_mode',
+    'volume_min', 'volume_max', 'volume_step', 'currency_base', 'currency_profit', 'currency_margin',
+])
+Tick = collections.namedtuple('Tick', ['time', 'bid', 'ask', 'last', 'volume', 'time_msc', 'flags', 'volume_real'])
+TradePosition = collections.namedtuple('TradePosition', [
+    'ticket', 'time', 'time_msc', 'time_update', 'type', 'magic', 'identifier', 'volume',
+    'price_open', 'sl', 'tp', 'price_current', 'swap', 'profit', 'symbol', 'comment',
+])
+OrderSendResult = collections.namedtuple('OrderSendResult', [
+    'retcode', 'deal', 'order', 'volume', 'price', 'bid', 'ask', 'comment', 'request_id', 'request',
+])
+TradeDeal = collections.namedtuple('TradeDeal', [
+    'ticket', 'order', 'time', 'time_msc', 'type', 'entry', 'magic', 'position_id', 'reason', 'volume',
+    'price', 'commission', 'swap', 'profit', 'fee', 'symbol', 'comment', 'external_id',
+])
+AccountInfo = collections.namedtuple('AccountInfo', [
+    'login', 'server', 'currency', 'leverage', 'balance', 'equity', 'profit', 'margin', 'margin_free',
+])
+
+
+class Broker:
+    """
+    The calls the bot makes, with the MetaTrader5 constant values
+    """
+
+    TIMEFRAME_M1 = 1
+    TIMEFRAME_M5 = 5
+    TIMEFRAME_M15 = 15
+    TIMEFRAME_M30 = 30
+    TIMEFRAME_H1 = 16385
+    TIMEFRAME_H4 = 16388
+    TIMEFRAME_D1 = 16408
+
+    ORDER_TYPE_BUY = 0
+    ORDER_TYPE_SELL = 1
+    POSITION_TYPE_BUY = 0
+    POSITION_TYPE_SELL = 1
+    TRADE_ACTION_DEAL = 1
+    ORDER_TIME_GTC = 0
+    ORDER_FILLING_FOK = 0
+    ORDER_FILLING_IOC = 1
+    ORDER_FILLING_RETURN = 2
+    # symbol_info().filling_mode flags
+    SYMBOL_FILLING_FOK = 1
+    SYMBOL_FILLING_IOC = 2
+
+    DEAL_TYPE_BUY = 0
+    DEAL_TYPE_SELL = 1
+    DEAL_ENTRY_IN = 0
+    DEAL_ENTRY_OUT = 1
+    DEAL_REASON_CLIENT = 0
+    DEAL_REASON_EXPERT = 3
+    DEAL_REASON_SL = 4
+    DEAL_REASON_TP = 5
+
+    TRADE_RETCODE_REQUOTE = 10004
+    TRADE_RETCODE_REJECT = 10006
+    TRADE_RETCODE_DONE = 10009
+    TRADE_RETCODE_INVALID = 10013
+    TRADE_RETCODE_INVALID_FILL = 10030
+    TRADE_RETCODE_MARKET_CLOSED = 10018
+    TRADE_RETCODE_PRICE_CHANGED = 10020
+    TRADE_RETCODE_PRICE_OFF = 10021
+    TRADE_RETCODE_POSITION_CLOSED = 10036
+
+    def initialize(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def login(self, login, password=None, server=None, timeout=None):
+        raise NotImplementedError
+
+    def shutdown(self):
+        raise NotImplementedError
+
+    def account_info(self):
+        raise NotImplementedError
+
+    def symbol_info(self, symbol):
+        raise NotImplementedError
+
+    def symbol_info_tick(self, symbol):
+        raise NotImplementedError
+
+    def copy_rates_from_pos(self, symbol, timeframe, start_pos, count):
+        raise NotImplementedError
+
+    def copy_rates_range(self, symbol, timeframe, date_from, date_to):
+        raise NotImplementedError
+
+    def order_send(self, request):
+        raise NotImplementedError
+
+    def positions_get(self, symbol=None, ticket=None):
+        raise NotImplementedError
+
+    def positions_close(self, ticket):
+        raise NotImplementedError
+
+    def history_deals_get(self, date_from=None, date_to=None, position=None):
+        """
+        Deals of one position, or of every position between two server times
+        """
+        raise NotImplementedError
+
+    def time(self):
+        """
+        Local clock the schedulers should use with this broker
+        """
+        return time.time()
+
+
+class MT5Broker(Broker):
+    """
+    The MetaTrader5 package behind the Broker interface
+    """
+
+    def __init__(self):
+        import MetaTrader5
+
+        self.mt = MetaTrader5
+
+    def __getattr__(self, name):
+        # Constants and calls outside the interface go straight to the package
+        return getattr(self.mt, name)
+
+    def initialize(self, *args, **kwargs):
+        return self.mt.initialize(*args, **kwargs)
+
+    def login(self, login, password=None, server=None, timeout=None):
+        kwargs = {'password': password, 'server': server, 'timeout': timeout}
+        return self.mt.login(login=login, **{key: value for key, value in kwargs.items() if value is not None})
+
+    def shutdown(self):
+        return self.mt.shutdown()
+
+    def account_info(self):
+        return self.mt.account_info()
+
+    def symbol_info(self, symbol):
+        return self.mt.symbol_info(symbol)
+
+    def symbol_info_tick(self, symbol):
+        return self.mt.symbol_info_tick(symbol)
+
+    def copy_rates_from_pos(self, symbol, timeframe, start_pos, count):
+        return self.mt.copy_rates_from_pos(symbol, timeframe, start_pos, count)
+
+    def copy_rates_range(self, symbol, timeframe, date_from, date_to):
+        return self.mt.copy_rates_range(symbol, timeframe, date_from, date_to)
+
+    def order_send(self, request):
+        return self.mt.order_send(request)
+
+    def positions_get(self, symbol=None, ticket=None):
+        if ticket is not None:
+            return self.mt.positions_get(ticket=ticket)
+        if symbol is not None:
+            return self.mt.positions_get(symbol=symbol)
+        return self.mt.positions_get()
+
+    def history_deals_get(self, date_from=None, date_to=None, position=None):
+        if position is not None:
+            return self.mt.history_deals_get(position=position)
+        return self.mt.history_deals_get(date_from, date_to)
+
+    def positions_close(self, ticket):
+        positions = self.mt.positions_get(ticket=ticket)
+        if not positions:
+            return None
+        return close_position(self.mt, positions[0])
+
+
+class SimulatedBroker(Broker):
+    """
+    Deterministic in-process broker replaying recorded bars, and ticks when given
+
+    bars maps each symbol to a copy_rates_from_pos shaped array of one timeframe.
+    The simulated server clock starts at the open of bar `start` of the first symbol and
+    only moves with advance() / step(); a bar appears once its open time is reached, as a
+    flat bar at its open price until it closes. Without recorded ticks the bid is the open
+    of the current bar and the ask adds its spread. Orders fill at the quote `latency`
+    seconds after they are sent, moved against the trader by `slippage` points (a uniform
+    random amount up to it when random_slippage is set), and are requoted when that
+    exceeds the request deviation. filling_mode holds the SYMBOL_FILLING_* flags every
+    symbol allows, a request with another type_filling is refused.
+    """
+
+    def __init__(self, bars, timeframe=Broker.TIMEFRAME_M15, ticks=None, point=0.00001, digits=5,
+                 contract_size=100000, slippage=0, random_slippage=False, latency=0.0, start=100,
+                 balance=10000.0, leverage=100, seed=0, filling_mode=Broker.SYMBOL_FILLING_IOC):
+        self.bars = {symbol: np.asarray(rates) for symbol, rates in bars.items()}
+        self.ticks = ticks or {}
+        self.timeframe = timeframe
+        self.bar_seconds = TIMEFRAME_SECONDS[timeframe]
+        self.point = point
+        self.digits = digits
+        self.contract_size = contract_size
+        self.slippage = slippage
+        self.random_slippage = random_slippage
+        self.latency = latency
+        self.filling_mode = filling_mode
+        self.leverage = leverage
+        self.balance = balance
+        self.rng = np.random.default_rng(seed)
+        first = next(iter(self.bars.values()))
+        self.now = int(first['time'][min(start, len(first) - 1)])
+        self.positions = {}
+        self.deals = []
+        self.next_ticket = 1
+        self.connected = False
+        self.login_id = 0
+        self.server = 'Simulated'
+
+    # Clock
+
+    def time(self):
+        return float(self.now)
+
+    def advance(self, seconds):
+        """
+        Move the server clock forward, closing positions whose SL or TP was reached
+        """
+        target = self.now + seconds
+        for position in list(self.positions.values()):
+            self._check_stops(position, self.now, target)
+        self.now = target
+
+    def step(self):
+        """
+        Move to the open of the next bar
+        """
+        self.advance(self.bar_seconds - self.now % self.bar_seconds)
+
+    def sleep(self, seconds):
+        self.advance(int(np.ceil(seconds)))
+
+    # Session
+
+    def initialize(self, *args, **kwargs):
+        self.connected = True
+        return True
+
+    def login(self, login, password=None, server=None, timeout=None):
+        self.login_id = login
+        self.server = server or self.server
+        return self.connected
+
+    def shutdown(self):
+        self.connected = False
+
+    def account_info(self):
+        profit = sum(self._profit(position) for position in self.positions.values())
+        margin = sum(position.volume * self.contract_size * position.price_open / self.leverage
+                     for position in self.positions.values())
+        equity = self.balance + profit
+        return AccountInfo(self.login_id, self.server, 'USD', self.leverage, self.balance, equity, profit,
+                           margin, equity - margin)
+
+    # Market data
+
+    def _opened(self, rates):
+        """
+        Number of bars opened so far
+        """
+        return int(np.searchsorted(rates['time'], self.now, side='right'))
+
+    def _hide_forming(self, bars):
+        """
+        The bar still forming only shows its open price
+        """
+        if len(bars) and bars[-1]['time'] + self.bar_seconds > self.now:
+            forming = bars[-1:]
+            forming['high'] = forming['low'] = forming['close'] = forming['open']
+            forming['tick_volume'] = forming['real_volume'] = 0
+        return bars
+
+    def _quote(self, symbol, at):
+        ticks = self.ticks.get(symbol)
+        if ticks is not None:
+            index = np.searchsorted(ticks['time_msc'], int(at * 1000), side='right') - 1
+            if index >= 0:
+                return float(ticks[index]['bid']), float(ticks[index]['ask'])
+        rates = self.bars[symbol]
+        index = np.searchsorted(rates['time'], at, side='right') - 1
+        if index < 0:
+            return None
+        bid = float(rates[index]['open'])
+        return bid, bid + int(rates[index]['spread']) * self.point
+
+    def symbol_info(self, symbol):
+        rates = self.bars.get(symbol)
+        if rates is None:
+            return None
+        spread = int(rates[max(self._opened(rates) - 1, 0)]['spread'])
+        return SymbolInfo(symbol, self.point, self.digits, spread, self.contract_size,
+                          self.filling_mode, 0.01, 100.0, 0.01, symbol[:3], symbol[3:], symbol[:3])
+
+    def symbol_info_tick(self, symbol):
+        if symbol not in self.bars:
+            return None
+        quote = self._quote(symbol, self.now)
+        if quote is None:
+            return None
+        return Tick(self.now, quote[0], quote[1], 0.0, 0, self.now * 1000, 0, 0.0)
+
+    def copy_rates_from_pos(self, symbol, timeframe, start_pos, count):
+        rates = self.bars.get(symbol)
+        if rates is None or timeframe != self.timeframe:
+            return None
+        end = max(0, self._opened(rates) - start_pos)
+        return self._hide_forming(rates[max(0, end - count):end].copy())
+
+    def copy_rates_range(self, symbol, timeframe, date_from, date_to):
+        rates = self.bars.get(symbol)
+        if rates is None or timeframe != self.timeframe:
+            return None
+        first = int(np.searchsorted(rates['time'], int(date_from), side='left'))
+        end = min(self._opened(rates), int(np.searchsorted(rates['time'], int(date_to), side='right')))
+        return self._hide_forming(rates[first:max(first, end)].copy())
+
+    # Trading
+
+    def _result(self, retcode, request, price=0.0, volume=0.0, ticket=0, comment=''):
+        quote = self._quote(request['symbol'], self.now) if request.get('symbol') in self.bars else None
+        bid, ask = quote or (0.0, 0.0)
+        return OrderSendResult(retcode, ticket, ticket, volume, price, bid, ask, comment, 0, request)
+
+    def order_send(self, request):
+        symbol = request['symbol']
+        if symbol not in self.bars:
+            return self._result(self.TRADE_RETCODE_INVALID, request, comment='Invalid symbol')
+        if not self._filling_allowed(request.get('type_filling', self.ORDER_FILLING_FOK)):
+            return self._result(self.TRADE_RETCODE_INVALID_FILL, request, comment='Unsupported filling mode')
+        if request.get('position'):
+            return self._close(request['position'], request)
+
+        is_buy = request['type'] == self.ORDER_TYPE_BUY
+        quote = self._quote(symbol, self.now + self.latency)
+        if quote is None:
+            return self._result(self.TRADE_RETCODE_MARKET_CLOSED, request, comment='Market closed')
+        slippage = self.rng.uniform(0, self.slippage) if self.random_slippage else self.slippage
+        market = quote[1] if is_buy else quote[0]
+        price = market + slippage * self.point if is_buy else market - slippage * self.point
+
+        # The fill has to stay within `deviation` points of the requested price
+        requested = request.get('price') or market
+        if abs(price - requested) > request.get('deviation', 0) * self.point + 1e-12:
+            return self._result(self.TRADE_RETCODE_REQUOTE, request, comment='Requote')
+
+        ticket = self.next_ticket
+        self.next_ticket += 1
+        position = TradePosition(ticket, self.now, self.now * 1000, self.now,
+                                 self.POSITION_TYPE_BUY if is_buy else self.POSITION_TYPE_SELL,
+                                 request.get('magic', 0), ticket, request['volume'], price,
+                                 request.get('sl', 0.0), request.get('tp', 0.0), price, 0.0, 0.0,
+                                 symbol, request.get('comment', ''))
+        self.positions[ticket] = position
+        self.deals.append({'deal': len(self.deals) + 1, 'ticket': ticket, 'symbol': symbol, 'time': self.now,
+                           'type': position.type, 'entry': 'in', 'volume': position.volume, 'price': price,
+                           'requested': requested, 'profit': 0.0, 'magic': position.magic,
+                           'comment': position.comment})
+        return self._result(self.TRADE_RETCODE_DONE, request, price, position.volume, ticket, 'Request executed')
+
+    def _filling_allowed(self, filling):
+        if filling == self.ORDER_FILLING_IOC:
+            return bool(self.filling_mode & self.SYMBOL_FILLING_IOC)
+        if filling == self.ORDER_FILLING_FOK:
+            return bool(self.filling_mode & self.SYMBOL_FILLING_FOK)
+        return not self.filling_mode & (self.SYMBOL_FILLING_FOK | self.SYMBOL_FILLING_IOC)
+
+    def _close_price(self, position, at):
+        bid, ask = self._quote(position.symbol, at)
+        return bid if position.type == self.POSITION_TYPE_BUY else ask
+
+    def _profit(self, position, price=None):
+        if price is None:
+            price = self._close_price(position, self.now)
+        direction = 1 if position.type == self.POSITION_TYPE_BUY else -1
+        return direction * (price - position.price_open) * position.volume * self.contract_size
+
+    def _close(self, ticket, request=None, price=None, reason='out'):
+        position = self.positions.pop(ticket, None)
+        request = request or {'symbol': position.symbol if position else None, 'position': ticket}
+        if position is None:
+            return self._result(self.TRADE_RETCODE_POSITION_CLOSED, request, comment='Position not found')
+        if price is None:
+            price = self._close_price(position, self.now + self.latency)
+        profit = self._profit(position, price)
+        self.balance += profit
+        self.deals.append({'deal': len(self.deals) + 1, 'ticket': ticket, 'symbol': position.symbol,
+                           'time': self.now, 'type': position.type, 'entry': reason, 'volume': position.volume,
+                           'price': price, 'requested': price, 'profit': profit, 'magic': position.magic,
+                           'comment': request.get('comment', '') if reason == 'out' else f"[{reason} {price}]"})
+        return self._result(self.TRADE_RETCODE_DONE, request, price, position.volume, ticket, 'Request executed')
+
+    def _check_stops(self, position, start, end):
+        # Bars that closed between start and end
+        rates = self.bars[position.symbol]
+        times = rates['time']
+        window = rates[np.searchsorted(times, start - self.bar_seconds, side='right'):
+                       np.searchsorted(times, end - self.bar_seconds, side='right')]
+        if not len(window):
+            return
+        spread = window['spread'] * self.point
+        no_stop = np.zeros(len(window), dtype=bool)
+        if position.type == self.POSITION_TYPE_BUY:
+            sl_hit = window['low'] <= position.sl if position.sl else no_stop
+            tp_hit = window['high'] >= position.tp if position.tp else no_stop
+        else:
+            sl_hit = window['high'] + spread >= position.sl if position.sl else no_stop
+            tp_hit = window['low'] + spread <= position.tp if position.tp else no_stop
+        hits = sl_hit | tp_hit
+        if hits.any():
+            index = int(hits.argmax())
+            # SL first when both are inside one bar
+            if sl_hit[index]:
+                self._close(position.ticket, price=position.sl, reason='sl')
+            else:
+                self._close(position.ticket, price=position.tp, reason='tp')
+
+    def positions_get(self, symbol=None, ticket=None):
+        positions = self.positions.values()
+        if ticket is not None:
+            positions = [position for position in positions if position.ticket == ticket]
+        elif symbol is not None:
+            positions = [position for position in positions if position.symbol == symbol]
+        return tuple(self._with_price(position) for position in positions)
+
+    def _with_price(self, position):
+        price = self._close_price(position, self.now)
+        return position._replace(price_current=price, profit=self._profit(position, price))
+
+    def history_deals_get(self, date_from=None, date_to=None, position=None):
+        if position is not None:
+            deals = [deal for deal in self.deals if deal['ticket'] == position]
+        else:
+            deals = [deal for deal in self.deals if date_from <= deal['time'] <= date_to]
+        reasons = {'sl': self.DEAL_REASON_SL, 'tp': self.DEAL_REASON_TP}
+        return tuple(
+            TradeDeal(deal['deal'], deal['ticket'], deal['time'], deal['time'] * 1000,
+                      deal['type'] if deal['entry'] == 'in' else 1 - deal['type'],
+                      self.DEAL_ENTRY_IN if deal['entry'] == 'in' else self.DEAL_ENTRY_OUT, deal['magic'],
+                      deal['ticket'], reasons.get(deal['entry'], self.DEAL_REASON_EXPERT), deal['volume'],
+                      deal['price'], 0.0, 0.0, deal['profit'], 0.0, deal['symbol'], deal['comment'], '')
+            for deal in deals)
+
+    def positions_close(self, ticket):
+        # The same opposite deal MT5Broker sends, so its request is checked here too
+        position = self.positions.get(ticket)
+        if position is None:
+            return self._close(ticket)
+        return close_position(self, position, filling_mode=self.filling_mode)
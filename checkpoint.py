@@ -0,0 +1,111 @@
+"""
+Warm restarts: indicator and strategy state saved to a local file and loaded on start
+
+EMAs with adjust=False only settle after many bars, so a bot rebuilding its indicators
+from a short lookback window signals differently from one that kept running. A
+checkpoint keeps every indicator accumulator, the last evaluated bar and signal of each
+strategy and the last position snapshot. On start the bars missed while the bot was down
+(the bar cache's delta fetch, or copy_rates_range when the cache does not reach back that
+far) are fed on top of it, and the positions are reconciled against positions_get().
+
+    state = checkpoint.capture(strategy, scheduler, book)
+    checkpoint.save(path, state)
+    ...
+    state = checkpoint.load(path)
+    checkpoint.resume(state, strategy, scheduler, cache.latest(), fetch=fetch)
+"""
+import os
+import pickle
+import time
+
+VERSION = 1
+
+
+def save(path, state):
+    """
+    Write state atomically, a crash while saving leaves the previous checkpoint in place
+    """
+    state = dict(state, version=VERSION, saved=time.time())
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+
+def load(path):
+    """
+    The saved state, None when there is none or it cannot be used
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+    except Exception as e:
+        print(f"Ignoring checkpoint {path}: {e}")
+        return None
+    if not isinstance(state, dict) or state.get('version') != VERSION:
+        print(f"Ignoring checkpoint {path}: written by another version")
+        return None
+    return state
+
+
+def strategy_state(strategy, scheduler):
+    """
+    The strategy's own fields (strategy.state_fields) and the last bar its scheduler saw
+    """
+    return {
+        'strategy': {name: getattr(strategy, name) for name in strategy.state_fields},
+        'last_bar_time': scheduler.last_bar_time,
+    }
+
+
+def resume_graph(graph, state, cached, fetch=None):
+    """
+    Load a graph's saved state and feed it the cached bars it has not seen
+    cached is the bar cache including the forming bar. When it does not reach back to the
+    checkpoint, fetch(date_from, date_to) (e.g. a copy_rates_range) gets the bars from the
+    checkpoint's last bar to the forming one; without them the graph is left cold and
+    False returned.
+    """
+    last_time = state['last_time']
+    if last_time is None or not len(cached):
+        return False
+    if int(cached[0]['time']) > last_time:
+        missed = fetch(last_time, int(cached[-1]['time'])) if fetch is not None else None
+        if missed is None or not len(missed) or int(missed[0]['time']) > last_time:
+            return False
+        cached = missed
+    graph.load_state(state)
+    graph.update_many(cached[:-1])
+    return True
+
+
+def resume_strategy(strategy, scheduler, state):
+    for name, value in state['strategy'].items():
+        setattr(strategy, name, value)
+    scheduler.last_bar_time = state['last_bar_time']
+
+
+def capture(strategy, scheduler, book=None, **extra):
+    """
+    Checkpoint of a single strategy bot (refinedmain.py, newtest.py)
+    """
+    state = dict(extra, graph=strategy.engine.graph.state(), **strategy_state(strategy, scheduler))
+    if book is not None:
+        state['positions'] = book.state()
+    return state
+
+
+def resume(state, strategy, scheduler, cached, book=None, fetch=None):
+    """
+    Continue a single strategy bot from capture(), returns False for a cold start
+    The position snapshot is loaded so the next book.refresh() reports what changed
+    while the bot was down. fetch is resume_graph()'s.
+    """
+    if book is not None and state.get('positions') is not None:
+        book.load_state(state['positions'])
+    if not resume_graph(strategy.engine.graph, state['graph'], cached, fetch):
+        return False
+    resume_strategy(strategy, scheduler, state)
+    return True
@@ -0,0 +1,469 @@
+"""
+Mirror one set of signals onto many accounts
+
+    python fanout.py accounts.json XAUUSD GBPUSD:trend EURUSD:crossover:H1
+
+Signals are computed once per symbol by a BotRunner on the data account (no orders of
+its own) and broadcast as order intents to one worker process per account. The
+MetaTrader5 package drives a single terminal per process, so every worker initializes
+its own terminal (the "path" of its account entry) and logs in there. The supervisor
+restarts a worker that died or stopped sending heartbeats, and measures the time from
+signal to each account's fill and to the last account's fill. With a risk.RiskEngine
+the volume of every account is sized and checked in one pass before an intent goes out.
+
+accounts.json is a list of {"login": ..., "password": ..., "server": ..., "path": ...,
+"lot_size": ...}, lot_size overriding the job's lot size for that account.
+"""
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from broker import Broker, MT5Broker
+from metrics import Metrics
+from orders import SymbolCache, place_market_order
+from positions import PositionBook
+from risk import REASONS
+from runner import BotRunner, add_risk_arguments, risk_engine
+load_dotenv()
+
+
+def account_worker(account, intents, results, broker_factory=None, heartbeat=1.0):
+    """
+    Worker process of one account: logs in to its own terminal and executes every intent
+    Results go back as tuples: ('ready'|'heartbeat', login, time, equity, leverage, held),
+    ('failed', login, reason) and ('done', login, intent id, received, finished, retcode, detail),
+    held being the (symbol, magic, type) of every open position.
+    """
+    login = account['login']
+    broker = broker_factory(account) if broker_factory else MT5Broker()
+    if not broker.initialize(**({'path': account['path']} if account.get('path') else {})):
+        results.put(('failed', login, "MT5 initialization failed"))
+        return
+    if not broker.login(login=login, password=account.get('password'), server=account.get('server')):
+        results.put(('failed', login, "Login failed"))
+        broker.shutdown()
+        return
+
+    symbols = SymbolCache(broker)
+    book = PositionBook(broker)
+    results.put(('ready', login, time.time()) + _account_state(broker, book))
+    beat = time.monotonic()
+    try:
+        while True:
+            try:
+                intent = intents.get(timeout=heartbeat)
+            except queue.Empty:
+                intent = False
+            if time.monotonic() - beat >= heartbeat:
+                results.put(('heartbeat', login, time.time()) + _account_state(broker, book))
+                beat = time.monotonic()
+            if intent is None:
+                return
+            if intent is False:
+                continue
+            received = time.time()
+            if received > intent['expires']:
+                results.put(('done', login, intent['id'], received, received, None, "expired"))
+                continue
+            try:
+                retcode, detail = _execute(broker, symbols, book, account, intent)
+            except Exception as e:
+                retcode, detail = None, str(e)
+            results.put(('done', login, intent['id'], received, time.time(), retcode, detail))
+    finally:
+        broker.shutdown()
+
+
+def _account_state(broker, book):
+    info = broker.account_info()
+    book.refresh()
+    held = tuple(sorted({(position.symbol, position.magic, position.type) for position in book.by_ticket.values()}))
+    return (info.equity, info.leverage, held) if info is not None else (None, None, held)
+
+
+def _sent_before(broker, intent):
+    """
+    Ticket of the position a previous worker of the account opened for intent, else None
+    The order comment carries the intent tag, to the position and its deals.
+    """
+    for position in broker.positions_get(symbol=intent['symbol']) or ():
+        if position.comment == intent['tag']:
+            return position.ticket
+    # Opened and already closed again, only the deal history has it. Deal times are server
+    # time, the window reaches back from the last tick by the intent's age plus an hour.
+    tick = broker.symbol_info_tick(intent['symbol'])
+    if tick is None:
+        return None
+    age = time.time() - intent['signal_time']
+    deals = broker.history_deals_get(int(tick.time - age) - 3600, int(tick.time) + 3600)
+    for deal in deals or ():
+        if deal.entry == broker.DEAL_ENTRY_IN and deal.comment == intent['tag']:
+            return deal.position_id
+    return None
+
+
+def _execute(broker, symbols, book, account, intent):
+    if intent['kind'] == 'open':
+        if intent.get('resent'):
+            ticket = _sent_before(broker, intent)
+            if ticket is not None:
+                return broker.TRADE_RETCODE_DONE, ticket
+        lot_size = intent['lots'][account['login']]
+        result = place_market_order(broker, intent['symbol'], intent['side'], lot_size, intent['sl_points'],
+                                    intent['tp_points'], symbols, comment=intent['tag'], magic=intent['magic'])
+        if result is None:
+            return None, "Unknown error"
+        return result.retcode, result.order if result.retcode == broker.TRADE_RETCODE_DONE else result.comment
+
+    # exit: close the bot's positions of the symbol on the sides its strategy exits,
+    # the account's other positions carry another magic number
+    book.refresh()
+    closed = []
+    for position in book.for_symbol(intent['symbol'], magic=intent['magic']):
+        if (position.type == 0 and intent['close_long']) or (position.type == 1 and intent['close_short']):
+            result = broker.positions_close(position.ticket)
+            if result is not None and result.retcode == broker.TRADE_RETCODE_DONE:
+                closed.append(position.ticket)
+    return broker.TRADE_RETCODE_DONE, closed
+
+
+class _Worker:
+    __slots__ = ('account', 'process', 'intents', 'seen', 'ready', 'restarts', 'failure', 'held')
+
+    def __init__(self, account):
+        self.account = account
+        self.process = None
+        self.intents = None
+        self.seen = None
+        self.ready = False
+        self.restarts = 0
+        self.failure = None
+        # (symbol, magic, type) of the open positions, from the heartbeats and fills
+        self.held = set()
+
+
+class FanoutSupervisor:
+    """
+    Broadcasts order intents to one worker process per account and watches the workers
+
+    A worker is restarted when its process exits or no heartbeat arrived for `timeout`
+    seconds; intents it had not answered are sent again to the new process unless they
+    are older than max_age. Orders carry their intent's tag as comment, so a resent
+    intent the dead process had already filled is found instead of opened twice, and
+    the magic number of the job that signalled, so an exit only closes that job's
+    positions. Exits go out only while an account holds a position on the exiting side.
+    Latencies go to metrics as fanout_fill (signal -> fill of one account, per account)
+    and fanout_last_fill (signal -> fill of the last account).
+    """
+
+    def __init__(self, accounts, broker_factory=None, metrics=None, heartbeat=1.0, timeout=10.0, max_age=5.0,
+                 max_restarts=10, risk=None):
+        self.accounts = accounts
+        self.risk = risk
+        self.broker_factory = broker_factory
+        self.metrics = metrics or Metrics()
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        self.max_age = max_age
+        self.max_restarts = max_restarts
+        # spawn everywhere: it is the only start method on Windows, where the terminal runs
+        self.context = multiprocessing.get_context('spawn')
+        self.results = self.context.Queue()
+        self.workers = {account['login']: _Worker(account) for account in accounts}
+        self.pending = {}
+        self.ids = itertools.count(1)
+        # Tags stay unique across supervisor restarts
+        self.session = int(time.time())
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.monitor = None
+
+    def start(self):
+        for worker in self.workers.values():
+            self._spawn(worker)
+        self.monitor = threading.Thread(target=self._watch, name="fanout-monitor", daemon=True)
+        self.monitor.start()
+
+    def _spawn(self, worker):
+        # A fresh queue, the old one may be left locked by a killed process
+        worker.intents = self.context.Queue()
+        worker.process = self.context.Process(
+            target=account_worker, name=f"account-{worker.account['login']}", daemon=True,
+            args=(worker.account, worker.intents, self.results, self.broker_factory, self.heartbeat))
+        worker.process.start()
+        worker.seen = time.monotonic()
+        worker.ready = False
+
+    def _restart(self, worker, reason):
+        login = worker.account['login']
+        if worker.process.is_alive():
+            worker.process.terminate()
+        worker.process.join(timeout=5)
+        if worker.restarts >= self.max_restarts:
+            if worker.failure is None:
+                worker.failure = reason
+                print(f"Account {login}: giving up after {worker.restarts} restarts ({reason})")
+            return
+        worker.restarts += 1
+        self.metrics.count('worker_restarts', login)
+        self.metrics.event('worker_restart', login=login, reason=reason, restarts=worker.restarts)
+        print(f"Account {login}: restarting worker ({reason})")
+        self._spawn(worker)
+        # Resend what the dead process had not answered while it is still worth filling
+        now = time.time()
+        with self.lock:
+            unanswered = [intent for intent, waiting in self.pending.values()
+                          if login in waiting and intent['expires'] > now]
+        for intent in sorted(unanswered, key=lambda intent: intent['id']):
+            worker.intents.put(dict(intent, resent=True))
+
+    def publish(self, kind, symbol, **fields):
+        """
+        Send an intent to every account, returns its id
+        kind is 'open' (side, lot_size, sl_points, tp_points, magic) or 'exit' (close_long,
+        close_short, magic)
+        """
+        now = time.time()
+        intent = dict(fields, id=next(self.ids), kind=kind, symbol=symbol, signal_time=now,
+                      expires=now + self.max_age)
+        intent['tag'] = f"PipBot {self.session}:{intent['id']}"
+        live = [login for login, worker in self.workers.items() if worker.failure is None]
+        if kind == 'open':
+            # The volume of each account: its own lot_size, then the job's, then risk sizing
+            intent['lots'] = {login: self.workers[login].account.get('lot_size') or fields.get('lot_size')
+                              for login in live}
+            if self.risk is not None:
+                with self.metrics.timer('risk', symbol):
+                    intent['lots'] = self._size(symbol, fields['side'], intent['lots'])
+            live = list(intent['lots'])
+        with self.lock:
+            self.pending[intent['id']] = (intent, set(live))
+        for login in live:
+            self.workers[login].intents.put(intent)
+        self.metrics.count('intents', symbol)
+        self.metrics.event('intent', symbol, id=intent['id'], action=kind, accounts=len(live))
+        return intent['id']
+
+    def _size(self, symbol, side, requested):
+        """
+        Risk-checked volume of every account in one pass, refused accounts are left out
+        """
+        logins = list(requested)
+        volumes, reasons = self.risk.check(logins, [symbol] * len(logins), [1 if side == 'BUY' else -1] * len(logins),
+                                           [requested[login] or math.nan for login in logins])
+        lots = {}
+        for login, volume, reason in zip(logins, volumes, reasons):
+            if volume:
+                lots[login] = float(volume)
+            else:
+                self.metrics.count('risk_rejected', login)
+                print(f"Account {login}: {side} {symbol} refused: {REASONS[reason]}")
+        return lots
+
+    def on_event(self, event):
+        """
+        BotRunner listener turning its signals into open intents, and the exits of its bars
+        into exit intents when an account holds a position the exit closes
+        """
+        if event['event'] == 'signal':
+            self.publish('open', event['symbol'], side=event['side'], lot_size=event['lot_size'],
+                         sl_points=event['sl_points'], tp_points=event['tp_points'], magic=event['magic'])
+        elif event['event'] == 'bar' and (event['close_long'] or event['close_short']):
+            closing = {(event['symbol'], event['magic'], position_type)
+                       for position_type, close in enumerate((event['close_long'], event['close_short'])) if close}
+            if self._release(closing):
+                self.publish('exit', event['symbol'], close_long=event['close_long'],
+                             close_short=event['close_short'], magic=event['magic'])
+
+    def _release(self, closing):
+        """
+        Forget the positions an exit goes out for, True when any account held one
+        The next heartbeat brings back those the exit did not close
+        """
+        held = False
+        with self.lock:
+            for worker in self.workers.values():
+                if worker.held & closing:
+                    worker.held -= closing
+                    held = True
+        return held
+
+    def _watch(self):
+        while not self.stop_event.is_set():
+            self.poll(self.heartbeat / 2)
+
+    def poll(self, timeout=0.0):
+        """
+        Take in worker results for up to timeout seconds, then check the workers' health
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                message = self.results.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            self._handle(message)
+        if not self.stop_event.is_set():
+            self._check()
+
+    def _handle(self, message):
+        kind, login = message[0], message[1]
+        worker = self.workers.get(login)
+        if worker is None:
+            return
+        worker.seen = time.monotonic()
+        if kind in ('ready', 'heartbeat'):
+            with self.lock:
+                worker.held = set(message[5])
+            if self.risk is not None and message[3] is not None:
+                self.risk.set_account(login, message[3], message[4])
+        if kind == 'ready':
+            worker.ready = True
+            print(f"Account {login}: worker ready")
+        elif kind == 'failed':
+            print(f"Account {login}: {message[2]}")
+        elif kind == 'done':
+            self._done(login, *message[2:])
+
+    def _done(self, login, intent_id, received, finished, retcode, detail):
+        with self.lock:
+            entry = self.pending.get(intent_id)
+            if entry is None or login not in entry[1]:
+                return
+            intent, waiting = entry
+            waiting.discard(login)
+            last = not waiting
+            if last:
+                del self.pending[intent_id]
+        symbol = intent['symbol']
+        self.metrics.record('fanout_dispatch', login, received - intent['signal_time'])
+        self.metrics.record('fanout_fill', login, finished - intent['signal_time'])
+        ok = retcode == Broker.TRADE_RETCODE_DONE
+        self.metrics.count('fills' if ok else 'fill_failures', login)
+        self.metrics.event('fill', symbol, id=intent_id, login=login, action=intent['kind'], retcode=retcode,
+                           detail=detail, latency=finished - intent['signal_time'])
+        if ok and intent['kind'] == 'open':
+            with self.lock:
+                self.workers[login].held.add((symbol, intent['magic'], 0 if intent['side'] == 'BUY' else 1))
+        if not ok:
+            print(f"Account {login}: {intent['kind']} {symbol} failed: {detail}")
+        elif self.risk is not None:
+            if intent['kind'] == 'open':
+                self.risk.on_fill(login, symbol, 1 if intent['side'] == 'BUY' else -1, intent['lots'][login],
+                                  ticket=detail)
+            else:
+                for ticket in detail:
+                    self.risk.on_close(login, ticket)
+        if last:
+            self.metrics.record('fanout_last_fill', symbol, finished - intent['signal_time'])
+
+    def _check(self):
+        now = time.monotonic()
+        for worker in self.workers.values():
+            if worker.failure is not None or worker.process is None:
+                continue
+            if not worker.process.is_alive():
+                self._restart(worker, f"exit code {worker.process.exitcode}")
+            elif now - worker.seen > self.timeout:
+                self._restart(worker, f"no heartbeat for {now - worker.seen:.1f}s")
+        # Intents nobody can answer any more are counted as missed
+        expired = time.time() - self.timeout
+        with self.lock:
+            stale = [intent_id for intent_id, (intent, _) in self.pending.items() if intent['expires'] < expired]
+            for intent_id in stale:
+                intent, waiting = self.pending.pop(intent_id)
+                self.metrics.count('fanout_missed', intent['symbol'], len(waiting))
+
+    def join(self, timeout=None):
+        """
+        Wait until every published intent was answered, returns False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                if not self.pending:
+                    return True
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            if self.monitor is None:
+                self.poll(0.05)
+            else:
+                time.sleep(0.01)
+
+    def status(self):
+        return [
+            {
+                'login': login,
+                'alive': worker.process is not None and worker.process.is_alive(),
+                'ready': worker.ready,
+                'restarts': worker.restarts,
+                'last_seen': time.monotonic() - worker.seen if worker.seen is not None else None,
+                'failure': worker.failure,
+            }
+            for login, worker in self.workers.items()
+        ]
+
+    def stop(self):
+        self.stop_event.set()
+        if self.monitor is not None:
+            self.monitor.join()
+        for worker in self.workers.values():
+            if worker.process is not None and worker.process.is_alive():
+                worker.intents.put(None)
+        for worker in self.workers.values():
+            if worker.process is not None:
+                worker.process.join(timeout=10)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+        # Answers that came in while the workers were shutting down
+        self.poll()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute signals once and mirror them on many accounts")
+    parser.add_argument('accounts', help="JSON file listing the accounts to trade")
+    parser.add_argument('jobs', nargs='+', help="SYMBOL[:STRATEGY[:TIMEFRAME]], e.g. GBPUSD:trend:H1")
+    parser.add_argument('--lot-size', type=float, default=0.01)
+    parser.add_argument('--sl-points', type=float, default=100)
+    parser.add_argument('--tp-points', type=float, default=200)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--metrics-log', help="append timing and fill events to this JSON lines file")
+    parser.add_argument('--heartbeat', type=float, default=1.0, help="seconds between worker heartbeats")
+    parser.add_argument('--timeout', type=float, default=10.0, help="restart a worker silent this long")
+    add_risk_arguments(parser)
+    args = parser.parse_args()
+
+    with open(args.accounts, encoding='utf-8') as f:
+        accounts = json.load(f)
+    metrics = Metrics(args.metrics_log)
+    risk = risk_engine(args)
+    supervisor = FanoutSupervisor(accounts, metrics=metrics, heartbeat=args.heartbeat, timeout=args.timeout,
+                                  risk=risk)
+    # The data account only computes signals, its jobs never trade; it keeps the risk prices current
+    runner = BotRunner(int(os.getenv("ACCOUNT_NUMBER")), os.getenv("PASSWORD"), workers=args.workers,
+                       metrics=metrics, risk=risk)
+    runner.listeners.append(supervisor.on_event)
+    for spec in args.jobs:
+        symbol, strategy, timeframe = (spec.split(':') + ['crossover', 'M15'])[:3]
+        runner.add(symbol, strategy, getattr(Broker, f"TIMEFRAME_{timeframe}"),
+                   lot_size=None if args.risk_per_trade else args.lot_size, sl_points=args.sl_points,
+                   tp_points=args.tp_points, trade=False)
+    supervisor.start()
+    try:
+        runner.run()
+    finally:
+        supervisor.join(timeout=10)
+        supervisor.stop()
+        metrics.report(symbol=True)
+
+
+if __name__ == '__main__':
+    main()
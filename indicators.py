@@ -0,0 +1,603 @@
+import copy
+import datetime
+import math
+import threading
+from collections import deque
+
+
+def bar_price(bar, source="close"):
+    """
+    Read the input price of an indicator from a bar
+    'median' is (high + low) / 2, anything else is a field of the bar
+    """
+    if source == "median":
+        return (bar["high"] + bar["low"]) / 2
+    return bar[source]
+
+
+def format_bar_time(timestamp):
+    """
+    Broker server time of a bar as printed by the bots
+    """
+    return datetime.datetime.fromtimestamp(int(timestamp), datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _new_bars(rates, last_time):
+    # Drop the bars already seen in one step when rates is a NumPy array
+    if last_time is not None and hasattr(rates, "dtype"):
+        return rates[rates["time"] > last_time]
+    return rates
+
+
+class EMA:
+    """
+    Exponential moving average, same as pandas ewm(span=span, adjust=False).mean()
+    """
+
+    def __init__(self, span, source="close"):
+        self.span = span
+        self.source = source
+        self.alpha = 2 / (span + 1)
+        self.value = None
+
+    def _next(self, x):
+        if self.value is None:
+            return float(x)
+        return self.alpha * x + (1 - self.alpha) * self.value
+
+    def update_value(self, x):
+        self.value = self._next(x)
+        return self.value
+
+    def peek_value(self, x):
+        return self._next(x)
+
+    def update(self, bar):
+        return self.update_value(bar_price(bar, self.source))
+
+    def peek(self, bar):
+        return self.peek_value(bar_price(bar, self.source))
+
+
+class RollingMean:
+    """
+    Simple moving average, same as pandas rolling(window).mean()
+    Returns nan until the window is full
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.total = 0.0
+
+    def _next_total(self, x):
+        if len(self.values) == self.window:
+            return self.total - self.values[0] + x
+        return self.total + x
+
+    def update_value(self, x):
+        self.total = self._next_total(x)
+        if len(self.values) == self.window:
+            self.values.popleft()
+        self.values.append(x)
+        if len(self.values) < self.window:
+            return math.nan
+        return self.total / self.window
+
+    def peek_value(self, x):
+        if len(self.values) + 1 < self.window:
+            return math.nan
+        return self._next_total(x) / self.window
+
+
+class WilderMean:
+    """
+    Wilder's smoothed average, seeded with the simple average of the first period values
+    """
+
+    def __init__(self, period):
+        self.period = period
+        self.count = 0
+        self.total = 0.0
+        self.value = math.nan
+
+    def _next(self, x):
+        if self.count + 1 < self.period:
+            return math.nan
+        if self.count + 1 == self.period:
+            return (self.total + x) / self.period
+        return (self.value * (self.period - 1) + x) / self.period
+
+    def update_value(self, x):
+        self.value = self._next(x)
+        if self.count < self.period:
+            self.total += x
+            self.count += 1
+        return self.value
+
+    def peek_value(self, x):
+        return self._next(x)
+
+
+def _rsi(gain, loss):
+    if loss == 0:
+        return math.nan if gain == 0 else 100.0
+    return 100 - (100 / (1 + gain / loss))
+
+
+class RSI:
+    """
+    Relative strength index
+    The default rolling mode matches the pandas calculation in newtest.py,
+    wilder=True uses Wilder's smoothing instead
+    """
+
+    def __init__(self, period=14, wilder=False, source="close"):
+        self.period = period
+        self.source = source
+        average = WilderMean if wilder else RollingMean
+        self.gain = average(period)
+        self.loss = average(period)
+        self.prev = None
+
+    def _delta(self, x):
+        # The first bar has no previous close, pandas turns that NaN into a 0 gain and loss
+        return 0.0 if self.prev is None else x - self.prev
+
+    def update_value(self, x):
+        delta = self._delta(x)
+        self.prev = x
+        gain = self.gain.update_value(max(delta, 0.0))
+        loss = self.loss.update_value(max(-delta, 0.0))
+        return _rsi(gain, loss)
+
+    def peek_value(self, x):
+        delta = self._delta(x)
+        gain = self.gain.peek_value(max(delta, 0.0))
+        loss = self.loss.peek_value(max(-delta, 0.0))
+        return _rsi(gain, loss)
+
+    def update(self, bar):
+        return self.update_value(bar_price(bar, self.source))
+
+    def peek(self, bar):
+        return self.peek_value(bar_price(bar, self.source))
+
+
+class MACD:
+    """
+    MACD line and its signal line, returned together as a (macd, signal) tuple
+    """
+
+    def __init__(self, fast=12, slow=26, signal=9, source="close"):
+        self.source = source
+        self.fast = EMA(fast)
+        self.slow = EMA(slow)
+        self.signal = EMA(signal)
+
+    def update(self, bar):
+        x = bar_price(bar, self.source)
+        macd = self.fast.update_value(x) - self.slow.update_value(x)
+        return macd, self.signal.update_value(macd)
+
+    def peek(self, bar):
+        x = bar_price(bar, self.source)
+        macd = self.fast.peek_value(x) - self.slow.peek_value(x)
+        return macd, self.signal.peek_value(macd)
+
+
+class ATR:
+    """
+    Average range over period bars
+    The default is the rolling mean of high - low used in newtest.py,
+    true_range=True uses the true range with Wilder's smoothing
+    """
+
+    def __init__(self, period=14, true_range=False):
+        self.period = period
+        self.true_range = true_range
+        self.average = WilderMean(period) if true_range else RollingMean(period)
+        self.prev_close = None
+
+    def _range(self, bar):
+        bar_range = bar["high"] - bar["low"]
+        if self.true_range and self.prev_close is not None:
+            bar_range = max(bar_range, abs(bar["high"] - self.prev_close), abs(bar["low"] - self.prev_close))
+        return bar_range
+
+    def update(self, bar):
+        value = self.average.update_value(self._range(bar))
+        self.prev_close = bar["close"]
+        return value
+
+    def peek(self, bar):
+        return self.average.peek_value(self._range(bar))
+
+
+class IndicatorEngine:
+    """
+    Keeps a set of streaming indicators up to date one closed bar at a time
+    indicators maps an output name to an indicator, a tuple of names unpacks
+    indicators that return several values (MACD)
+    The last `history` values of every output and of the bar prices are kept
+    """
+
+    price_fields = ("open", "high", "low", "close")
+
+    def __init__(self, indicators, history=100):
+        self.indicators = indicators
+        self.history = {}
+        for name in self._names():
+            self.history[name] = deque(maxlen=history)
+        self.last_time = None
+
+    def _names(self):
+        names = list(self.price_fields)
+        for key in self.indicators:
+            names.extend(key if isinstance(key, tuple) else (key,))
+        return names
+
+    def _values(self, bar, commit):
+        values = {field: float(bar[field]) for field in self.price_fields}
+        for key, indicator in self.indicators.items():
+            result = indicator.update(bar) if commit else indicator.peek(bar)
+            if isinstance(key, tuple):
+                values.update(zip(key, result))
+            else:
+                values[key] = result
+        return values
+
+    def update(self, bar):
+        """
+        Feed one closed bar, bars at or before the last seen time are ignored
+        """
+        bar_time = int(bar["time"])
+        if self.last_time is not None and bar_time <= self.last_time:
+            return None
+        values = self._values(bar, commit=True)
+        for name, value in values.items():
+            self.history[name].append(value)
+        self.last_time = bar_time
+        return values
+
+    def update_many(self, rates):
+        """
+        Feed every new bar of a copy_rates_from_pos array, returns how many were new
+        """
+        rates = _new_bars(rates, self.last_time)
+        count = 0
+        for bar in rates:
+            if self.update(bar) is not None:
+                count += 1
+        return count
+
+    def warm_up(self, rates):
+        self.update_many(rates)
+        return self
+
+    def peek(self, bar):
+        """
+        Indicator values for a bar that is still forming, without changing any state
+        """
+        return self._values(bar, commit=False)
+
+    def last_values(self):
+        """
+        Values of the last closed bar
+        """
+        return {name: values[-1] for name, values in self.history.items() if values}
+
+    def series(self, name, count, latest=None):
+        """
+        The last count values of an output, optionally ending with a peeked value
+        """
+        values = list(self.history[name])
+        if latest is not None:
+            values.append(latest[name])
+        return values[-count:]
+
+
+class _Price:
+    def __init__(self, source):
+        self.source = source
+
+    def update(self, bar):
+        return float(bar_price(bar, self.source))
+
+    peek = update
+
+
+class _Smoothed:
+    # EMA, RollingMean, WilderMean or RSI of the input node
+    def __init__(self, average):
+        self.average = average
+
+    def update(self, x):
+        return self.average.update_value(x)
+
+    def peek(self, x):
+        return self.average.peek_value(x)
+
+
+class _Difference:
+    def update(self, a, b):
+        return a - b
+
+    peek = update
+
+
+class _TrueRange:
+    def __init__(self):
+        self.prev_close = None
+
+    def _range(self, high, low):
+        if self.prev_close is None:
+            return high - low
+        return max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+
+    def update(self, high, low, close):
+        value = self._range(high, low)
+        self.prev_close = close
+        return value
+
+    def peek(self, high, low, close):
+        return self._range(high, low)
+
+
+class IndicatorGraph:
+    """
+    The indicators of one symbol and timeframe as a graph of shared nodes
+    A node is identified by its kind, parameters and input nodes, so declaring the same
+    indicator twice (EMA 10 of close in two strategies, the EMAs inside MACD) returns the
+    existing node and each node is computed once per bar for every strategy using it.
+    Strategies read the graph through view(), which behaves like an IndicatorEngine.
+    """
+
+    def __init__(self, history=100):
+        self.history_size = history
+        self.keys = []
+        self.index = {}
+        self.nodes = []
+        self.inputs = []
+        self.history = []
+        self.last_time = None
+        self.lock = threading.RLock()
+        self._peeked = (None, None)
+        for field in IndicatorEngine.price_fields:
+            self.price(field)
+
+    def _node(self, key, make, inputs=None):
+        with self.lock:
+            position = self.index.get(key)
+            if position is not None:
+                return key
+            node = make()
+            history = deque(maxlen=self.history_size)
+            if inputs is not None and self.last_time is not None:
+                # Declared after bars were fed: replay the stored history of its inputs
+                for values in zip(*(self.history[self.index[name]] for name in inputs)):
+                    history.append(node.update(*values))
+            self.index[key] = len(self.keys)
+            self.keys.append(key)
+            self.nodes.append(node)
+            self.inputs.append(None if inputs is None else [self.index[name] for name in inputs])
+            self.history.append(history)
+            self._peeked = (None, None)
+            return key
+
+    def _input(self, source):
+        return self.price(source) if isinstance(source, str) else source
+
+    def price(self, source):
+        return self._node(("price", source), lambda: _Price(source))
+
+    def ema(self, source, span):
+        source = self._input(source)
+        return self._node(("ema", source, span), lambda: _Smoothed(EMA(span)), [source])
+
+    def sma(self, source, window):
+        source = self._input(source)
+        return self._node(("sma", source, window), lambda: _Smoothed(RollingMean(window)), [source])
+
+    def wilder(self, source, period):
+        source = self._input(source)
+        return self._node(("wilder", source, period), lambda: _Smoothed(WilderMean(period)), [source])
+
+    def difference(self, a, b):
+        a, b = self._input(a), self._input(b)
+        return self._node(("difference", a, b), _Difference, [a, b])
+
+    def rsi(self, source="close", period=14, wilder=False):
+        source = self._input(source)
+        return self._node(("rsi", source, period, wilder), lambda: _Smoothed(RSI(period, wilder)), [source])
+
+    def macd(self, source="close", fast=12, slow=26, signal=9):
+        """
+        (MACD line, signal line) nodes, the EMAs are shared with any other user
+        """
+        line = self.difference(self.ema(source, fast), self.ema(source, slow))
+        return line, self.ema(line, signal)
+
+    def atr(self, period=14, true_range=False):
+        """
+        Same values as ATR(period, true_range)
+        """
+        if true_range:
+            ranges = self._node(("true_range",), _TrueRange,
+                                [self.price("high"), self.price("low"), self.price("close")])
+            return self.wilder(ranges, period)
+        return self.sma(self.difference("high", "low"), period)
+
+    def ensure_history(self, size):
+        with self.lock:
+            if size > self.history_size:
+                self.history_size = size
+                self.history = [deque(values, maxlen=size) for values in self.history]
+
+    def _evaluate(self, bar, commit):
+        values = []
+        for node, inputs in zip(self.nodes, self.inputs):
+            if inputs is None:
+                values.append(node.update(bar))
+            elif commit:
+                values.append(node.update(*[values[position] for position in inputs]))
+            else:
+                values.append(node.peek(*[values[position] for position in inputs]))
+        return values
+
+    def update(self, bar):
+        """
+        Feed one closed bar, bars at or before the last seen time are ignored
+        """
+        bar_time = int(bar["time"])
+        with self.lock:
+            if self.last_time is not None and bar_time <= self.last_time:
+                return False
+            for history, value in zip(self.history, self._evaluate(bar, commit=True)):
+                history.append(value)
+            self.last_time = bar_time
+            return True
+
+    def update_many(self, rates):
+        with self.lock:
+            rates = _new_bars(rates, self.last_time)
+            count = 0
+            for bar in rates:
+                count += self.update(bar)
+            return count
+
+    def state(self):
+        """
+        Copy of every node's accumulators and history, for checkpoint.save()
+        """
+        with self.lock:
+            return {
+                'last_time': self.last_time,
+                'nodes': {key: (copy.deepcopy(node), list(history))
+                          for key, node, history in zip(self.keys, self.nodes, self.history)},
+            }
+
+    def load_state(self, state):
+        """
+        Continue from a state() of a graph with the same indicators
+        A node the saved graph did not have is replayed from its inputs' history
+        """
+        with self.lock:
+            saved = state['nodes']
+            for position, key in enumerate(self.keys):
+                if key in saved:
+                    node, values = saved[key]
+                    self.nodes[position] = node
+                    self.history[position] = deque(values, maxlen=self.history_size)
+                    continue
+                history = deque(maxlen=self.history_size)
+                inputs = self.inputs[position]
+                if inputs is not None:
+                    for values in zip(*(self.history[index] for index in inputs)):
+                        history.append(self.nodes[position].update(*values))
+                self.history[position] = history
+            self.last_time = state['last_time']
+            self._peeked = (None, None)
+
+    def value(self, key):
+        """
+        Value of a node at the last bar fed, None before the first one
+        """
+        history = self.history[self.index[key]]
+        return history[-1] if history else None
+
+    def peek(self, bar):
+        """
+        Node values for a forming bar, computed once however many views ask for it
+        """
+        bar_key = tuple(float(bar[field]) for field in ("time",) + IndicatorEngine.price_fields)
+        with self.lock:
+            peeked_key, values = self._peeked
+            if peeked_key != (bar_key, self.last_time):
+                values = self._evaluate(bar, commit=False)
+                self._peeked = ((bar_key, self.last_time), values)
+            return values
+
+    def view(self, outputs, history=100):
+        """
+        IndicatorEngine-like access to the nodes in outputs (output name -> node)
+        """
+        self.ensure_history(history)
+        return IndicatorView(self, outputs)
+
+
+class IndicatorView:
+    """
+    Named outputs of an IndicatorGraph with the IndicatorEngine interface
+    Feeding bars through any view advances the shared graph once
+    """
+
+    def __init__(self, graph, outputs):
+        self.graph = graph
+        self.outputs = {field: ("price", field) for field in IndicatorEngine.price_fields}
+        self.outputs.update(outputs)
+        self.positions = {name: graph.index[key] for name, key in self.outputs.items()}
+
+    @property
+    def last_time(self):
+        return self.graph.last_time
+
+    @property
+    def history(self):
+        return {name: self.graph.history[position] for name, position in self.positions.items()}
+
+    def update(self, bar):
+        if not self.graph.update(bar):
+            return None
+        return self.last_values()
+
+    def update_many(self, rates):
+        return self.graph.update_many(rates)
+
+    def warm_up(self, rates):
+        self.update_many(rates)
+        return self
+
+    def peek(self, bar):
+        values = self.graph.peek(bar)
+        return {name: values[position] for name, position in self.positions.items()}
+
+    def last_values(self):
+        history = self.graph.history
+        return {name: history[position][-1] for name, position in self.positions.items() if history[position]}
+
+    def series(self, name, count, latest=None):
+        values = list(self.graph.history[self.positions[name]])
+        if latest is not None:
+            values.append(latest[name])
+        return values[-count:]
+
+
+def crossover_engine(history=100, fast_span=10, slow_span=23, graph=None):
+    """
+    Indicators of the EMA crossover strategy in refinedmain.py
+    Pass the graph of the symbol to share its nodes with other strategies
+    """
+    graph = graph or IndicatorGraph(history)
+    return graph.view({
+        f"EMA_Median_{slow_span}": graph.ema("median", slow_span),
+        f"EMA_Close_{fast_span}": graph.ema("close", fast_span),
+    }, history=history)
+
+
+def trend_engine(history=100, graph=None):
+    """
+    Indicators of the trend strength strategy in newtest.py
+    Pass the graph of the symbol to share its nodes with other strategies
+    """
+    graph = graph or IndicatorGraph(history)
+    macd, signal_line = graph.macd("close", 12, 26, 9)
+    return graph.view({
+        "EMA_10": graph.ema("close", 10),
+        "EMA_20": graph.ema("close", 20),
+        "EMA_50": graph.ema("close", 50),
+        "RSI": graph.rsi("close", 14),
+        "MACD": macd,
+        "Signal_Line": signal_line,
+        "ATR": graph.atr(14),
+    }, history=history)
@@ -0,0 +1,337 @@
+"""
+Durable trade journal: bar evaluations, signals, orders and closes in a local SQLite file
+
+    journal = Journal('pipbot.db')
+    journal.start()
+    runner.listeners.append(journal.record)
+    ...
+    journal.pnl(account=5031234, start=1717200000, end=1719792000)
+    journal.close()
+
+record() only queues the runner event, a writer thread inserts the queue in batches of
+one transaction each, so the trading loop never waits on disk. Rows are indexed by
+account, symbol and time, orders and closes by ticket too. Times are broker server
+time, as the runner's events carry them, so a day is a trading day of the broker. Closes
+come from the deal history with the realized profit. Triggers keep per day totals of
+every account and symbol next to the closes and orders, so a PnL, hit rate or slippage
+query over any range reads the whole days from those and only the rows of the two
+partial days at its ends.
+"""
+import queue
+import sqlite3
+import threading
+
+DAY = 86400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bars (
+    account INTEGER, symbol TEXT, job TEXT, time REAL, bar_time INTEGER, signal INTEGER);
+CREATE INDEX IF NOT EXISTS bars_by_symbol ON bars (account, symbol, bar_time);
+
+CREATE TABLE IF NOT EXISTS signals (
+    account INTEGER, symbol TEXT, job TEXT, time REAL, bar_time INTEGER, side TEXT, lot_size REAL);
+CREATE INDEX IF NOT EXISTS signals_by_symbol ON signals (account, symbol, time);
+
+CREATE TABLE IF NOT EXISTS orders (
+    account INTEGER, symbol TEXT, job TEXT, time REAL, side TEXT, volume REAL, requested REAL,
+    price REAL, slippage REAL, filled INTEGER, retcode INTEGER, ticket INTEGER, comment TEXT);
+CREATE INDEX IF NOT EXISTS orders_by_symbol ON orders (account, symbol, time);
+CREATE INDEX IF NOT EXISTS orders_by_time ON orders (time);
+CREATE INDEX IF NOT EXISTS orders_by_ticket ON orders (ticket);
+
+CREATE TABLE IF NOT EXISTS closes (
+    account INTEGER, ticket INTEGER, symbol TEXT, time REAL, type INTEGER, volume REAL,
+    price_open REAL, price_close REAL, profit REAL, reason INTEGER,
+    PRIMARY KEY (account, ticket));
+CREATE INDEX IF NOT EXISTS closes_by_symbol ON closes (account, symbol, time);
+CREATE INDEX IF NOT EXISTS closes_by_time ON closes (time);
+CREATE INDEX IF NOT EXISTS closes_by_ticket ON closes (ticket);
+
+CREATE TABLE IF NOT EXISTS closes_daily (
+    account INTEGER, symbol TEXT, day INTEGER, trades INTEGER, wins INTEGER, losses INTEGER,
+    profit REAL, gross_profit REAL, gross_loss REAL,
+    PRIMARY KEY (account, symbol, day)) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS orders_daily (
+    account INTEGER, symbol TEXT, day INTEGER, orders INTEGER, filled INTEGER,
+    slipped INTEGER, slippage REAL, slippage_max REAL,
+    PRIMARY KEY (account, symbol, day)) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS closes_added AFTER INSERT ON closes BEGIN
+    INSERT INTO closes_daily VALUES (
+        NEW.account, NEW.symbol, CAST(NEW.time / 86400 AS INTEGER) * 86400, 1, NEW.profit > 0,
+        NEW.profit < 0, NEW.profit, MAX(NEW.profit, 0), MIN(NEW.profit, 0))
+    ON CONFLICT (account, symbol, day) DO UPDATE SET
+        trades = trades + 1, wins = wins + excluded.wins, losses = losses + excluded.losses,
+        profit = profit + excluded.profit, gross_profit = gross_profit + excluded.gross_profit,
+        gross_loss = gross_loss + excluded.gross_loss;
+END;
+
+CREATE TRIGGER IF NOT EXISTS closes_changed AFTER UPDATE ON closes BEGIN
+    UPDATE closes_daily SET
+        trades = trades - 1, wins = wins - (OLD.profit > 0), losses = losses - (OLD.profit < 0),
+        profit = profit - OLD.profit, gross_profit = gross_profit - MAX(OLD.profit, 0),
+        gross_loss = gross_loss - MIN(OLD.profit, 0)
+    WHERE account = OLD.account AND symbol = OLD.symbol AND day = CAST(OLD.time / 86400 AS INTEGER) * 86400;
+    INSERT INTO closes_daily VALUES (
+        NEW.account, NEW.symbol, CAST(NEW.time / 86400 AS INTEGER) * 86400, 1, NEW.profit > 0,
+        NEW.profit < 0, NEW.profit, MAX(NEW.profit, 0), MIN(NEW.profit, 0))
+    ON CONFLICT (account, symbol, day) DO UPDATE SET
+        trades = trades + 1, wins = wins + excluded.wins, losses = losses + excluded.losses,
+        profit = profit + excluded.profit, gross_profit = gross_profit + excluded.gross_profit,
+        gross_loss = gross_loss + excluded.gross_loss;
+END;
+
+CREATE TRIGGER IF NOT EXISTS orders_added AFTER INSERT ON orders BEGIN
+    INSERT INTO orders_daily VALUES (
+        NEW.account, NEW.symbol, CAST(NEW.time / 86400 AS INTEGER) * 86400, 1, NEW.filled,
+        NEW.slippage IS NOT NULL, COALESCE(NEW.slippage, 0), NEW.slippage)
+    ON CONFLICT (account, symbol, day) DO UPDATE SET
+        orders = orders + 1, filled = filled + excluded.filled, slipped = slipped + excluded.slipped,
+        slippage = slippage + excluded.slippage,
+        slippage_max = COALESCE(MAX(slippage_max, excluded.slippage_max), slippage_max, excluded.slippage_max);
+END;
+"""
+
+# Runner event -> statement and the event fields it inserts
+_INSERTS = {
+    'bar': ("INSERT INTO bars VALUES (?, ?, ?, ?, ?, ?)",
+            ('account', 'symbol', 'job', 'time', 'bar_time', 'signal')),
+    'signal': ("INSERT INTO signals VALUES (?, ?, ?, ?, ?, ?, ?)",
+               ('account', 'symbol', 'job', 'time', 'bar_time', 'side', 'lot_size')),
+    'order': ("INSERT INTO orders VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+              ('account', 'symbol', 'job', 'time', 'side', 'volume', 'requested', 'price', 'slippage', 'filled',
+               'retcode', 'ticket', 'comment')),
+    # An order the risk engine refused never reaches the broker
+    'risk_rejected': ("INSERT INTO orders (account, symbol, job, time, side, volume, filled, comment) "
+                      "VALUES (?, ?, ?, ?, ?, ?, 0, ?)",
+                      ('account', 'symbol', 'job', 'time', 'side', 'lot_size', 'reason')),
+    # A closed position from its deals, seen again when the deal history is read again
+    'close': ("INSERT INTO closes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+              "ON CONFLICT (account, ticket) DO UPDATE SET time = excluded.time, volume = excluded.volume, "
+              "price_close = excluded.price_close, profit = excluded.profit, reason = excluded.reason",
+              ('account', 'ticket', 'symbol', 'time', 'type', 'volume', 'price_open', 'price', 'profit', 'reason')),
+}
+
+_GROUPS = {None: (), 'account': ('account',), 'symbol': ('account', 'symbol')}
+
+
+def _ranges(start, end):
+    """
+    Split [start, end) into the whole days (first, last) and the partial ranges at its ends
+    """
+    first = None if start is None else -(-start // DAY) * DAY
+    last = None if end is None else end // DAY * DAY
+    if first is not None and last is not None and first >= last:
+        return None, [(start, end)]
+    partial = []
+    if start is not None and start < first:
+        partial.append((start, first))
+    if end is not None and last < end:
+        partial.append((last, end))
+    return (first, last), partial
+
+
+class Journal:
+    """
+    SQLite journal of one or more runners, written from a background thread
+    The writer commits whatever has been queued, up to batch_size events a transaction,
+    so batches grow with the load. Queries open their own connection, WAL mode lets them
+    read while the writer writes.
+    """
+
+    def __init__(self, path, batch_size=1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.thread = None
+        self.written = 0
+        self.failed = 0
+
+    def start(self):
+        connection = self._connect()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(_SCHEMA)
+        connection.close()
+        self.thread = threading.Thread(target=self._write_loop, name="journal", daemon=True)
+        self.thread.start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def record(self, event):
+        """
+        BotRunner listener, events it does not journal are dropped here
+        """
+        if event['event'] in _INSERTS:
+            self.queue.put(event)
+
+    def _write_loop(self):
+        connection = self._connect()
+        try:
+            while True:
+                batch = [self.queue.get()]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = batch[-1] is None
+                events = batch[:-1] if stop else batch
+                try:
+                    self._write(connection, events)
+                except sqlite3.Error as e:
+                    self.failed += len(events)
+                    print(f"Journal write of {len(events)} events failed: {e}")
+                finally:
+                    for _ in batch:
+                        self.queue.task_done()
+                if stop:
+                    return
+        finally:
+            connection.close()
+
+    def _write(self, connection, events):
+        rows = {}
+        for event in events:
+            rows.setdefault(event['event'], []).append(event)
+        with connection:
+            for kind, grouped in rows.items():
+                statement, fields = _INSERTS[kind]
+                connection.executemany(statement, [tuple(event.get(name) for name in fields) for event in grouped])
+        self.written += len(events)
+
+    def flush(self):
+        """
+        Wait until every recorded event is committed
+        """
+        self.queue.join()
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    # Queries
+
+    def _totals(self, daily, table, columns, account, symbol, start, end, by):
+        """
+        Sum columns (name -> (daily expression, row expression)) over [start, end)
+        """
+        group = _GROUPS[by]
+        names = list(columns)
+        filters = []
+        values = []
+        if account is not None:
+            filters.append("account = ?")
+            values.append(account)
+        if symbol is not None:
+            filters.append("symbol = ?")
+            values.append(symbol)
+        days, partial = _ranges(start, end)
+        queries = []
+        if days is not None:
+            conditions = list(filters)
+            bounds = list(values)
+            if days[0] is not None:
+                conditions.append("day >= ?")
+                bounds.append(days[0])
+            if days[1] is not None:
+                conditions.append("day < ?")
+                bounds.append(days[1])
+            queries.append((daily, [columns[name][0] for name in names], conditions, bounds))
+        # A partial range is less than a day, its rows are found faster by time than by account
+        source = table if symbol is not None else f"{table} INDEXED BY {table}_by_time"
+        for low, high in partial:
+            queries.append((source, [columns[name][1] for name in names], filters + ["time >= ?", "time < ?"],
+                            values + [low, high]))
+
+        totals = {}
+        connection = self._connect()
+        try:
+            for source, expressions, conditions, bounds in queries:
+                where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+                keys = f"{', '.join(group)}, " if group else ""
+                grouping = f" GROUP BY {', '.join(group)}" if group else ""
+                sql = f"SELECT {keys}{', '.join(expressions)} FROM {source}{where}{grouping}"
+                for row in connection.execute(sql, bounds):
+                    key = row[:len(group)]
+                    total = totals.setdefault(key, dict.fromkeys(names))
+                    for name, value in zip(names, row[len(group):]):
+                        if value is None:
+                            continue
+                        if name.endswith('_max'):
+                            total[name] = value if total[name] is None else max(total[name], value)
+                        else:
+                            total[name] = (total[name] or 0) + value
+        finally:
+            connection.close()
+        if not group and not totals:
+            totals[()] = dict.fromkeys(names)
+        return [dict(zip(group, key), **{name: value or 0 for name, value in total.items()})
+                for key, total in sorted(totals.items())]
+
+    def _closes(self, account, symbol, start, end, by):
+        return self._totals('closes_daily', 'closes', {
+            'trades': ("SUM(trades)", "COUNT(*)"),
+            'wins': ("SUM(wins)", "SUM(profit > 0)"),
+            'losses': ("SUM(losses)", "SUM(profit < 0)"),
+            'profit': ("SUM(profit)", "SUM(profit)"),
+            'gross_profit': ("SUM(gross_profit)", "SUM(MAX(profit, 0))"),
+            'gross_loss': ("SUM(gross_loss)", "SUM(MIN(profit, 0))"),
+        }, account, symbol, start, end, by)
+
+    def pnl(self, account=None, symbol=None, start=None, end=None, by=None):
+        """
+        Realized profit of the positions closed in [start, end), epoch seconds in server time
+        by None for one total, 'account' or 'symbol' for one row each
+        """
+        return [{name: row[name] for name in row if name not in ('wins', 'losses')}
+                for row in self._closes(account, symbol, start, end, by)]
+
+    def hit_rate(self, account=None, symbol=None, start=None, end=None, by=None):
+        """
+        Share of the positions closed in [start, end) that made money
+        """
+        rows = self._closes(account, symbol, start, end, by)
+        return [dict({name: row[name] for name in row if name not in ('profit', 'gross_profit', 'gross_loss')},
+                     hit_rate=row['wins'] / row['trades'] if row['trades'] else 0.0)
+                for row in rows]
+
+    def slippage(self, account=None, symbol=None, start=None, end=None, by=None):
+        """
+        Fill slippage in points of the orders sent in [start, end), positive is worse than requested
+        """
+        rows = self._totals('orders_daily', 'orders', {
+            'orders': ("SUM(orders)", "COUNT(*)"),
+            'filled': ("SUM(filled)", "SUM(filled)"),
+            'slipped': ("SUM(slipped)", "COUNT(slippage)"),
+            'slippage': ("SUM(slippage)", "SUM(slippage)"),
+            'slippage_max': ("MAX(slippage_max)", "MAX(slippage)"),
+        }, account, symbol, start, end, by)
+        results = []
+        for row in rows:
+            slipped = row.pop('slipped')
+            total = row.pop('slippage')
+            row['slippage_mean'] = total / slipped if slipped else 0.0
+            results.append(row)
+        return results
+
+    def trade(self, ticket, account=None):
+        """
+        The order and close rows of a ticket
+        """
+        connection = self._connect()
+        connection.row_factory = sqlite3.Row
+        try:
+            condition = "ticket = ?" + (" AND account = ?" if account is not None else "")
+            values = [ticket] + ([account] if account is not None else [])
+            orders = connection.execute(f"SELECT * FROM orders WHERE {condition} ORDER BY time", values)
+            orders = [dict(row) for row in orders]
+            closes = [dict(row) for row in connection.execute(f"SELECT * FROM closes WHERE {condition}", values)]
+        finally:
+            connection.close()
+        return {'orders': orders, 'closes': closes}
@@ -1,10 +1,10 @@
 import MetaTrader5 as mt
 import os
 from dotenv import load_dotenv
-import pytz
-import datetime
-import pandas as pd
 import time
+from metrics import Metrics
+from orders import filling_type
+from scheduler import BarScheduler
 load_dotenv()
 
 mt.initialize()
@@ -33,7 +33,7 @@ def place_market_order(symbol, order_type, lot_size, sl_points, tp_points):
         "magic": 234000,
         "comment": f"PipBot {order_type} order",
         "type_time": mt.ORDER_TIME_GTC,
-        "type_filling": mt.ORDER_FILLING_IOC,
+        "type_filling": filling_type(mt, symbol_info.filling_mode),
     }
     
     result = mt.order_send(request)
@@ -41,7 +41,12 @@ def place_market_order(symbol, order_type, lot_size, sl_points, tp_points):
 
 
     
-def start_mt5_bot(account_number, password, symbol="XAUUSD", lot_size=0.01, sl_points=100, tp_points=200):
+def start_mt5_bot(account_number, password, symbol="XAUUSD", lot_size=0.01, sl_points=100, tp_points=200, verbose=False, metrics=None, report_every=96):
+    """
+    Evaluate the strategy just after every M15 bar closes
+    Stage timings are printed every report_every bars, verbose also prints the last rows of the frame
+    """
+    metrics = metrics or Metrics()
     # Initialize connection to MetaTrader 5
     if not mt.initialize():
         print("MT5 initialization failed")
@@ -55,27 +60,46 @@ def start_mt5_bot(account_number, password, symbol="XAUUSD", lot_size=0.01, sl_p
     user_account = mt.account_info()
     print(f"Successfully logged in to account {user_account.login}")
     
+    scheduler = BarScheduler(mt.TIMEFRAME_M15)
+    tick = mt.symbol_info_tick(symbol)
+    if tick is not None:
+        scheduler.sync(tick.time)
+    bars = 0
+    # Imported once logged in, so a bad login or terminal fails without loading pandas
+    import pandas as pd
     try:
         while True:
             # Fetch latest data
-            rates = mt.copy_rates_from_pos(symbol, mt.TIMEFRAME_M15, 0, 60)
+            with metrics.timer('fetch', symbol):
+                rates = mt.copy_rates_from_pos(symbol, mt.TIMEFRAME_M15, 0, 60)
             if rates is None:
                 print("Failed to fetch rates")
                 continue
             
-            # Create DataFrame and calculate indicators
-            rates_frame = pd.DataFrame(rates)
-            rates_frame['time'] = pd.to_datetime(rates_frame['time'], unit='s')
-            rates_frame.set_index('time', inplace=True)
+            if not scheduler.is_new_bar(rates[-1]['time']):
+                # No new bar yet, nothing to evaluate
+                scheduler.wait(rates[-1]['time'])
+                continue
+            
+            bars += 1
+            metrics.count('bars', symbol)
             
-            # Calculate Median Price
-            rates_frame['Median_Price'] = (rates_frame['high'] + rates_frame['low']) / 2
+            # Create DataFrame and calculate indicators on the closed bars
+            with metrics.timer('frame', symbol):
+                rates_frame = pd.DataFrame(rates[:-1])
+                rates_frame['time'] = pd.to_datetime(rates_frame['time'], unit='s')
+                rates_frame.set_index('time', inplace=True)
             
-            # Calculate EMAs
-            rates_frame['EMA_Median_23'] = rates_frame['Median_Price'].ewm(span=23, adjust=False).mean()
-            rates_frame['EMA_Close_10'] = rates_frame['close'].ewm(span=10, adjust=False).mean()
+            with metrics.timer('indicators', symbol):
+                # Calculate Median Price
+                rates_frame['Median_Price'] = (rates_frame['high'] + rates_frame['low']) / 2
+                
+                # Calculate EMAs
+                rates_frame['EMA_Median_23'] = rates_frame['Median_Price'].ewm(span=23, adjust=False).mean()
+                rates_frame['EMA_Close_10'] = rates_frame['close'].ewm(span=10, adjust=False).mean()
             
             # Generate signals
+            signal_start = time.perf_counter()
             rates_frame['Signal'] = 0
             rates_frame.loc[(rates_frame['EMA_Close_10'].shift(1) < rates_frame['EMA_Median_23'].shift(1)) & 
                           (rates_frame['EMA_Close_10'] > rates_frame['EMA_Median_23']), 'Signal'] = 1  # Bullish
@@ -113,20 +137,26 @@ def start_mt5_bot(account_number, password, symbol="XAUUSD", lot_size=0.01, sl_p
                             # else:
                             #     print(f"Order failed: {result.comment if result else 'Unknown error'}")
             
+            metrics.record('signal', symbol, time.perf_counter() - signal_start)
+            
             # Position management
-            positions = mt.positions_get(symbol=symbol)
-            if positions:
-                for position in positions:
-                    # Check if we should close any positions based on your criteria
-                    # Add your position management logic here
-                    pass
+            with metrics.timer('positions', symbol):
+                positions = mt.positions_get(symbol=symbol)
+                if positions:
+                    for position in positions:
+                        # Check if we should close any positions based on your criteria
+                        # Add your position management logic here
+                        pass
             
             # display data
-            print("\nDisplay dataframe with data")
-            print(rates_frame)  
+            if verbose:
+                print("\nDisplay dataframe with data")
+                print(rates_frame)
+            if bars % report_every == 0:
+                metrics.report()
             
-            # Wait before next iteration (e.g., 1 minute)
-            time.sleep(60 * 5)
+            # Wait until the next bar closes
+            scheduler.wait(rates[-1]['time'])
             
     except KeyboardInterrupt:
         print("\nBot stopped by user")
@@ -135,6 +165,8 @@ def start_mt5_bot(account_number, password, symbol="XAUUSD", lot_size=0.01, sl_p
     finally:
         mt.shutdown()
         print("MetaTrader 5 connection closed")
+        metrics.report()
+        metrics.close()
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+"""
+Timing hooks for the trading loop: per-symbol stage histograms, counters and a JSON lines log
+
+    metrics = Metrics(log_path='pipbot.jsonl')
+    with metrics.timer('fetch', symbol):
+        ...
+    metrics.event('order', symbol, retcode=10009)
+    metrics.report()
+"""
+import json
+import math
+import threading
+import time
+
+# Histogram buckets: 10 per decade from 1 microsecond to 1000 seconds
+_BUCKETS_PER_DECADE = 10
+_BUCKETS = 9 * _BUCKETS_PER_DECADE + 1
+
+
+class Histogram:
+    """
+    Log-bucketed durations in seconds, constant memory and O(1) per sample
+    Percentiles are the upper edge of the bucket they fall in, within 26% of the value
+    """
+
+    def __init__(self):
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        micros = seconds * 1e6
+        index = int(math.log10(micros) * _BUCKETS_PER_DECADE) + 1 if micros >= 1 else 0
+        self.counts[min(index, _BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        if self.count == 0:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(10 ** (index / _BUCKETS_PER_DECADE) / 1e6, self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class _Timer:
+    __slots__ = ('metrics', 'key', 'start')
+
+    def __init__(self, metrics, key):
+        self.metrics = metrics
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.key[0], self.key[1], time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """
+    Stage timings and counters keyed by (stage, symbol), safe to share between threads
+    log_path appends one JSON object per event, buffered and written by flush()/close()
+    """
+
+    def __init__(self, log_path=None, buffer_size=256):
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.log = open(log_path, 'a', encoding='utf-8') if log_path else None
+        self.buffer = []
+        self.buffer_size = buffer_size
+
+    def timer(self, stage, symbol=None):
+        """
+        Context manager recording how long its block took
+        """
+        return _Timer(self, (stage, symbol))
+
+    def record(self, stage, symbol, seconds):
+        key = (stage, symbol)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.record(seconds)
+
+    def count(self, name, symbol=None, n=1):
+        key = (name, symbol)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def event(self, kind, symbol=None, **fields):
+        """
+        Structured log line, dropped when there is no log file
+        """
+        if self.log is None:
+            return
+        fields['ts'] = round(time.time(), 6)
+        fields['event'] = kind
+        if symbol is not None:
+            fields['symbol'] = symbol
+        line = json.dumps(fields, separators=(',', ':'), default=str)
+        with self.lock:
+            self.buffer.append(line)
+            if len(self.buffer) < self.buffer_size:
+                return
+            lines, self.buffer = self.buffer, []
+        self._write(lines)
+
+    def _write(self, lines):
+        self.log.write('\n'.join(lines) + '\n')
+        self.log.flush()
+
+    def flush(self):
+        if self.log is None:
+            return
+        with self.lock:
+            lines, self.buffer = self.buffer, []
+        if lines:
+            self._write(lines)
+
+    def close(self):
+        self.flush()
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    def summary(self, symbol=False):
+        """
+        Timings in milliseconds and counters, per stage or per (stage, symbol) when symbol is True
+        """
+        with self.lock:
+            items = list(self.histograms.items())
+            counters = dict(self.counters)
+        merged = {}
+        for (stage, name), histogram in items:
+            key = f"{stage}/{name}" if symbol and name is not None else stage
+            total = merged.setdefault(key, Histogram())
+            total.counts = [a + b for a, b in zip(total.counts, histogram.counts)]
+            total.count += histogram.count
+            total.total += histogram.total
+            total.max = max(total.max, histogram.max)
+        stages = {
+            key: {
+                'count': histogram.count,
+                'p50_ms': histogram.percentile(50) * 1000,
+                'p99_ms': histogram.percentile(99) * 1000,
+                'max_ms': histogram.max * 1000,
+                'mean_ms': histogram.mean * 1000,
+            }
+            for key, histogram in sorted(merged.items())
+        }
+        totals = {}
+        for (name, name_symbol), value in counters.items():
+            key = f"{name}/{name_symbol}" if symbol and name_symbol is not None else name
+            totals[key] = totals.get(key, 0) + value
+        return {'uptime': time.time() - self.started, 'stages': stages, 'counters': dict(sorted(totals.items()))}
+
+    def report(self, symbol=False):
+        """
+        Print the summary as a table
+        """
+        summary = self.summary(symbol)
+        print(f"{'stage':<32}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for stage, row in summary['stages'].items():
+            print(f"{stage:<32}{row['count']:>8}{row['p50_ms']:>10.3f}{row['p99_ms']:>10.3f}{row['max_ms']:>10.3f}")
+        if summary['counters']:
+            print(", ".join(f"{name}={value}" for name, value in summary['counters'].items()))
@@ -1,15 +1,29 @@
 import MetaTrader5 as mt
 import os
 from dotenv import load_dotenv
-import pytz
-import datetime
-import pandas as pd
 import time
+import checkpoint
+import orders
+from bar_cache import BarCacheStore
+from indicators import format_bar_time
+from metrics import Metrics
+from positions import PositionBook
+from scheduler import BarScheduler
+from strategies import TrendStrengthStrategy
 load_dotenv()
 
 # mt.initialize()
 
-def start_mt5_bot(account_number, password, symbol="XAUUSD", lot_size=0.01, sl_points=100, tp_points=200):
+def start_mt5_bot(account_number, password, symbol="XAUUSD", lot_size=0.01, sl_points=100, tp_points=200, tick_latency=None, cache_dir=None, metrics=None, report_every=96, checkpoint_path=None):
+    """
+    Evaluate the strategy just after every M15 bar closes, or on every quote change
+    (polled every tick_latency seconds) when tick_latency is set
+    Bars are cached between cycles, and across restarts when cache_dir is given
+    Stage timings are printed every report_every evaluated bars
+    With checkpoint_path the indicator, strategy and position state is saved once per closed
+    bar and a restart continues from it
+    """
+    metrics = metrics or Metrics()
     # Initialize connection to MetaTrader 5
     if not mt.initialize():
         print("MT5 initialization failed")
@@ -23,141 +37,117 @@ def start_mt5_bot(account_number, password, symbol="XAUUSD", lot_size=0.01, sl_p
     user_account = mt.account_info()
     print(f"Successfully logged in to account {user_account.login}")
     
+    scheduler = BarScheduler(mt.TIMEFRAME_M15)
+    tick = mt.symbol_info_tick(symbol)
+    if tick is not None:
+        scheduler.sync(tick.time)
+    last_signal_bar = None
+    book = PositionBook(mt)
+    evaluated = 0
+    strategy = TrendStrengthStrategy()
+    # The runner's magic number for this symbol and strategy, only its positions are closed
+    magic = orders.magic_number(f"{symbol}/{type(strategy).__name__}/{mt.TIMEFRAME_M15}")
+    cache = BarCacheStore(cache_dir, capacity=strategy.lookback).get(symbol, mt.TIMEFRAME_M15)
+    saved = checkpoint.load(checkpoint_path)
+    checkpointed = None
+    failures = 0
     try:
         while True:
-            # Fetch latest data
-            rates = mt.copy_rates_from_pos(symbol, mt.TIMEFRAME_M15, 0, 100)  # Increased lookback period
-            if rates is None:
-                print("Failed to fetch rates")
+            # Fetch the bars added since the last cycle
+            with metrics.timer('fetch', symbol):
+                refreshed = cache.refresh(mt)
+                rates = cache.latest(strategy.lookback)
+            if refreshed is None:
+                # Back off instead of asking the terminal again at once
+                failures += 1
+                print(f"Failed to fetch rates ({failures} in a row)")
+                scheduler.sleep(min(scheduler.max_retry, 2 ** failures))
                 continue
+            failures = 0
             
-            # Create DataFrame and calculate indicators
-            rates_frame = pd.DataFrame(rates)
-            rates_frame['time'] = pd.to_datetime(rates_frame['time'], unit='s')
-            rates_frame.set_index('time', inplace=True)
+            # Continue from the checkpoint on top of the bars missed while stopped
+            if saved is not None:
+                fetch = lambda start, end: mt.copy_rates_range(symbol, mt.TIMEFRAME_M15, start, end)
+                if checkpoint.resume(saved, strategy, scheduler, cache.latest(), book, fetch):
+                    last_signal_bar = saved.get('last_signal_bar')
+                    print(f"Resumed from the checkpoint at {format_bar_time(strategy.bar_time)}")
+                saved = None
             
-            # Calculate multiple EMAs for trend confirmation
-            rates_frame['EMA_10'] = rates_frame['close'].ewm(span=10, adjust=False).mean()
-            rates_frame['EMA_20'] = rates_frame['close'].ewm(span=20, adjust=False).mean()
-            rates_frame['EMA_50'] = rates_frame['close'].ewm(span=50, adjust=False).mean()
-            
-            # Calculate RSI for trend strength
-            delta = rates_frame['close'].diff()
-            gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-            loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-            rs = gain / loss
-            rates_frame['RSI'] = 100 - (100 / (1 + rs))
-            
-            # Calculate MACD for trend confirmation
-            exp1 = rates_frame['close'].ewm(span=12, adjust=False).mean()
-            exp2 = rates_frame['close'].ewm(span=26, adjust=False).mean()
-            rates_frame['MACD'] = exp1 - exp2
-            rates_frame['Signal_Line'] = rates_frame['MACD'].ewm(span=9, adjust=False).mean()
-            
-            # Analyze trend strength
-            def analyze_trend_strength(row):
-                strength = 0
-                
-                # EMA alignment check (trend structure)
-                if row['EMA_10'] > row['EMA_20'] > row['EMA_50']:
-                    strength += 1  # Bullish alignment
-                elif row['EMA_10'] < row['EMA_20'] < row['EMA_50']:
-                    strength -= 1  # Bearish alignment
-                
-                # RSI trend check
-                if row['RSI'] > 50:
-                    strength += 0.5
-                elif row['RSI'] < 50:
-                    strength -= 0.5
-                
-                # MACD confirmation
-                if row['MACD'] > row['Signal_Line']:
-                    strength += 0.5
-                elif row['MACD'] < row['Signal_Line']:
-                    strength -= 0.5
-                
-                return strength
+            if tick_latency is None and not scheduler.is_new_bar(rates[-1]['time']):
+                # No new bar yet, nothing to evaluate
+                scheduler.wait(rates[-1]['time'])
+                continue
             
-            # Calculate trend strength for each row
-            rates_frame['Trend_Strength'] = rates_frame.apply(analyze_trend_strength, axis=1)
+            # Trend strength signal with pullback confirmation for the latest candle
+            # Right after a bar closes that bar is evaluated, in tick mode the forming bar is
+            with metrics.timer('indicators', symbol):
+                strategy.update_indicators(rates, closed_only=tick_latency is None)
+            with metrics.timer('signal', symbol):
+                latest_signal = strategy.evaluate()
+            evaluated += 1
+            metrics.count('bars', symbol)
+            bar_time = format_bar_time(strategy.bar_time)
+            if latest_signal != 0:
+                if strategy.bar_time == last_signal_bar:
+                    latest_signal = 0  # Already acted on this bar
+                else:
+                    last_signal_bar = strategy.bar_time
             
-            # Generate trading signals based on trend strength and confirmations
-            def generate_signal(df):
-                current_strength = df['Trend_Strength'].iloc[-1]
-                prev_strength = df['Trend_Strength'].iloc[-2]
-                
-                # Check for strong trend confirmation
-                if current_strength >= 1.5 and prev_strength < 1.5:
-                    return 1  # Strong bullish signal
-                elif current_strength <= -1.5 and prev_strength > -1.5:
-                    return -1  # Strong bearish signal
-                return 0
+            # Execute trades based on signals
+            if latest_signal == 1:  # Bullish signal
+                print(f"Strong bullish trend detected at {bar_time}")
+                print(f"Trend Strength: {strategy.strength}")
+                # Uncomment to enable actual trading
+                # result = orders.place_market_order(mt, symbol, "BUY", lot_size, sl_points, tp_points, magic=magic)
+                # if result and result.retcode == mt.TRADE_RETCODE_DONE:
+                #     print(f"Buy order placed successfully: {result.order}")
             
-            # Generate signal for the latest candle
-            latest_signal = generate_signal(rates_frame)
+            elif latest_signal == -1:  # Bearish signal
+                print(f"Strong bearish trend detected at {bar_time}")
+                print(f"Trend Strength: {strategy.strength}")
+                # Uncomment to enable actual trading
+                # result = orders.place_market_order(mt, symbol, "SELL", lot_size, sl_points, tp_points, magic=magic)
+                # if result and result.retcode == mt.TRADE_RETCODE_DONE:
+                #     print(f"Sell order placed successfully: {result.order}")
             
-            # Execute trades based on signals
-            if latest_signal != 0:
-                # Additional trend confirmation
-                recent_candles = rates_frame.tail(5)
-                price_range = recent_candles['high'].max() - recent_candles['low'].min()
-                atr = rates_frame['high'].subtract(rates_frame['low']).rolling(14).mean().iloc[-1]
-                
-                if latest_signal == 1:  # Bullish signal
-                    # Check for pullback completion
-                    if (rates_frame['close'].iloc[-1] > rates_frame['EMA_10'].iloc[-1] and 
-                        rates_frame['RSI'].iloc[-1] > 40 and 
-                        price_range < atr * 2):  # Controlled volatility
-                        print(f"Strong bullish trend detected at {rates_frame.index[-1]}")
-                        print(f"Trend Strength: {rates_frame['Trend_Strength'].iloc[-1]}")
-                        # Uncomment to enable actual trading
-                        # result = place_market_order(symbol, "BUY", lot_size, sl_points, tp_points)
-                        # if result and result.retcode == mt.TRADE_RETCODE_DONE:
-                        #     print(f"Buy order placed successfully: {result.order}")
-                
-                elif latest_signal == -1:  # Bearish signal
-                    # Check for pullback completion
-                    if (rates_frame['close'].iloc[-1] < rates_frame['EMA_10'].iloc[-1] and 
-                        rates_frame['RSI'].iloc[-1] < 60 and 
-                        price_range < atr * 2):  # Controlled volatility
-                        print(f"Strong bearish trend detected at {rates_frame.index[-1]}")
-                        print(f"Trend Strength: {rates_frame['Trend_Strength'].iloc[-1]}")
-                        # Uncomment to enable actual trading
-                        # result = place_market_order(symbol, "SELL", lot_size, sl_points, tp_points)
-                        # if result and result.retcode == mt.TRADE_RETCODE_DONE:
-                        #     print(f"Sell order placed successfully: {result.order}")
+            # Position management, one account-wide snapshot and one exit decision per cycle
+            position_start = time.perf_counter()
+            book.refresh()
+            for position in book.to_close(symbol, strategy, magic=magic):
+                # Close position if trend weakens significantly
+                print(f"Closing position due to trend reversal. Profit: {position.profit}")
+                # Uncomment to enable actual trading
+                # close_position(position.ticket)
             
-            # Position management
-            positions = mt.positions_get(symbol=symbol)
-            if positions:
-                for position in positions:
-                    current_profit = position.profit
-                    position_type = position.type  # 0 for buy, 1 for sell
-                    
-                    # Dynamic position management based on trend strength
-                    current_trend = rates_frame['Trend_Strength'].iloc[-1]
-                    
-                    # Close position if trend weakens significantly
-                    if (position_type == 0 and current_trend < -1) or \
-                       (position_type == 1 and current_trend > 1):
-                        print(f"Closing position due to trend reversal. Profit: {current_profit}")
-                        # Uncomment to enable actual trading
-                        # close_position(position.ticket)
+            metrics.record('positions', symbol, time.perf_counter() - position_start)
+            # Once per closed bar and signal, not on every tick
+            if checkpoint_path and (rates[-2]['time'], last_signal_bar) != checkpointed:
+                checkpointed = (rates[-2]['time'], last_signal_bar)
+                checkpoint.save(checkpoint_path, checkpoint.capture(strategy, scheduler, book,
+                                                                    last_signal_bar=last_signal_bar))
+            if evaluated % report_every == 0:
+                metrics.report()
             
             # Display data
             # print("\nLatest market analysis:")
-            # print(rates_frame[['close', 'EMA_10', 'EMA_20', 'EMA_50', 'RSI', 'MACD', 'Trend_Strength']].tail())
+            # print({name: strategy.latest[name] for name in ('close', 'EMA_10', 'EMA_20', 'EMA_50', 'RSI', 'MACD')}, strategy.strength)
             
-            # Wait before next iteration
-            time.sleep(60 * 5)
+            # Wait for the next bar to close, or for the next quote in tick mode
+            if tick_latency is None:
+                scheduler.wait(rates[-1]['time'])
+            else:
+                tick = scheduler.wait_for_tick(lambda: mt.symbol_info_tick(symbol), tick, tick_latency)
             
     except KeyboardInterrupt:
         print("\nBot stopped by user")
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
+        cache.flush()
         mt.shutdown()
         print("MetaTrader 5 connection closed")
+        metrics.report()
+        metrics.close()
 
 
 
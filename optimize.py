@@ -0,0 +1,161 @@
+"""
+Grid or random search over the refinedmain.py strategy parameters on a process pool
+
+    python optimize.py GBPUSD_M15.npy --fast-span 5:20:1 --slow-span 15:40:1 \
+        --sl-points 50 100 150 --tp-points 100:400:50 --random 5000 --output results.csv
+
+Every worker memory-maps the same .npy bar history read-only, so the bars are
+neither pickled nor copied per worker. Histories in other formats are converted
+to a temporary .npy file first.
+"""
+import argparse
+import functools
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from backtest import crossover_entries, ema, simulate_trades, summarize
+from rates import RATES_DTYPE, load_rates
+
+_rates = None
+_settings = None
+
+
+def _init_worker(history_path, settings):
+    global _rates, _settings
+    _rates = np.load(history_path, mmap_mode='r')
+    _settings = settings
+
+
+@functools.lru_cache(maxsize=32)
+def _ema(field, span):
+    if field == 'median':
+        return ema((_rates['high'] + _rates['low']) / 2, span)
+    return ema(_rates[field], span)
+
+
+def evaluate(params):
+    """
+    Backtest one parameter combination in a worker, EMAs are reused between combinations
+    """
+    ema_close = _ema('close', params['fast_span'])
+    ema_median = _ema('median', params['slow_span'])
+    entries = crossover_entries(ema_close, ema_median, params['trend_period'], params['trend_ratio'])
+    trades = simulate_trades(_rates, *entries, params['sl_points'], params['tp_points'], params['lot_size'],
+                             _settings['point'], _settings['contract_size'])
+    return {**params, **summarize(trades)}
+
+
+def parse_values(values, cast):
+    """
+    Command line values, 'start:stop:step' expands to an inclusive range
+    """
+    result = []
+    for value in values:
+        if ':' in value:
+            start, stop, step = (cast(part) for part in value.split(':'))
+            result.extend(cast(x) for x in np.arange(start, stop + step / 2, step))
+        else:
+            result.append(cast(value))
+    return result
+
+
+def combinations(grid, samples=None, seed=0):
+    """
+    Every combination of the grid, or samples random ones without repeats
+    Combinations where the fast EMA is not faster than the slow one are skipped
+    """
+    names = list(grid)
+    sizes = [len(grid[name]) for name in names]
+    total = int(np.prod(sizes))
+    if samples is None or samples >= total:
+        indexes = range(total)
+    else:
+        indexes = random.Random(seed).sample(range(total), samples)
+
+    for index in indexes:
+        positions = []
+        for size in reversed(sizes):
+            index, position = divmod(index, size)
+            positions.append(position)
+        params = {name: grid[name][position] for name, position in zip(names, reversed(positions))}
+        if params['fast_span'] < params['slow_span']:
+            yield params
+
+
+def optimize(history_path, grid, samples=None, workers=None, point=0.00001, contract_size=100000, seed=0):
+    """
+    Run every combination on a process pool, returns one result per combination
+    """
+    settings = {'point': point, 'contract_size': contract_size}
+    params = list(combinations(grid, samples, seed))
+    workers = workers or os.cpu_count()
+    chunksize = max(1, len(params) // (workers * 8))
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(history_path, settings)) as pool:
+        return list(pool.map(evaluate, params, chunksize=chunksize))
+
+
+def write_results(path, results, rank_by):
+    """
+    Write results best first, as CSV or JSON depending on the extension
+    """
+    import pandas as pd
+
+    frame = pd.DataFrame(results).sort_values(rank_by, ascending=False, kind='stable')
+    if path.endswith('.json'):
+        frame.to_json(path, orient='records', indent=2)
+    else:
+        frame.to_csv(path, index=False)
+    return frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parameter sweep of the refinedmain.py EMA crossover strategy")
+    parser.add_argument('history', help="bar history (.npy is memory-mapped directly, .csv/.parquet are converted)")
+    parser.add_argument('--fast-span', nargs='+', default=['10'])
+    parser.add_argument('--slow-span', nargs='+', default=['23'])
+    parser.add_argument('--sl-points', nargs='+', default=['100'])
+    parser.add_argument('--tp-points', nargs='+', default=['200'])
+    parser.add_argument('--lot-size', nargs='+', default=['0.01'])
+    parser.add_argument('--trend-period', nargs='+', default=['5'])
+    parser.add_argument('--trend-ratio', nargs='+', default=['0.6'])
+    parser.add_argument('--random', type=int, help="sample this many combinations instead of the full grid")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, help="defaults to the number of cores")
+    parser.add_argument('--point', type=float, default=0.00001, help="symbol_info(symbol).point")
+    parser.add_argument('--contract-size', type=float, default=100000)
+    parser.add_argument('--rank-by', default='total_pnl', help="summary column to rank by, highest first")
+    parser.add_argument('--output', default='optimize_results.csv')
+    args = parser.parse_args()
+
+    grid = {
+        'fast_span': parse_values(args.fast_span, int),
+        'slow_span': parse_values(args.slow_span, int),
+        'sl_points': parse_values(args.sl_points, float),
+        'tp_points': parse_values(args.tp_points, float),
+        'lot_size': parse_values(args.lot_size, float),
+        'trend_period': parse_values(args.trend_period, int),
+        'trend_ratio': parse_values(args.trend_ratio, float),
+    }
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as directory:
+        history_path = args.history
+        if not history_path.endswith('.npy'):
+            history_path = os.path.join(directory, 'history.npy')
+            np.save(history_path, load_rates(args.history))
+        elif np.load(history_path, mmap_mode='r').dtype != RATES_DTYPE:
+            raise SystemExit(f"{args.history} is not a copy_rates_from_pos structured array")
+        results = optimize(history_path, grid, args.random, args.workers, args.point, args.contract_size, args.seed)
+
+    frame = write_results(args.output, results, args.rank_by)
+    print(f"{len(results)} combinations in {time.perf_counter() - start:.1f}s, results written to {args.output}")
+    print(frame.head(10).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
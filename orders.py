@@ -0,0 +1,310 @@
+"""
+Market order placement shared by the bots
+
+SymbolCache keeps the static symbol_info fields so an order only needs a fresh tick,
+send_market_order retries requotes inside the deviation budget, and OrderExecutor
+sends orders from a worker queue so the signal loop never waits on the terminal.
+"""
+import collections
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+
+import numpy as np
+
+SymbolSpec = collections.namedtuple('SymbolSpec', ['name', 'point', 'digits', 'filling_mode', 'volume_min',
+                                                   'volume_max', 'volume_step', 'trade_contract_size',
+                                                   'currency_base', 'currency_profit'])
+
+
+class SymbolCache:
+    """
+    symbol_info fields that do not change during a session, fetched once per symbol
+    call runs the broker calls (e.g. BotRunner.call to hold the terminal lock)
+    """
+
+    def __init__(self, broker, call=None):
+        self.broker = broker
+        self.call = call or (lambda func, *args: func(*args))
+        self.specs = {}
+
+    def get(self, symbol):
+        spec = self.specs.get(symbol)
+        if spec is None:
+            info = self.call(self.broker.symbol_info, symbol)
+            if info is None:
+                return None
+            spec = SymbolSpec(symbol, info.point, info.digits, info.filling_mode, info.volume_min,
+                              info.volume_max, info.volume_step, info.trade_contract_size,
+                              info.currency_base, info.currency_profit)
+            self.specs[symbol] = spec
+        return spec
+
+    def invalidate(self, symbol=None):
+        if symbol is None:
+            self.specs.clear()
+        else:
+            self.specs.pop(symbol, None)
+
+
+def magic_number(name, base=234000):
+    """
+    The magic number of one bot, e.g. a BotRunner job name, the same across restarts
+    Positions are told apart by it, so bots trading one symbol only close their own
+    """
+    return base + zlib.crc32(name.encode()) % 100000
+
+
+def filling_type(broker, filling_mode):
+    """
+    The type_filling a symbol accepts, from its symbol_info().filling_mode flags
+    IOC when allowed, then FOK, RETURN when the symbol allows neither
+    """
+    if filling_mode & broker.SYMBOL_FILLING_IOC:
+        return broker.ORDER_FILLING_IOC
+    if filling_mode & broker.SYMBOL_FILLING_FOK:
+        return broker.ORDER_FILLING_FOK
+    return broker.ORDER_FILLING_RETURN
+
+
+def build_market_order(broker, symbol, order_type, lot_size, sl_points, tp_points, point, price,
+                       deviation=20, magic=234000, filling=None, comment=None):
+    """
+    Market order request with stop loss and take profit sl_points / tp_points away from price
+    filling is the type_filling, filling_type() of the symbol; IOC when not given
+    """
+    return {
+        "action": broker.TRADE_ACTION_DEAL,
+        "symbol": symbol,
+        "volume": lot_size,
+        "type": broker.ORDER_TYPE_BUY if order_type == 'BUY' else broker.ORDER_TYPE_SELL,
+        "price": price,
+        "sl": price - sl_points * point if order_type == 'BUY' else price + sl_points * point,
+        "tp": price + tp_points * point if order_type == 'BUY' else price - tp_points * point,
+        "deviation": deviation,
+        "magic": magic,
+        "comment": comment or f"PipBot {order_type} order",
+        "type_time": broker.ORDER_TIME_GTC,
+        "type_filling": broker.ORDER_FILLING_IOC if filling is None else filling,
+    }
+
+
+def close_position(broker, position, deviation=20, filling_mode=None):
+    """
+    Close a position with an opposite market deal at the current quote
+    MetaTrader5 has no close call, the deal names the position it closes. Returns the
+    order_send result, None when there is no quote. filling_mode is the symbol's
+    symbol_info().filling_mode, looked up when not given.
+    """
+    if filling_mode is None:
+        info = broker.symbol_info(position.symbol)
+        if info is None:
+            return None
+        filling_mode = info.filling_mode
+    tick = broker.symbol_info_tick(position.symbol)
+    if tick is None:
+        return None
+    is_buy = position.type == broker.POSITION_TYPE_BUY
+    return broker.order_send({
+        "action": broker.TRADE_ACTION_DEAL,
+        "symbol": position.symbol,
+        "volume": position.volume,
+        "type": broker.ORDER_TYPE_SELL if is_buy else broker.ORDER_TYPE_BUY,
+        "position": position.ticket,
+        "price": tick.bid if is_buy else tick.ask,
+        "deviation": deviation,
+        "magic": position.magic,
+        "comment": "PipBot close",
+        "type_time": broker.ORDER_TIME_GTC,
+        "type_filling": filling_type(broker, filling_mode),
+    })
+
+
+def send_market_order(broker, symbol, order_type, lot_size, sl_points, tp_points, spec, deviation=20,
+                      max_retries=3, call=None, report=None, comment=None, magic=234000):
+    """
+    Send a market order at the current quote, resending it on requote / price changed
+    Every attempt must fill within `deviation` points of the first quote: a resend goes
+    out at the new quote with only the deviation that is left, and is not sent at all
+    once the quote has moved further than that. report, when given, is a dict that
+    receives the requested price, the attempts and the send / fill times.
+    """
+    call = call or (lambda func, *args: func(*args))
+    report = {} if report is None else report
+    # Retcodes that only mean the price moved, the order can go again at the new price
+    retry_retcodes = (broker.TRADE_RETCODE_REQUOTE, broker.TRADE_RETCODE_PRICE_CHANGED)
+    first_price = None
+    result = None
+    for attempt in range(max_retries + 1):
+        tick = call(broker.symbol_info_tick, symbol)
+        if tick is None:
+            break
+        price = tick.ask if order_type == 'BUY' else tick.bid
+        if first_price is None:
+            first_price = price
+            report['requested'] = price
+        budget = deviation - round(abs(price - first_price) / spec.point)
+        if budget < 0:
+            break
+
+        request = build_market_order(broker, symbol, order_type, lot_size, sl_points, tp_points, spec.point,
+                                     price, budget, magic, filling=filling_type(broker, spec.filling_mode),
+                                     comment=comment)
+        report['attempts'] = attempt + 1
+        report.setdefault('sent', time.perf_counter())
+        result = call(broker.order_send, request)
+        if result is None or result.retcode not in retry_retcodes:
+            break
+    report['filled'] = time.perf_counter()
+    return result
+
+
+def place_market_order(broker, symbol, order_type, lot_size, sl_points, tp_points, symbols=None, max_retries=3,
+                       comment=None, magic=234000):
+    """
+    Place a market order with stop loss and take profit
+    broker is the MetaTrader5 module or any broker.Broker, symbols a SymbolCache to reuse
+    """
+    spec = (symbols or SymbolCache(broker)).get(symbol)
+    if spec is None:
+        print(f"Symbol {symbol} not found")
+        return None
+    return send_market_order(broker, symbol, order_type, lot_size, sl_points, tp_points, spec,
+                             max_retries=max_retries, comment=comment, magic=magic)
+
+
+class OrderExecutor:
+    """
+    Sends market orders from a worker queue and records per-order latency
+
+    submit() returns at once with a concurrent.futures.Future of the order_send result.
+    Each finished order appends a record with the signal -> send and send -> fill times
+    in seconds and the slippage in points against the price quoted when it was sent.
+    """
+
+    def __init__(self, broker, call=None, workers=1, max_retries=3, deviation=20, history=10000, metrics=None):
+        self.broker = broker
+        self.metrics = metrics
+        self.call = call or (lambda func, *args: func(*args))
+        self.symbols = SymbolCache(broker, self.call)
+        self.max_retries = max_retries
+        self.deviation = deviation
+        self.records = collections.deque(maxlen=history)
+        self.queue = queue.Queue()
+        self.threads = [threading.Thread(target=self._work, name=f"orders-{n}", daemon=True)
+                        for n in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, symbol, order_type, lot_size, sl_points, tp_points, signal_time=None, magic=234000):
+        """
+        Queue an order, signal_time is the time.perf_counter() when the signal was generated
+        """
+        order = (symbol, order_type, lot_size, sl_points, tp_points, magic)
+        return self._submit(self._send, order, signal_time or time.perf_counter())
+
+    def submit_close(self, position, signal_time=None):
+        """
+        Queue closing a position, returns a Future of the positions_close result
+        """
+        return self._submit(self._close, position, signal_time or time.perf_counter())
+
+    def _submit(self, func, *args):
+        future = Future()
+        self.queue.put((future, func, args))
+        return future
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            future, func, args = item
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    def _send(self, order, signal_time):
+        symbol, order_type, lot_size, sl_points, tp_points, magic = order
+        spec = self.symbols.get(symbol)
+        if spec is None:
+            print(f"Symbol {symbol} not found")
+            return None
+
+        report = {}
+        result = send_market_order(self.broker, symbol, order_type, lot_size, sl_points, tp_points, spec,
+                                   self.deviation, self.max_retries, self.call, report, magic=magic)
+        sent = report.get('sent', report['filled'])
+        filled = result is not None and result.retcode == self.broker.TRADE_RETCODE_DONE
+        slippage = None
+        if filled and 'requested' in report:
+            # Positive when the fill was worse than the quote
+            direction = 1 if order_type == 'BUY' else -1
+            slippage = direction * (result.price - report['requested']) / spec.point
+        record = {
+            'symbol': symbol,
+            'type': order_type,
+            'retcode': result.retcode if result is not None else None,
+            'filled': filled,
+            'attempts': report.get('attempts', 0),
+            'signal_to_send': sent - signal_time,
+            'send_to_fill': report['filled'] - sent,
+            'slippage': slippage,
+        }
+        self.records.append(record)
+        if self.metrics is not None:
+            self.metrics.record('order_queue', symbol, record['signal_to_send'])
+            self.metrics.record('order_fill', symbol, record['send_to_fill'])
+            self.metrics.count('orders_filled' if filled else 'orders_failed', symbol)
+            if record['attempts'] > 1:
+                self.metrics.count('order_retries', symbol, record['attempts'] - 1)
+            self.metrics.event('order', **record)
+        return result
+
+    def _close(self, position, signal_time):
+        sent = time.perf_counter()
+        result = self.call(self.broker.positions_close, position.ticket)
+        if self.metrics is not None:
+            self.metrics.record('close_queue', position.symbol, sent - signal_time)
+            self.metrics.record('close_fill', position.symbol, time.perf_counter() - sent)
+        return result
+
+    def join(self):
+        """
+        Wait until every queued order was sent
+        """
+        self.queue.join()
+
+    def stats(self):
+        """
+        Latency percentiles in milliseconds, fill and retry counts and slippage in points
+        """
+        records = list(self.records)
+        if not records:
+            return {'orders': 0}
+        signal_to_send = np.array([record['signal_to_send'] for record in records]) * 1000
+        send_to_fill = np.array([record['send_to_fill'] for record in records]) * 1000
+        slippage = [record['slippage'] for record in records if record['slippage'] is not None]
+        return {
+            'orders': len(records),
+            'filled': sum(record['filled'] for record in records),
+            'retried': sum(record['attempts'] > 1 for record in records),
+            'signal_to_send_p50_ms': float(np.percentile(signal_to_send, 50)),
+            'signal_to_send_p99_ms': float(np.percentile(signal_to_send, 99)),
+            'send_to_fill_p50_ms': float(np.percentile(send_to_fill, 50)),
+            'send_to_fill_p99_ms': float(np.percentile(send_to_fill, 99)),
+            'slippage_mean': float(np.mean(slippage)) if slippage else 0.0,
+            'slippage_max': float(np.max(slippage)) if slippage else 0.0,
+        }
+
+    def stop(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
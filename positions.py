@@ -0,0 +1,133 @@
+"""
+Account-wide position tracking from one positions_get() snapshot per cycle
+
+Every symbol of an account shares the snapshot, so broker round trips grow with the
+number of accounts instead of symbols x positions. Each refresh is diffed against the
+previous snapshot into opened / closed / modified events.
+"""
+import collections
+import threading
+import time
+
+# Fields whose change makes a position "modified"
+_TRACKED = ('sl', 'tp', 'volume')
+
+# What state() keeps of a position, enough to diff against and report on
+SavedPosition = collections.namedtuple('SavedPosition', ['ticket', 'symbol', 'type', 'magic', 'volume',
+                                                         'price_open', 'sl', 'tp', 'profit'])
+
+
+class PositionBook:
+    """
+    The open positions of one account, indexed by ticket, symbol and magic number
+    call runs the broker calls (e.g. BotRunner.call to hold the terminal lock)
+    """
+
+    def __init__(self, broker, call=None, clock=time.monotonic):
+        self.broker = broker
+        self.call = call or (lambda func, *args, **kwargs: func(*args, **kwargs))
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.by_ticket = {}
+        self.by_symbol = {}
+        self.by_magic = {}
+        self.updated = None
+        self.pending_close = set()
+        self.listeners = []
+
+    def refresh(self):
+        """
+        Take a new snapshot, returns the (event, position) pairs it differs by
+        """
+        positions = self.call(self.broker.positions_get)
+        if positions is None:
+            return []
+        with self.lock:
+            return self._apply(positions)
+
+    def snapshot(self, max_age=1.0):
+        """
+        Refresh unless the snapshot is younger than max_age seconds
+        Jobs evaluated at the same bar close share one positions_get call this way
+        """
+        with self.lock:
+            fresh = self.updated is not None and self.clock() - self.updated < max_age
+        if not fresh:
+            self.refresh()
+        return self
+
+    def _apply(self, positions):
+        current = {position.ticket: position for position in positions}
+        events = []
+        for ticket, position in current.items():
+            previous = self.by_ticket.get(ticket)
+            if previous is None:
+                events.append(('opened', position))
+            elif any(getattr(previous, name) != getattr(position, name) for name in _TRACKED):
+                events.append(('modified', position))
+        for ticket, position in self.by_ticket.items():
+            if ticket not in current:
+                events.append(('closed', position))
+                self.pending_close.discard(ticket)
+        self._index(current)
+
+        for event, position in events:
+            for listener in list(self.listeners):
+                listener(event, position)
+        return events
+
+    def _index(self, current):
+        by_symbol = {}
+        by_magic = {}
+        for position in current.values():
+            by_symbol.setdefault(position.symbol, []).append(position)
+            by_magic.setdefault(position.magic, []).append(position)
+        self.by_ticket = current
+        self.by_symbol = by_symbol
+        self.by_magic = by_magic
+        self.updated = self.clock()
+
+    def state(self):
+        """
+        The last snapshot as plain tuples, for checkpoint.save()
+        """
+        with self.lock:
+            return [tuple(SavedPosition(*(getattr(position, name) for name in SavedPosition._fields)))
+                    for position in self.by_ticket.values()]
+
+    def load_state(self, rows):
+        """
+        Start from a saved snapshot, the next refresh() reports what changed since as events
+        """
+        with self.lock:
+            self._index({row[0]: SavedPosition(*row) for row in rows})
+            self.updated = None
+
+    def for_symbol(self, symbol, magic=None):
+        positions = self.by_symbol.get(symbol, ())
+        if magic is not None:
+            positions = [position for position in positions if position.magic == magic]
+        return tuple(positions)
+
+    def to_close(self, symbol, strategy, magic=None, sides=None):
+        """
+        Positions of symbol the strategy's exit rule closes, evaluated once for the symbol
+        sides is strategy.exit_sides() when the caller already has it
+        Tickets already being closed are left out
+        """
+        positions = [position for position in self.for_symbol(symbol, magic)
+                     if position.ticket not in self.pending_close]
+        if not positions:
+            return []
+        close_long, close_short = sides or strategy.exit_sides()
+        return [position for position in positions
+                if (position.type == 0 and close_long) or (position.type == 1 and close_short)]
+
+    def closing(self, ticket):
+        """
+        Mark a ticket as being closed until a snapshot no longer has it
+        """
+        self.pending_close.add(ticket)
+
+    def close_failed(self, ticket):
+        self.pending_close.discard(ticket)
@@ -0,0 +1,107 @@
+import os
+
+import numpy as np
+
+# Layout of the arrays returned by MetaTrader5 copy_rates_from_pos / copy_rates_from / copy_rates_range
+RATES_DTYPE = np.dtype([
+    ('time', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('tick_volume', '<u8'),
+    ('spread', '<i4'),
+    ('real_volume', '<u8'),
+])
+
+# Bar length of the MetaTrader5 TIMEFRAME_* constants, keyed by their values
+TIMEFRAME_SECONDS = {
+    1: 60,  # TIMEFRAME_M1
+    5: 5 * 60,  # TIMEFRAME_M5
+    15: 15 * 60,  # TIMEFRAME_M15
+    30: 30 * 60,  # TIMEFRAME_M30
+    16385: 60 * 60,  # TIMEFRAME_H1
+    16388: 4 * 60 * 60,  # TIMEFRAME_H4
+    16408: 24 * 60 * 60,  # TIMEFRAME_D1
+}
+
+
+def synthetic_rates(bars, seed=0, start=1262304000, timeframe=15, price=1.25, volatility=0.0004, spread=10):
+    """
+    Seeded random walk bars in the copy_rates_from_pos layout, for offline runs and benchmarks
+    """
+    rng = np.random.default_rng(seed)
+    bar_seconds = TIMEFRAME_SECONDS[timeframe]
+    rates = np.zeros(bars, dtype=RATES_DTYPE)
+    close = price * np.exp(np.cumsum(rng.normal(0, volatility, bars)))
+    opens = np.concatenate([[price], close[:-1]])
+    wick = np.abs(rng.normal(0, volatility / 2, (2, bars))) * close
+    rates['time'] = start // bar_seconds * bar_seconds + np.arange(bars) * bar_seconds
+    rates['open'] = opens
+    rates['close'] = close
+    rates['high'] = np.maximum(opens, close) + wick[0]
+    rates['low'] = np.minimum(opens, close) - wick[1]
+    rates['tick_volume'] = rng.integers(50, 2000, bars)
+    rates['spread'] = spread
+    return rates
+
+
+def to_rates(frame):
+    """
+    Convert a DataFrame (time as epoch seconds or datetimes) to a RATES_DTYPE array
+    Missing tick_volume, spread and real_volume columns are filled with 0
+    """
+    import pandas as pd
+
+    rates = np.zeros(len(frame), dtype=RATES_DTYPE)
+    time_column = frame['time'] if 'time' in frame else frame.index.to_series()
+    if pd.api.types.is_datetime64_any_dtype(time_column):
+        rates['time'] = pd.to_datetime(time_column).to_numpy(dtype='datetime64[s]').astype('<i8')
+    else:
+        rates['time'] = time_column.to_numpy()
+    for name in RATES_DTYPE.names[1:]:
+        if name in frame:
+            rates[name] = frame[name].to_numpy()
+    return rates
+
+
+def load_rates(path):
+    """
+    Load a stored bar history as a RATES_DTYPE array
+    Supports .npy (structured array as saved by save_rates), .csv and .parquet
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        return np.load(path).astype(RATES_DTYPE, copy=False)
+
+    import pandas as pd
+
+    if extension == '.csv':
+        frame = pd.read_csv(path)
+        if frame['time'].dtype == object:
+            frame['time'] = pd.to_datetime(frame['time'])
+    elif extension == '.parquet':
+        frame = pd.read_parquet(path)
+    else:
+        raise ValueError(f"Unsupported bar history format: {path}")
+    return to_rates(frame)
+
+
+def save_rates(path, rates):
+    """
+    Save a copy_rates_from_pos array, the format follows the file extension
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        np.save(path, np.asarray(rates, dtype=RATES_DTYPE))
+        return
+
+    import pandas as pd
+
+    frame = pd.DataFrame(rates)
+    if extension == '.csv':
+        frame.to_csv(path, index=False)
+    elif extension == '.parquet':
+        frame.to_parquet(path, index=False)
+    else:
+        raise ValueError(f"Unsupported bar history format: {path}")
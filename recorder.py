@@ -0,0 +1,360 @@
+"""
+Local market data history: bars and tick snapshots appended to a chunked columnar store
+
+    python recorder.py data/market GBPUSD EURUSD --timeframes M1 M15 --tick-interval 1
+
+Each symbol and stream (ticks, bars_M15, ...) is a directory of chunks holding a fixed
+number of rows, one .npy file per column. The open chunk is a preallocated memmap that
+grows in place; full chunks are sealed and all but the newest `keep_raw` sealed chunks
+are compressed into a single .npz. Uncompressed chunks are read as memmap views, so a
+range inside one chunk costs no copy and chunks() walks months of data one chunk at a time.
+"""
+import argparse
+import os
+import shutil
+import time
+
+import numpy as np
+
+from bar_cache import _RANGE_AHEAD
+from rates import RATES_DTYPE, TIMEFRAME_SECONDS
+
+TICK_DTYPE = np.dtype([
+    ('time_msc', '<i8'),
+    ('bid', '<f8'),
+    ('ask', '<f8'),
+    ('last', '<f8'),
+    ('volume', '<u8'),
+    ('flags', '<u4'),
+])
+
+# Index columns: first time, last time, rows, compressed
+_INDEX_COLUMNS = 4
+
+
+class ChunkedColumns:
+    """
+    Append-only columnar store of one dtype, ordered by its first (time) field
+    """
+
+    def __init__(self, path, dtype, chunk_rows=65536, keep_raw=4):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.time_field = self.dtype.names[0]
+        self.chunk_rows = chunk_rows
+        self.keep_raw = keep_raw
+        os.makedirs(path, exist_ok=True)
+        index_path = os.path.join(path, 'index.npy')
+        self.index = np.load(index_path) if os.path.exists(index_path) else \
+            np.zeros((0, _INDEX_COLUMNS), dtype='<i8')
+        self.open_chunk = None
+        self.open_count = None
+        if len(self.index) and not self.index[-1, 3] and self._raw_rows(len(self.index) - 1) < chunk_rows:
+            self._open(len(self.index) - 1)
+            # The row count is written before the index, trust it after a crash
+            count = int(self.open_count[0])
+            if count:
+                self.index[-1, 0] = self.open_chunk[self.time_field][0]
+                self.index[-1, 1] = self.open_chunk[self.time_field][count - 1]
+            self.index[-1, 2] = count
+        # Raw files of compressed chunks a crash left behind
+        for number in np.flatnonzero(self.index[:, 3]):
+            if os.path.isdir(self._chunk_dir(number)):
+                shutil.rmtree(self._chunk_dir(number))
+
+    def _chunk_dir(self, number):
+        return os.path.join(self.path, f"{number:06d}")
+
+    def _raw_rows(self, number):
+        count_path = os.path.join(self._chunk_dir(number), 'count.npy')
+        return int(np.load(count_path)[0]) if os.path.exists(count_path) else int(self.index[number, 2])
+
+    def _open(self, number):
+        directory = self._chunk_dir(number)
+        os.makedirs(directory, exist_ok=True)
+        columns = {}
+        for name in self.dtype.names:
+            column_path = os.path.join(directory, f"{name}.npy")
+            if os.path.exists(column_path):
+                columns[name] = np.load(column_path, mmap_mode='r+')
+            else:
+                columns[name] = np.lib.format.open_memmap(column_path, mode='w+', dtype=self.dtype[name],
+                                                          shape=(self.chunk_rows,))
+        count_path = os.path.join(directory, 'count.npy')
+        if os.path.exists(count_path):
+            self.open_count = np.load(count_path, mmap_mode='r+')
+        else:
+            self.open_count = np.lib.format.open_memmap(count_path, mode='w+', dtype='<i8', shape=(1,))
+        self.open_chunk = columns
+
+    def __len__(self):
+        return int(self.index[:, 2].sum())
+
+    @property
+    def last_time(self):
+        if not len(self.index) or self.index[-1, 2] == 0:
+            return None
+        return int(self.index[-1, 1])
+
+    def append(self, rows):
+        """
+        Append rows (a structured array of this dtype) newer than the last stored row
+        Returns the number of rows written
+        """
+        rows = np.asarray(rows)
+        last_time = self.last_time
+        if last_time is not None:
+            rows = rows[rows[self.time_field] > last_time]
+        written = 0
+        while written < len(rows):
+            if self.open_chunk is None:
+                self.index = np.vstack([self.index, np.zeros((1, _INDEX_COLUMNS), dtype='<i8')])
+                self._open(len(self.index) - 1)
+            count = int(self.open_count[0])
+            take = min(self.chunk_rows - count, len(rows) - written)
+            part = rows[written:written + take]
+            for name in self.dtype.names:
+                self.open_chunk[name][count:count + take] = part[name]
+            # Data first, then the row count, so readers never see rows that are not written
+            self.open_count[0] = count + take
+            number = len(self.index) - 1
+            if count == 0:
+                self.index[number, 0] = part[self.time_field][0]
+            self.index[number, 1] = part[self.time_field][-1]
+            self.index[number, 2] = count + take
+            written += take
+            if count + take == self.chunk_rows:
+                self._seal()
+        if written:
+            self._save_index()
+        return written
+
+    def _seal(self):
+        for column in self.open_chunk.values():
+            column.flush()
+        self.open_count.flush()
+        self.open_chunk = None
+        self.open_count = None
+        sealed = len(self.index) - self.keep_raw
+        for number in range(sealed):
+            if not self.index[number, 3]:
+                self._compress(number)
+
+    def _compress(self, number):
+        # Archive, index, then the raw files: a crash at any point leaves one readable copy
+        directory = self._chunk_dir(number)
+        columns = {name: np.load(os.path.join(directory, f"{name}.npy")) for name in self.dtype.names}
+        np.savez_compressed(directory + '.tmp.npz', **columns)
+        os.replace(directory + '.tmp.npz', directory + '.npz')
+        self.index[number, 3] = 1
+        self._save_index()
+        shutil.rmtree(directory)
+
+    def _save_index(self):
+        index_path = os.path.join(self.path, 'index.npy')
+        np.save(index_path + '.tmp.npy', self.index)
+        os.replace(index_path + '.tmp.npy', index_path)
+
+    def flush(self):
+        if self.open_chunk is not None:
+            for column in self.open_chunk.values():
+                column.flush()
+            self.open_count.flush()
+
+    def _load_chunk(self, number, columns):
+        rows = int(self.index[number, 2])
+        if self.index[number, 3]:
+            with np.load(self._chunk_dir(number) + '.npz') as archive:
+                return {name: archive[name][:rows] for name in columns}
+        if self.open_chunk is not None and number == len(self.index) - 1:
+            return {name: self.open_chunk[name][:rows] for name in columns}
+        directory = self._chunk_dir(number)
+        return {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')[:rows] for name in columns}
+
+    def chunks(self, start=None, end=None, columns=None):
+        """
+        Column dicts of every chunk overlapping [start, end], trimmed to it
+        Uncompressed chunks are memmap views, compressed ones are decompressed one at a time
+        """
+        columns = columns or self.dtype.names
+        for number in range(len(self.index)):
+            first, last, rows = self.index[number, :3]
+            if rows == 0 or (end is not None and first > end) or (start is not None and last < start):
+                continue
+            data = self._load_chunk(number, set(columns) | {self.time_field})
+            times = data[self.time_field]
+            lo = 0 if start is None else int(np.searchsorted(times, start, side='left'))
+            hi = len(times) if end is None else int(np.searchsorted(times, end, side='right'))
+            yield {name: data[name][lo:hi] for name in columns}
+
+    def read(self, start=None, end=None, columns=None):
+        """
+        Columns of the rows with start <= time <= end
+        A range inside one uncompressed chunk comes back as views on the files
+        """
+        columns = columns or self.dtype.names
+        parts = list(self.chunks(start, end, columns))
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return {name: np.zeros(0, dtype=self.dtype[name]) for name in columns}
+        return {name: np.concatenate([part[name] for part in parts]) for name in columns}
+
+    def records(self, start=None, end=None):
+        """
+        The rows as one structured array of this dtype
+        """
+        columns = self.read(start, end)
+        rows = np.empty(len(columns[self.time_field]), dtype=self.dtype)
+        for name in self.dtype.names:
+            rows[name] = columns[name]
+        return rows
+
+
+class MarketStore:
+    """
+    Bars per symbol and timeframe and tick snapshots per symbol under one directory
+    """
+
+    def __init__(self, directory, bar_chunk_rows=8192, tick_chunk_rows=65536, keep_raw=4):
+        self.directory = directory
+        self.bar_chunk_rows = bar_chunk_rows
+        self.tick_chunk_rows = tick_chunk_rows
+        self.keep_raw = keep_raw
+        self.streams = {}
+
+    def bars(self, symbol, timeframe):
+        return self._stream(symbol, f"bars_{timeframe}", RATES_DTYPE, self.bar_chunk_rows)
+
+    def ticks(self, symbol):
+        return self._stream(symbol, "ticks", TICK_DTYPE, self.tick_chunk_rows)
+
+    def _stream(self, symbol, name, dtype, chunk_rows):
+        key = (symbol, name)
+        if key not in self.streams:
+            path = os.path.join(self.directory, symbol, name)
+            self.streams[key] = ChunkedColumns(path, dtype, chunk_rows, self.keep_raw)
+        return self.streams[key]
+
+    def record_bars(self, symbol, timeframe, rates, forming=True):
+        """
+        Append copy_rates_* bars, the last one is left out while it is still forming
+        """
+        if rates is None or not len(rates):
+            return 0
+        return self.bars(symbol, timeframe).append(rates[:-1] if forming else rates)
+
+    def record_tick(self, symbol, tick):
+        """
+        Append a symbol_info_tick snapshot unless it repeats the last one
+        """
+        if tick is None:
+            return 0
+        stream = self.ticks(symbol)
+        row = np.array([(tick.time_msc, tick.bid, tick.ask, tick.last, tick.volume, tick.flags)], dtype=TICK_DTYPE)
+        return stream.append(row)
+
+    def frame(self, symbol, timeframe=None, start=None, end=None, columns=None):
+        """
+        Bars (or ticks when timeframe is None) as a pandas DataFrame indexed by time
+        """
+        import pandas as pd
+
+        stream = self.ticks(symbol) if timeframe is None else self.bars(symbol, timeframe)
+        columns = [name for name in columns or stream.dtype.names if name != stream.time_field]
+        data = stream.read(start, end, [stream.time_field] + columns)
+        index = pd.to_datetime(data[stream.time_field], unit='ms' if timeframe is None else 's')
+        return pd.DataFrame({name: data[name] for name in columns}, index=index)
+
+    def flush(self):
+        for stream in self.streams.values():
+            stream.flush()
+
+
+class MarketRecorder:
+    """
+    Polls the broker for ticks and records every bar once it has closed
+    Bars are fetched when the tick time enters a new bar, a few at a time
+    """
+
+    def __init__(self, broker, store, symbols, timeframes=(15,), tick_interval=1.0, sleep=time.sleep):
+        self.broker = broker
+        self.store = store
+        self.symbols = list(symbols)
+        self.timeframes = list(timeframes)
+        self.tick_interval = tick_interval
+        self.sleep = sleep
+        self.bar_opens = {}
+
+    def record_once(self):
+        """
+        One polling cycle over every symbol, returns the number of rows written
+        """
+        written = 0
+        for symbol in self.symbols:
+            tick = self.broker.symbol_info_tick(symbol)
+            if tick is None:
+                continue
+            written += self.store.record_tick(symbol, tick)
+            for timeframe in self.timeframes:
+                bar_seconds = TIMEFRAME_SECONDS[timeframe]
+                bar_open = tick.time // bar_seconds * bar_seconds
+                if self.bar_opens.get((symbol, timeframe)) == bar_open:
+                    continue
+                written += self._record_bars(symbol, timeframe)
+                self.bar_opens[(symbol, timeframe)] = bar_open
+        return written
+
+    def _record_bars(self, symbol, timeframe):
+        stream = self.store.bars(symbol, timeframe)
+        rates = None
+        if stream.last_time is not None:
+            # Every bar since the last recorded one in server time, however long the recorder was down
+            rates = self.broker.copy_rates_range(symbol, timeframe, stream.last_time,
+                                                 stream.last_time + _RANGE_AHEAD)
+        if rates is None:
+            rates = self.broker.copy_rates_from_pos(symbol, timeframe, 0, 1000)
+        return self.store.record_bars(symbol, timeframe, rates)
+
+    def run(self):
+        try:
+            while True:
+                self.record_once()
+                self.sleep(self.tick_interval)
+        except KeyboardInterrupt:
+            print("\nRecorder stopped by user")
+        finally:
+            self.store.flush()
+
+
+def main():
+    from dotenv import load_dotenv
+
+    from broker import Broker, MT5Broker
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Record bars and ticks into a local columnar store")
+    parser.add_argument('directory')
+    parser.add_argument('symbols', nargs='+')
+    parser.add_argument('--timeframes', nargs='+', default=['M15'])
+    parser.add_argument('--tick-interval', type=float, default=1.0, help="seconds between tick polls")
+    parser.add_argument('--server', default="MetaQuotes-Demo")
+    args = parser.parse_args()
+
+    broker = MT5Broker()
+    if not broker.initialize():
+        print("MT5 initialization failed")
+        return
+    if not broker.login(int(os.getenv("ACCOUNT_NUMBER")), os.getenv("PASSWORD"), args.server):
+        print("Login failed")
+        broker.shutdown()
+        return
+    timeframes = [getattr(Broker, f"TIMEFRAME_{timeframe}") for timeframe in args.timeframes]
+    try:
+        MarketRecorder(broker, MarketStore(args.directory), args.symbols, timeframes, args.tick_interval).run()
+    finally:
+        broker.shutdown()
+
+
+if __name__ == '__main__':
+    main()
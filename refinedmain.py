@@ -1,46 +1,36 @@
 import MetaTrader5 as mt
-import os
 from dotenv import load_dotenv
-import pytz
-import datetime
-import pandas as pd
 import time
+import checkpoint
+import orders
+from bar_cache import BarCacheStore
+from indicators import format_bar_time
+from metrics import Metrics
+from positions import PositionBook
+from scheduler import BarScheduler
+from strategies import CrossoverStrategy
 load_dotenv()
 
-def place_market_order(symbol, order_type, lot_size, sl_points, tp_points):
+# point, digits and filling mode are fetched once per symbol, not on every order
+symbols = orders.SymbolCache(mt)
+
+def place_market_order(symbol, order_type, lot_size, sl_points, tp_points, magic=234000):
     """
-    Place a market order with stop loss and take profit
+    Place a market order with stop loss and take profit, resent on requotes within the deviation
     """
     print(f"Symbol {symbol} - {order_type}")
-    symbol_info = mt.symbol_info(symbol)
-    print(f"Adel check symbol_info {symbol_info}")
-    if symbol_info is None:
-        print(f"Symbol {symbol} not found")
-        return None
-    
-    point = symbol_info.point
-    price = mt.symbol_info_tick(symbol).ask if order_type == 'BUY' else mt.symbol_info_tick(symbol).bid
-    # price=50
-    
-    request = {
-        "action": mt.TRADE_ACTION_DEAL,
-        "symbol": symbol,
-        "volume": lot_size,
-        "type": mt.ORDER_TYPE_BUY if order_type == 'BUY' else mt.ORDER_TYPE_SELL,
-        "price": price,
-        "sl": price - sl_points * point if order_type == 'BUY' else price + sl_points * point,
-        "tp": price + tp_points * point if order_type == 'BUY' else price - tp_points * point,
-        "deviation": 20,
-        "magic": 234000,
-        "comment": f"PipBot {order_type} order",
-        "type_time": mt.ORDER_TIME_GTC,
-        "type_filling": mt.ORDER_FILLING_IOC,
-    }
-    
-    result = mt.order_send(request)
-    return result
+    return orders.place_market_order(mt, symbol, order_type, lot_size, sl_points, tp_points, symbols, magic=magic)
 
-def start_mt5_bot(account_number, password, symbol="GBPUSD", lot_size=0.01, sl_points=100, tp_points=200):
+def start_mt5_bot(account_number, password, symbol="GBPUSD", lot_size=0.01, sl_points=100, tp_points=200, tick_latency=None, cache_dir=None, metrics=None, report_every=96, checkpoint_path=None):
+    """
+    Evaluate the strategy just after every M15 bar closes, or on every quote change
+    (polled every tick_latency seconds) when tick_latency is set
+    Bars are cached between cycles, and across restarts when cache_dir is given
+    Stage timings are printed every report_every evaluated bars
+    With checkpoint_path the indicator, strategy and position state is saved once per closed
+    bar and a restart continues from it
+    """
+    metrics = metrics or Metrics()
     # Initialize connection to MetaTrader 5
     if not mt.initialize():
         print("MT5 initialization failed")
@@ -54,129 +44,125 @@ def start_mt5_bot(account_number, password, symbol="GBPUSD", lot_size=0.01, sl_p
     user_account = mt.account_info()
     print(f"Successfully logged in to account {user_account.login}")
     
+    scheduler = BarScheduler(mt.TIMEFRAME_M15)
+    tick = mt.symbol_info_tick(symbol)
+    if tick is not None:
+        scheduler.sync(tick.time)
+    last_signal_bar = None
+    book = PositionBook(mt)
+    evaluated = 0
+    strategy = CrossoverStrategy()
+    # The runner's magic number for this symbol and strategy, only its positions are closed
+    magic = orders.magic_number(f"{symbol}/{type(strategy).__name__}/{mt.TIMEFRAME_M15}")
+    cache = BarCacheStore(cache_dir, capacity=strategy.lookback).get(symbol, mt.TIMEFRAME_M15)
+    saved = checkpoint.load(checkpoint_path)
+    checkpointed = None
+    failures = 0
     try:
         while True:
-            # Fetch latest data
-            rates = mt.copy_rates_from_pos(symbol, mt.TIMEFRAME_M15, 0, 60)
-            if rates is None:
-                print("Failed to fetch rates")
+            # Fetch the bars added since the last cycle
+            with metrics.timer('fetch', symbol):
+                refreshed = cache.refresh(mt)
+                rates = cache.latest(strategy.lookback)
+            if refreshed is None:
+                # Back off instead of asking the terminal again at once
+                failures += 1
+                print(f"Failed to fetch rates ({failures} in a row)")
+                scheduler.sleep(min(scheduler.max_retry, 2 ** failures))
                 continue
+            failures = 0
             
-            # Create DataFrame and calculate indicators
-            rates_frame = pd.DataFrame(rates)
-            rates_frame['time'] = pd.to_datetime(rates_frame['time'], unit='s')
-            rates_frame.set_index('time', inplace=True)
+            # Continue from the checkpoint on top of the bars missed while stopped
+            if saved is not None:
+                fetch = lambda start, end: mt.copy_rates_range(symbol, mt.TIMEFRAME_M15, start, end)
+                if checkpoint.resume(saved, strategy, scheduler, cache.latest(), book, fetch):
+                    last_signal_bar = saved.get('last_signal_bar')
+                    print(f"Resumed from the checkpoint at {format_bar_time(strategy.bar_time)}")
+                saved = None
             
-            # Calculate Median Price
-            rates_frame['Median_Price'] = (rates_frame['high'] + rates_frame['low']) / 2
-            
-            # Calculate EMAs
-            rates_frame['EMA_Median_23'] = rates_frame['Median_Price'].ewm(span=23, adjust=False).mean()
-            rates_frame['EMA_Close_10'] = rates_frame['close'].ewm(span=10, adjust=False).mean()
-            
-            # Generate signals based on EMA crossover
-            rates_frame['Signal'] = 0
-            rates_frame.loc[(rates_frame['EMA_Close_10'].shift(1) < rates_frame['EMA_Median_23'].shift(1)) & 
-                          (rates_frame['EMA_Close_10'] > rates_frame['EMA_Median_23']), 'Signal'] = 1  # Bullish
-            rates_frame.loc[(rates_frame['EMA_Close_10'].shift(1) > rates_frame['EMA_Median_23'].shift(1)) & 
-                          (rates_frame['EMA_Close_10'] < rates_frame['EMA_Median_23']), 'Signal'] = -1  # Bearish
+            if tick_latency is None and not scheduler.is_new_bar(rates[-1]['time']):
+                # No new bar yet, nothing to evaluate
+                scheduler.wait(rates[-1]['time'])
+                continue
             
-            # Check for valid signals in the latest candle
-            latest_signal = rates_frame['Signal'].iloc[-1]
+            # Generate the EMA crossover signal and validate the trend after it
+            # Right after a bar closes that bar is evaluated, in tick mode the forming bar is
+            with metrics.timer('indicators', symbol):
+                strategy.update_indicators(rates, closed_only=tick_latency is None)
+            with metrics.timer('signal', symbol):
+                latest_signal = strategy.evaluate()
+            evaluated += 1
+            metrics.count('bars', symbol)
+            bar_time = format_bar_time(strategy.bar_time)
+            if latest_signal != 0:
+                if strategy.bar_time == last_signal_bar:
+                    latest_signal = 0  # Already acted on this bar
+                else:
+                    last_signal_bar = strategy.bar_time
             
-            def validate_trend(prices, trend_type='bullish'):
-                """
-                Validates trend direction without requiring strict monotonic behavior
-                Allows for small retracements while maintaining overall direction
-                """
-                trend_period = 5
-                prices = prices[-trend_period:]
-                
-                if trend_type == 'bullish':
-                    # Check if general direction is upward
-                    start_price = prices.iloc[0]
-                    end_price = prices.iloc[-1]
-                    price_change = end_price - start_price
-                    
-                    # Calculate how many periods are moving in desired direction
-                    positive_moves = (prices.diff() > 0).sum()
-                    
-                    # Return True if price has overall increased and majority of moves are positive
-                    return price_change > 0 and positive_moves >= trend_period * 0.6
-                
-                else:  # bearish
-                    start_price = prices.iloc[0]
-                    end_price = prices.iloc[-1]
-                    price_change = end_price - start_price
-                    
-                    # Calculate how many periods are moving in desired direction
-                    negative_moves = (prices.diff() < 0).sum()
-                    
-                    # Return True if price has overall decreased and majority of moves are negative
-                    return price_change < 0 and negative_moves >= trend_period * 0.6
+            # Execute trades
+            if latest_signal == 1:  # Bullish signal
+                print(f"Valid bullish signal detected at {bar_time}")
+                with metrics.timer('order', symbol):
+                    result = place_market_order(symbol, "BUY", lot_size, sl_points, tp_points, magic)
+                if result and result.retcode == mt.TRADE_RETCODE_DONE:
+                    print(f"Buy order placed successfully: {result.order}")
+                else:
+                    print(f"Order failed: {result.comment if result else 'Unknown error'}")
             
-            # Validate trend and execute trades
-            if latest_signal != 0:
-                if latest_signal == 1:  # Bullish signal
-                    if len(rates_frame) >= 6:  # 5 periods + current
-                        recent_ema = rates_frame['EMA_Close_10'].iloc[-6:]
-                        if validate_trend(recent_ema, 'bullish'):
-                            print(f"Valid bullish signal detected at {rates_frame.index[-1]}")
-                            result = place_market_order(symbol, "BUY", lot_size, sl_points, tp_points)
-                            if result and result.retcode == mt.TRADE_RETCODE_DONE:
-                                print(f"Buy order placed successfully: {result.order}")
-                            else:
-                                print(f"Order failed: {result.comment if result else 'Unknown error'}")
-                
-                elif latest_signal == -1:  # Bearish signal
-                    if len(rates_frame) >= 6:
-                        recent_ema = rates_frame['EMA_Close_10'].iloc[-6:]
-                        if validate_trend(recent_ema, 'bearish'):
-                            print(f"Valid bearish signal detected at {rates_frame.index[-1]}")
-                            result = place_market_order(symbol, "SELL", lot_size, sl_points, tp_points)
-                            if result and result.retcode == mt.TRADE_RETCODE_DONE:
-                                print(f"Sell order placed successfully: {result.order}")
-                            else:
-                                print(f"Order failed: {result.comment if result else 'Unknown error'}")
+            elif latest_signal == -1:  # Bearish signal
+                print(f"Valid bearish signal detected at {bar_time}")
+                with metrics.timer('order', symbol):
+                    result = place_market_order(symbol, "SELL", lot_size, sl_points, tp_points, magic)
+                if result and result.retcode == mt.TRADE_RETCODE_DONE:
+                    print(f"Sell order placed successfully: {result.order}")
+                else:
+                    print(f"Order failed: {result.comment if result else 'Unknown error'}")
             # result = place_market_order(symbol, "BUY", lot_size, sl_points, tp_points)
             # print("adel see")
             # print(result)
-            # Position management
-            positions = mt.positions_get(symbol=symbol)
-            if positions:
-                for position in positions:
-                    # Close position if trend reverses
-                    position_type = position.type  # 0 for buy, 1 for sell
-                    
-                    # Get recent trend direction
-                    recent_ema = rates_frame['EMA_Close_10'].iloc[-5:]
-                    
-                    # Close long position if trend becomes bearish
-                    if position_type == 0 and validate_trend(recent_ema, 'bearish'):
-                        close_result = mt.positions_close(position.ticket)
-                        if close_result.retcode == mt.TRADE_RETCODE_DONE:
-                            print(f"Closed long position {position.ticket} due to trend reversal")
-                    
-                    # Close short position if trend becomes bullish
-                    elif position_type == 1 and validate_trend(recent_ema, 'bullish'):
-                        close_result = mt.positions_close(position.ticket)
-                        if close_result.retcode == mt.TRADE_RETCODE_DONE:
-                            print(f"Closed short position {position.ticket} due to trend reversal")
+            # Position management, one account-wide snapshot and one exit decision per cycle
+            position_start = time.perf_counter()
+            for event, position in book.refresh():
+                print(f"Position {position.ticket} {event}")
+            for position in book.to_close(symbol, strategy, magic=magic):
+                # Close position if trend reverses
+                close_result = orders.close_position(mt, position)
+                if close_result and close_result.retcode == mt.TRADE_RETCODE_DONE:
+                    book.closing(position.ticket)
+                    side = "long" if position.type == 0 else "short"
+                    print(f"Closed {side} position {position.ticket} due to trend reversal")
+            metrics.record('positions', symbol, time.perf_counter() - position_start)
+            # Once per closed bar and signal, not on every tick
+            if checkpoint_path and (rates[-2]['time'], last_signal_bar) != checkpointed:
+                checkpointed = (rates[-2]['time'], last_signal_bar)
+                checkpoint.save(checkpoint_path, checkpoint.capture(strategy, scheduler, book,
+                                                                    last_signal_bar=last_signal_bar))
+            if evaluated % report_every == 0:
+                metrics.report()
             
             # Display data
             print("\nLatest market analysis:")
-            print(rates_frame)
+            latest = strategy.values()
+            print(f"{bar_time} close={latest['close']} EMA_Close_10={latest['EMA_Close_10']:.5f} "
+                  f"EMA_Median_23={latest['EMA_Median_23']:.5f} signal={latest_signal}")
             
-            # Wait before next iteration
-            time.sleep(60 * 5)
+            # Wait for the next bar to close, or for the next quote in tick mode
+            if tick_latency is None:
+                scheduler.wait(rates[-1]['time'])
+            else:
+                tick = scheduler.wait_for_tick(lambda: mt.symbol_info_tick(symbol), tick, tick_latency)
             
     except KeyboardInterrupt:
         print("\nBot stopped by user")
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
+        cache.flush()
         mt.shutdown()
         print("MetaTrader 5 connection closed")
+        metrics.report()
+        metrics.close()
 
 
 if __name__ == "__main__":
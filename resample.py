@@ -0,0 +1,198 @@
+"""
+Higher timeframe bars built locally from one M1 feed per symbol
+
+A BarResampler fetches M1 bars with one terminal call per refresh and aggregates them
+into every timeframe it serves (M5, M15, H1, H4, D1...) on broker server time bucket
+boundaries: first open, highest high, lowest low, last close, summed volumes. It
+answers copy_rates_from_pos / copy_rates_range itself, so a BarCache of any timeframe
+can refresh from it instead of from the terminal.
+"""
+import numpy as np
+
+from bar_cache import _RANGE_AHEAD, BarCache
+from rates import RATES_DTYPE, TIMEFRAME_SECONDS
+
+TIMEFRAME_M1 = 1
+
+
+def resample(rates, timeframe):
+    """
+    Aggregate bars (M1 or any finer timeframe dividing it) into timeframe bars
+    Buckets are aligned on multiples of the bar length in server time, a bucket with
+    no source bar is skipped like the terminal does when there were no ticks
+    """
+    if not len(rates):
+        return np.zeros(0, dtype=RATES_DTYPE)
+    bar_seconds = TIMEFRAME_SECONDS[timeframe]
+    buckets = rates['time'] // bar_seconds * bar_seconds
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(rates)] - 1
+    bars = np.zeros(len(starts), dtype=RATES_DTYPE)
+    bars['time'] = buckets[starts]
+    bars['open'] = rates['open'][starts]
+    bars['high'] = np.maximum.reduceat(rates['high'], starts)
+    bars['low'] = np.minimum.reduceat(rates['low'], starts)
+    bars['close'] = rates['close'][ends]
+    bars['tick_volume'] = np.add.reduceat(rates['tick_volume'], starts)
+    bars['real_volume'] = np.add.reduceat(rates['real_volume'], starts)
+    bars['spread'] = np.minimum.reduceat(rates['spread'], starts)
+    return bars
+
+
+class BarResampler:
+    """
+    Every timeframe of one symbol from its M1 bars
+
+    Each timeframe is seeded once with its closed bars from the terminal, after that
+    only the M1 feed is fetched and the forming bar of every timeframe is rebuilt from
+    it. The M1 buffer covers the longest bucket served so the forming bar is complete;
+    after a longer gap every M1 bar since the last refresh is fetched and resampled, or
+    without copy_rates_range the closed bars are seeded from the terminal again.
+    min_interval (seconds of clock()) lets jobs of several timeframes closing together
+    share one M1 fetch.
+    """
+
+    def __init__(self, symbol, timeframes=(), capacity=500, min_interval=0.5, clock=None):
+        self.symbol = symbol
+        self.capacity = capacity
+        self.min_interval = min_interval
+        self.clock = clock
+        self.caches = {}
+        self.forming = {}
+        self.base = BarCache(symbol, TIMEFRAME_M1, 60)
+        self.refreshed = None
+        for timeframe in timeframes:
+            self.add_timeframe(timeframe)
+
+    def add_timeframe(self, timeframe):
+        if timeframe == TIMEFRAME_M1 or timeframe in self.caches:
+            return
+        if TIMEFRAME_SECONDS[timeframe] % 60:
+            raise ValueError(f"Timeframe {timeframe} is not a multiple of M1")
+        self.caches[timeframe] = BarCache(self.symbol, timeframe, self.capacity)
+        self.forming[timeframe] = None
+        # M1 bars of the longest bucket, plus slack for the bar that just closed
+        minutes = TIMEFRAME_SECONDS[timeframe] // 60
+        if self.base.capacity < minutes + 60:
+            base = BarCache(self.symbol, TIMEFRAME_M1, minutes + 60)
+            base.extend(self.base.latest())
+            self.base = base
+
+    def refresh(self, source):
+        """
+        Seed new timeframes and fetch the M1 bars added since the last refresh
+        Returns False when the terminal returned nothing
+        """
+        now = self.clock() if self.clock is not None else None
+        if now is not None and self.refreshed is not None and now - self.refreshed < self.min_interval:
+            return True
+        for timeframe, cache in self.caches.items():
+            if not len(cache):
+                # Closed bars only, the forming one is rebuilt from M1
+                rates = source.copy_rates_from_pos(self.symbol, timeframe, 1, self.capacity - 1)
+                if rates is not None:
+                    cache.extend(rates)
+        minutes = self._fetch(source)
+        if minutes is None:
+            return False
+        self.refreshed = now
+        self._resample(minutes)
+        return True
+
+    def _fetch(self, source):
+        """
+        Bring the M1 buffer up to date, returns the M1 bars to resample or None
+        """
+        base = self.base
+        last_time = base.last_time
+        if last_time is None:
+            return base.latest() if base.refresh(source) is not None else None
+        rates = source.copy_rates_range(self.symbol, TIMEFRAME_M1, last_time, last_time + _RANGE_AHEAD)
+        if rates is not None:
+            # The whole gap, the buffer only keeps its newest bars
+            earlier = base.latest()
+            base.extend(rates)
+            return np.concatenate([earlier[earlier['time'] < last_time], rates[rates['time'] >= last_time]])
+        rates = source.copy_rates_from_pos(self.symbol, TIMEFRAME_M1, 0, base.capacity)
+        if rates is None:
+            return None
+        if len(rates) and rates[0]['time'] > last_time:
+            # Bars are missing in between, take the closed ones from the terminal again
+            for timeframe, cache in self.caches.items():
+                closed = source.copy_rates_from_pos(self.symbol, timeframe, 1, self.capacity - 1)
+                if closed is not None:
+                    cache.extend(closed)
+                    self.forming[timeframe] = None
+        base.extend(rates)
+        return base.latest()
+
+    def _resample(self, minutes):
+        if not len(minutes):
+            return
+        for timeframe, cache in self.caches.items():
+            bar_seconds = TIMEFRAME_SECONDS[timeframe]
+            # Rebuild the forming bar and everything after it, or start after the seeded bars
+            if self.forming[timeframe] is not None:
+                start = self.forming[timeframe]
+            elif cache.last_time is not None:
+                start = cache.last_time + bar_seconds
+            else:
+                start = int(minutes['time'][0]) // bar_seconds * bar_seconds
+                if start < minutes['time'][0]:
+                    start += bar_seconds  # The first bucket is only partly covered
+            bars = resample(minutes[minutes['time'] >= start], timeframe)
+            if len(bars):
+                cache.extend(bars)
+                self.forming[timeframe] = int(bars['time'][-1])
+
+    def rates(self, timeframe, count=None):
+        """
+        The last count bars of timeframe, the forming bar last
+        """
+        if timeframe == TIMEFRAME_M1:
+            return self.base.latest(count)
+        return self.caches[timeframe].latest(count)
+
+    # The BarCache.refresh source interface
+
+    def copy_rates_from_pos(self, symbol, timeframe, start_pos, count):
+        if symbol != self.symbol or (timeframe != TIMEFRAME_M1 and timeframe not in self.caches):
+            return None
+        rates = self.rates(timeframe)
+        end = max(0, len(rates) - start_pos)
+        return rates[max(0, end - count):end]
+
+    def copy_rates_range(self, symbol, timeframe, date_from, date_to):
+        if symbol != self.symbol or (timeframe != TIMEFRAME_M1 and timeframe not in self.caches):
+            return None
+        rates = self.rates(timeframe)
+        return rates[(rates['time'] >= date_from) & (rates['time'] <= date_to)]
+
+
+class ResampledSource:
+    """
+    Stands in for the terminal as a BarCache source: bars of symbols with a resampler
+    come from it after one M1 refresh, everything else goes to the broker
+    """
+
+    def __init__(self, broker, resamplers):
+        self.broker = broker
+        self.resamplers = resamplers
+
+    def _resampler(self, symbol):
+        resampler = self.resamplers.get(symbol)
+        if resampler is not None and not resampler.refresh(self.broker):
+            return None
+        return resampler
+
+    def copy_rates_from_pos(self, symbol, timeframe, start_pos, count):
+        resampler = self._resampler(symbol)
+        if resampler is None:
+            return self.broker.copy_rates_from_pos(symbol, timeframe, start_pos, count)
+        return resampler.copy_rates_from_pos(symbol, timeframe, start_pos, count)
+
+    def copy_rates_range(self, symbol, timeframe, date_from, date_to):
+        resampler = self._resampler(symbol)
+        if resampler is None:
+            return self.broker.copy_rates_range(symbol, timeframe, date_from, date_to)
+        return resampler.copy_rates_range(symbol, timeframe, date_from, date_to)
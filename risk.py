@@ -0,0 +1,408 @@
+"""
+Pre-trade risk checks and position sizing for every account and symbol in one pass
+
+RiskEngine keeps the open exposure of each account per currency and the margin it uses
+in NumPy arrays, updated on every fill and close. check() takes a batch of order intents
+(one signal on many accounts, or many symbols at one bar close) and returns for each the
+volume it may trade:
+
+    risk = RiskEngine('USD', risk_per_trade=0.01, max_exposure=200000)
+    risk.set_account(login, equity, leverage)
+    risk.add_symbol(symbols.get('EURUSD'))
+    risk.update_market('EURUSD', price, atr)
+    lots, reasons = risk.check([login], ['EURUSD'], [1])
+
+A volume left as NaN is sized from the ATR: the position loses risk_per_trade of the
+account's equity when the price moves atr_multiple ATRs against it.
+
+Currencies are valued through the registered pairs, so EURJPY is priced once EURUSD or
+USDJPY is. A currency no registered pair reaches has to be bridged with
+bridge_rates(risk, broker), which reads the tick of the pair against the deposit currency;
+until then its symbols are refused with NO_PRICE.
+"""
+import math
+import threading
+
+import numpy as np
+
+# Why check() cut an intent to zero volume, REASONS[code] is the text
+APPROVED, NO_PRICE, TOO_SMALL, EXPOSURE, MARGIN, UNKNOWN = range(6)
+REASONS = ('approved', 'no price or ATR', 'below the minimum volume', 'currency exposure limit',
+           'not enough free margin', 'account or symbol not registered')
+
+
+def _grow(array, size, axis=0, fill=0.0):
+    if array.shape[axis] >= size:
+        return array
+    shape = list(array.shape)
+    shape[axis] = max(size, 2 * shape[axis])
+    grown = np.full(shape, fill, dtype=array.dtype)
+    grown[tuple(slice(0, n) for n in array.shape)] = array
+    return grown
+
+
+def _group_cumsum(keys, values):
+    """
+    Running total of values within each key, in the original order
+    """
+    if len(keys) < 2:
+        return values
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    repeated = sorted_keys[1:] == sorted_keys[:-1]
+    if not repeated.any():
+        return values
+    ordered = values[order]
+    totals = np.cumsum(ordered)
+    starts = np.flatnonzero(np.concatenate(([True], ~repeated)))
+    counts = np.diff(np.append(starts, len(keys)))
+    totals -= np.repeat(totals[starts] - ordered[starts], counts)
+    result = np.empty_like(totals)
+    result[order] = totals
+    return result
+
+
+class RiskEngine:
+    """
+    Exposure and margin state of many accounts, checked for a batch of intents at once
+
+    Exposure is held in units of each currency (a EURUSD buy adds EUR and removes USD),
+    valued in the deposit currency at the latest prices when checked. max_exposure is the
+    limit on the absolute value per currency, a number or a {currency: limit} dict; orders
+    that reduce an exposure are never refused for it. Margin is the notional over the
+    account leverage and has to stay under max_margin_ratio of equity. Intents of one
+    batch are checked as if every earlier one in the batch filled.
+    """
+
+    def __init__(self, currency='USD', risk_per_trade=0.01, atr_multiple=2.0, max_lots=1.0, max_exposure=None,
+                 max_margin_ratio=0.5):
+        self.currency = currency
+        self.risk_per_trade = risk_per_trade
+        self.atr_multiple = atr_multiple
+        self.max_lots = max_lots
+        self.max_exposure = max_exposure if max_exposure is not None else np.inf
+        self.max_margin_ratio = max_margin_ratio
+        self.lock = threading.Lock()
+
+        self.accounts = {}
+        self.equity = np.zeros(4)
+        self.leverage = np.ones(4)
+        self.margin = np.zeros(4)
+
+        self.currencies = {}
+        self.fx = np.full(4, np.nan)
+        self.rates = np.full(4, np.nan)
+        self.limits = np.full(4, np.inf)
+        self.exposure = np.zeros((4, 4))
+
+        self.symbols = {}
+        self.base = np.zeros(4, dtype=np.intp)
+        self.quote = np.zeros(4, dtype=np.intp)
+        self.contract_size = np.zeros(4)
+        self.volume_min = np.zeros(4)
+        self.volume_max = np.zeros(4)
+        self.volume_step = np.zeros(4)
+        self.price = np.full(4, np.nan)
+        self.atr = np.full(4, np.nan)
+
+        # (login, ticket) -> (account row, symbol row, signed lots, price, margin), to undo on close
+        self.positions = {}
+        self._currency(currency)
+
+    # Registration
+
+    def _currency(self, name):
+        column = self.currencies.get(name)
+        if column is None:
+            column = self.currencies[name] = len(self.currencies)
+            size = column + 1
+            self.fx = _grow(self.fx, size, fill=np.nan)
+            self.rates = _grow(self.rates, size, fill=np.nan)
+            self.limits = _grow(self.limits, size, fill=np.inf)
+            self.exposure = _grow(self.exposure, size, axis=1)
+            if name == self.currency:
+                self.fx[column] = self.rates[column] = 1.0
+            elif isinstance(self.max_exposure, dict):
+                self.limits[column] = self.max_exposure.get(name, np.inf)
+            else:
+                self.limits[column] = self.max_exposure
+        return column
+
+    def _account(self, login):
+        row = self.accounts.get(login)
+        if row is None:
+            row = self.accounts[login] = len(self.accounts)
+            size = row + 1
+            self.equity = _grow(self.equity, size)
+            self.leverage = _grow(self.leverage, size, fill=1.0)
+            self.margin = _grow(self.margin, size)
+            self.exposure = _grow(self.exposure, size)
+        return row
+
+    def set_account(self, login, equity, leverage=None):
+        """
+        Register an account or refresh its equity (e.g. from account_info())
+        """
+        with self.lock:
+            row = self._account(login)
+            self.equity[row] = equity
+            if leverage:
+                self.leverage[row] = leverage
+
+    def add_symbol(self, spec):
+        """
+        Register a symbol from its orders.SymbolSpec or symbol_info()
+        """
+        with self.lock:
+            if spec.name in self.symbols:
+                return
+            row = self.symbols[spec.name] = len(self.symbols)
+            size = row + 1
+            for name in ('base', 'quote', 'contract_size', 'volume_min', 'volume_max', 'volume_step'):
+                setattr(self, name, _grow(getattr(self, name), size))
+            self.price = _grow(self.price, size, fill=np.nan)
+            self.atr = _grow(self.atr, size, fill=np.nan)
+            self.base[row] = self._currency(spec.currency_base)
+            self.quote[row] = self._currency(spec.currency_profit)
+            self.contract_size[row] = spec.trade_contract_size
+            self.volume_min[row] = spec.volume_min
+            self.volume_max[row] = spec.volume_max
+            self.volume_step[row] = spec.volume_step
+
+    def update_market(self, symbol, price, atr=None):
+        """
+        Latest price and ATR of a symbol, which also revalues the currencies it reaches
+        """
+        with self.lock:
+            row = self.symbols[symbol]
+            self.price[row] = price
+            if atr is not None:
+                self.atr[row] = atr
+            self._derive_rates()
+
+    def set_rate(self, currency, rate):
+        """
+        Value of one unit of a currency in the deposit currency, from a pair that is not
+        registered (see bridge_rates)
+        """
+        with self.lock:
+            self.rates[self._currency(currency)] = rate
+            self._derive_rates()
+
+    def _derive_rates(self):
+        # Walk out from the deposit currency and the bridged rates through every priced
+        # pair, a cross needs one pass per pair between it and a known currency
+        count = len(self.symbols)
+        fx = self.rates[:len(self.currencies)].copy()
+        base, quote, price = self.base[:count], self.quote[:count], self.price[:count]
+        priced = np.isfinite(price) & (price > 0)
+        for _ in range(len(self.currencies)):
+            known = ~np.isnan(fx)
+            from_quote = priced & known[quote] & ~known[base]
+            from_base = priced & known[base] & ~known[quote]
+            if not (from_quote.any() or from_base.any()):
+                break
+            fx[base[from_quote]] = price[from_quote] * fx[quote[from_quote]]
+            fx[quote[from_base]] = fx[base[from_base]] / price[from_base]
+        self.fx[:len(fx)] = fx
+
+    def unpriced(self):
+        """
+        Currencies of the registered symbols that have no value in the deposit currency
+        """
+        with self.lock:
+            return [name for name, column in self.currencies.items() if np.isnan(self.fx[column])]
+
+    def bridged(self):
+        """
+        Currencies valued from set_rate() rather than a registered pair
+        """
+        with self.lock:
+            return [name for name, column in self.currencies.items()
+                    if name != self.currency and not np.isnan(self.rates[column])]
+
+    # Fills
+
+    def _apply(self, row, symbol_row, lots, price, direction=1, margin=None):
+        # direction 1 adds a position, -1 takes off again the margin it added
+        units = lots * self.contract_size[symbol_row]
+        self.exposure[row, self.base[symbol_row]] += direction * units
+        self.exposure[row, self.quote[symbol_row]] -= direction * units * price
+        if margin is None:
+            margin = abs(units) * price * self.fx[self.quote[symbol_row]] / self.leverage[row]
+            if not math.isfinite(margin):
+                # A fill on a symbol that cannot be valued (e.g. opened by hand), leaving it
+                # out keeps the margin check working for everything else
+                symbol = next(name for name, index in self.symbols.items() if index == symbol_row)
+                print(f"Risk: no {self.currency} value for the margin of {lots} lots of {symbol}, not counted")
+                margin = 0.0
+        self.margin[row] += direction * margin
+        return margin
+
+    def on_fill(self, login, symbol, side, lots, price=None, ticket=None):
+        """
+        Add a filled order, side is 1 for a buy and -1 for a sell
+        """
+        with self.lock:
+            if ticket is not None and (login, ticket) in self.positions:
+                return
+            row = self._account(login)
+            symbol_row = self.symbols[symbol]
+            price = self.price[symbol_row] if price is None else price
+            margin = self._apply(row, symbol_row, side * lots, price)
+            if ticket is not None:
+                self.positions[(login, ticket)] = (row, symbol_row, side * lots, price, margin)
+
+    def on_close(self, login, ticket):
+        with self.lock:
+            position = self.positions.pop((login, ticket), None)
+            if position is not None:
+                row, symbol_row, lots, price, margin = position
+                self._apply(row, symbol_row, lots, price, -1, margin)
+                self.margin[row] = max(self.margin[row], 0.0)
+
+    def listener(self, login):
+        """
+        PositionBook listener keeping the account in step with its position snapshots
+        """
+        def position_event(event, position):
+            if position.symbol not in self.symbols:
+                return
+            side = 1 if position.type == 0 else -1
+            if event == 'opened':
+                self.on_fill(login, position.symbol, side, position.volume, position.price_open, position.ticket)
+            elif event == 'closed':
+                self.on_close(login, position.ticket)
+            elif event == 'modified':
+                # A partial close changes the volume
+                known = self.positions.get((login, position.ticket))
+                if known is not None and abs(known[2]) != position.volume:
+                    self.on_close(login, position.ticket)
+                    self.on_fill(login, position.symbol, side, position.volume, position.price_open,
+                                 position.ticket)
+        return position_event
+
+    # Checks
+
+    def check(self, logins, symbols, sides, lots=None):
+        """
+        Volume each intent may trade and the reason code of the ones cut to zero
+        lots are the requested volumes, NaN or lots=None for ATR sizing
+        Intents of an account or symbol not registered yet are refused with UNKNOWN
+        """
+        count = len(sides)
+        accounts = self.accounts
+        indices = self.symbols
+        rows = np.fromiter((accounts.get(login, -1) for login in logins), np.intp, count)
+        symbol_rows = np.fromiter((indices.get(symbol, -1) for symbol in symbols), np.intp, count)
+        unknown = (rows < 0) | (symbol_rows < 0)
+        # Any row will do, their volume is zero
+        rows[unknown] = 0
+        symbol_rows[unknown] = 0
+        sides = np.asarray(sides, dtype=float)
+        requested = np.full(count, np.nan) if lots is None else np.asarray(lots, dtype=float)
+
+        with self.lock:
+            price = self.price[symbol_rows]
+            contract_size = self.contract_size[symbol_rows]
+            base = self.base[symbol_rows]
+            quote = self.quote[symbol_rows]
+            quote_fx = self.fx[quote]
+            equity = self.equity[rows]
+
+            # ATR sizing, then the symbol and per order limits on the volume step grid
+            loss_per_lot = self.atr_multiple * self.atr[symbol_rows] * contract_size * quote_fx
+            wanted = np.where(np.isnan(requested), self.risk_per_trade * equity / loss_per_lot, requested)
+            wanted = np.minimum(wanted, np.minimum(self.volume_max[symbol_rows], self.max_lots))
+            step = self.volume_step[symbol_rows]
+            volume = np.floor(wanted / step + 1e-9) * step
+            reasons = np.where(unknown, UNKNOWN, APPROVED).astype(np.int8)
+            priced = np.isfinite(volume) & np.isfinite(price) & np.isfinite(quote_fx)
+            reasons[(reasons == APPROVED) & ~priced] = NO_PRICE
+            reasons[(reasons == APPROVED) & ~(volume >= self.volume_min[symbol_rows])] = TOO_SMALL
+            approved = reasons == APPROVED
+            volume = np.where(approved, volume, 0.0)
+            price = np.where(approved, price, 0.0)
+            quote_fx = np.where(approved, quote_fx, 0.0)
+
+            # Currency exposure after each intent: base and quote legs, interleaved to keep the order
+            units = sides * volume * contract_size
+            columns = np.empty(2 * count, dtype=np.intp)
+            columns[0::2] = base
+            columns[1::2] = quote
+            keys = np.repeat(rows, 2) * self.exposure.shape[1] + columns
+            deltas = np.empty(2 * count)
+            deltas[0::2] = units
+            deltas[1::2] = -units * price
+            after = self.exposure.ravel()[keys] + _group_cumsum(keys, deltas)
+            # Over the limit, unless the intent brings the exposure closer to zero
+            breach = ((np.abs(after * self.fx[columns]) > self.limits[columns]) &
+                      (np.abs(after) > np.abs(after - deltas)))
+            reasons[(reasons == APPROVED) & breach.reshape(count, 2).any(axis=1)] = EXPOSURE
+
+            # Margin used after each intent against the allowed share of equity
+            required = volume * contract_size * price * quote_fx / self.leverage[rows]
+            used = self.margin[rows] + _group_cumsum(rows, required)
+            reasons[(reasons == APPROVED) & (used > self.max_margin_ratio * equity)] = MARGIN
+        return np.where(reasons == APPROVED, volume, 0.0), reasons
+
+    def check_one(self, login, symbol, side, lots=None):
+        """
+        check() of a single intent in plain floats, a few microseconds instead of the
+        fixed cost of the array version
+        """
+        row = self.accounts.get(login)
+        symbol_row = self.symbols.get(symbol)
+        if row is None or symbol_row is None:
+            return 0.0, UNKNOWN
+        with self.lock:
+            price = float(self.price[symbol_row])
+            contract_size = float(self.contract_size[symbol_row])
+            base, quote = self.base[symbol_row], self.quote[symbol_row]
+            quote_fx = float(self.fx[quote])
+            equity = float(self.equity[row])
+            if lots is None or math.isnan(lots):
+                lots = self.risk_per_trade * equity / (self.atr_multiple * float(self.atr[symbol_row]) *
+                                                      contract_size * quote_fx)
+            lots = min(lots, float(self.volume_max[symbol_row]), self.max_lots)
+            step = float(self.volume_step[symbol_row])
+            volume = math.floor(lots / step + 1e-9) * step if math.isfinite(lots) else math.nan
+            if not (math.isfinite(volume) and math.isfinite(price) and math.isfinite(quote_fx)):
+                return 0.0, NO_PRICE
+            if not volume >= self.volume_min[symbol_row]:
+                return 0.0, TOO_SMALL
+            units = side * volume * contract_size
+            for column, delta in ((base, units), (quote, -units * price)):
+                after = self.exposure[row, column] + delta
+                if abs(after * self.fx[column]) > self.limits[column] and abs(after) > abs(after - delta):
+                    return 0.0, EXPOSURE
+            required = volume * contract_size * price * quote_fx / self.leverage[row]
+            if self.margin[row] + required > self.max_margin_ratio * equity:
+                return 0.0, MARGIN
+        return volume, APPROVED
+
+    def exposures(self, login):
+        """
+        Open exposure of an account per currency, valued in the deposit currency
+        """
+        with self.lock:
+            row = self.accounts[login]
+            values = self.exposure[row, :len(self.currencies)] * self.fx[:len(self.currencies)]
+            return {name: float(values[column]) for name, column in self.currencies.items()
+                    if abs(values[column]) > 1e-6}
+
+
+def bridge_rates(risk, broker):
+    """
+    Value the currencies no registered pair reaches from the tick of their pair against
+    the deposit currency (EURJPY on a USD account needs USDJPY or JPYUSD), call again to
+    refresh them. Returns the currencies still unpriced, orders on their symbols are
+    refused with NO_PRICE.
+    """
+    for currency in risk.unpriced() + risk.bridged():
+        for pair, invert in ((currency + risk.currency, False), (risk.currency + currency, True)):
+            tick = broker.symbol_info_tick(pair)
+            if tick is not None and tick.bid > 0:
+                risk.set_rate(currency, 1 / tick.bid if invert else tick.bid)
+                break
+    return risk.unpriced()
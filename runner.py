@@ -0,0 +1,636 @@
+"""
+Run the bot on many symbols and timeframes from a single MetaTrader 5 terminal session
+
+    python runner.py XAUUSD GBPUSD:trend EURUSD:crossover:H1 --dry-run
+
+Each symbol is evaluated just after its bar closes. MetaTrader5 calls are not thread
+safe, so they are serialized behind one lock while the strategies run on a thread pool,
+and an error on one symbol is retried later without stopping the others. Orders are
+sent from their own worker queue so a slow fill never holds up the next evaluation.
+"""
+import argparse
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import checkpoint
+from journal import Journal
+from bar_cache import BarCacheStore
+from broker import Broker, MT5Broker
+from indicators import IndicatorGraph, format_bar_time
+from metrics import Metrics
+from orders import OrderExecutor, magic_number
+from positions import PositionBook
+from rates import TIMEFRAME_SECONDS
+from resample import BarResampler, ResampledSource
+from risk import REASONS, RiskEngine, bridge_rates
+from scheduler import BarScheduler
+from strategies import STRATEGIES
+load_dotenv()
+
+
+class SymbolJob:
+    """
+    One symbol, timeframe and strategy managed by the runner
+    magic marks the job's orders, it only closes positions that carry it
+    """
+
+    def __init__(self, symbol, strategy, timeframe, lot_size=0.01, sl_points=100, tp_points=200, trade=True,
+                 clock=time.time, magic=None):
+        self.symbol = symbol
+        self.strategy = strategy
+        self.timeframe = timeframe
+        self.lot_size = lot_size
+        self.sl_points = sl_points
+        self.tp_points = tp_points
+        self.trade = trade
+        self.magic = magic_number(self.name) if magic is None else magic
+        self.index = None
+        self.cache = None
+        self.scheduler = BarScheduler(timeframe, clock=clock)
+        self.last_bar_time = None
+        self.failures = 0
+        self.last_error = None
+        self.active = True
+        self.graph = None
+        self.atr = None
+        self.resume = None
+
+    @property
+    def name(self):
+        return f"{self.symbol}/{type(self.strategy).__name__}/{self.timeframe}"
+
+
+class BotRunner:
+    """
+    Schedules every job at its bar close and evaluates them on a thread pool
+    broker defaults to the MetaTrader5 terminal, a broker.SimulatedBroker runs it offline
+    With a risk.RiskEngine every order is sized and checked first, a job with lot_size
+    None is sized from the ATR. With a checkpoint_path the indicator, strategy and position
+    state is saved every checkpoint_every seconds and on exit, and a restart continues
+    from it. Closed positions are read from the deal history every closes_every seconds
+    and right after a close is seen. Event times are broker server time.
+    """
+
+    def __init__(self, account_number, password, server="MetaQuotes-Demo", workers=4, close_delay=2,
+                 cache_dir=None, broker=None, metrics=None, report_every=3600, positions_max_age=1.0,
+                 resample=False, risk=None, checkpoint_path=None, checkpoint_every=60, closes_every=60):
+        self.broker = broker or MT5Broker()
+        self.metrics = metrics or Metrics()
+        self.report_every = report_every
+        self.account_number = account_number
+        self.password = password
+        self.server = server
+        self.workers = workers
+        self.close_delay = close_delay
+        self.jobs = []
+        # Queue entries name their job by a number of its own, jobs come and go
+        self.job_ids = itertools.count()
+        self.caches = BarCacheStore(cache_dir)
+        self.mt_lock = threading.Lock()
+        self.orders = OrderExecutor(self.broker, self.call, metrics=self.metrics)
+        # One positions_get per account and cycle, shared by every job
+        self.positions = PositionBook(self.broker, self.call, clock=self.broker.time)
+        self.positions.listeners.append(self._position_event)
+        self.positions_max_age = positions_max_age
+        self.stop_event = threading.Event()
+        self.wakeup = threading.Condition()
+        self.queue = []
+        self.server_time = None
+        self.running = False
+        self.closes_every = closes_every
+        self.closes_from = None
+        self.closes_due = False
+        # Exit deal ticket -> server time, the deals already looked at
+        self.seen_deals = {}
+        self.listeners = []
+        self.graphs = {}
+        # With resample every timeframe of a symbol is built from its M1 bars
+        self.resample = resample
+        self.resamplers = {}
+        self.source = ResampledSource(self.broker, self.resamplers) if resample else self.broker
+        self.risk = risk
+        self.risk_listener = None
+        # Currencies already reported as impossible to value
+        self.unpriced = set()
+        if risk is not None:
+            self.risk_listener = risk.listener(account_number)
+            self.positions.listeners.append(self.risk_listener)
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.saved = checkpoint.load(checkpoint_path)
+        self.saved_graphs = dict(self.saved['graphs']) if self.saved else {}
+        self.resumed = {}
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+
+    def add(self, symbol, strategy="crossover", timeframe=Broker.TIMEFRAME_M15, **kwargs):
+        """
+        Add a job, it is scheduled at once when the runner is already running
+        Strategies named by string share one indicator graph per symbol and timeframe
+        Every job gets a magic number from its name unless magic= is given
+        """
+        graph = None
+        if isinstance(strategy, str):
+            graph = self.graphs.setdefault((symbol, timeframe), IndicatorGraph())
+            strategy = STRATEGIES[strategy](graph=graph)
+        job = SymbolJob(symbol, strategy, timeframe, clock=self.broker.time, **kwargs)
+        for other in self.jobs:
+            if other.magic == job.magic:
+                raise ValueError(f"{job.name} has the magic number {job.magic} of {other.name}, pass magic=")
+        if self.saved is not None:
+            job.resume = self.saved['jobs'].get(job.name)
+        if graph is not None and self.risk is not None:
+            # The ATR node newtest.py's strategy already has, declared for the others
+            job.graph = graph
+            job.atr = graph.atr(14)
+        job.index = next(self.job_ids)
+        job.cache = self.caches.get(symbol, timeframe)
+        if self.resample and timeframe != Broker.TIMEFRAME_M1:
+            if symbol not in self.resamplers:
+                self.resamplers[symbol] = BarResampler(symbol, capacity=self.caches.capacity, clock=self.broker.time)
+            self.resamplers[symbol].add_timeframe(timeframe)
+        job.scheduler.close_delay = self.close_delay
+        if self.server_time is not None:
+            job.scheduler.sync(self.server_time[0] + self.broker.time() - self.server_time[1])
+        self.jobs.append(job)
+        if self.running:
+            self._schedule(job, self.broker.time())
+        return job
+
+    def remove(self, job):
+        """
+        Stop evaluating a job, its open positions are left alone
+        """
+        job.active = False
+        # A new list, so threads iterating over the jobs are not disturbed
+        self.jobs = [other for other in self.jobs if other is not job]
+
+    def emit(self, kind, job=None, **fields):
+        """
+        Pass an event (bar, signal, exit, order, close, error, position_*) to every listener
+        Listeners are called from the worker threads and must not block
+        """
+        fields.setdefault('time', self.server_clock())
+        fields.update(event=kind, account=self.account_number)
+        if job is not None:
+            fields.update(symbol=job.symbol, job=job.name)
+        for listener in list(self.listeners):
+            try:
+                listener(fields)
+            except Exception as e:
+                print(f"Event listener failed: {e}")
+
+    def server_clock(self):
+        """
+        Broker server time now, the local clock until a tick or bar gave the offset
+        """
+        for job in self.jobs:
+            if job.scheduler.server_offset is not None:
+                return self.broker.time() + job.scheduler.server_offset
+        return self.broker.time()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Run a MetaTrader5 call, one at a time across all threads
+        """
+        with self.mt_lock:
+            return func(*args, **kwargs)
+
+    def connect(self):
+        mt = self.broker
+        if not mt.initialize():
+            print("MT5 initialization failed")
+            return False
+
+        if not mt.login(login=self.account_number, server=self.server, password=self.password):
+            print("Login failed")
+            mt.shutdown()
+            return False
+
+        user_account = mt.account_info()
+        print(f"Successfully logged in to account {user_account.login}")
+        if self.risk is not None:
+            self.risk.set_account(self.account_number, user_account.equity, user_account.leverage)
+            # Symbols known before the first position snapshot so open positions count
+            for job in self.jobs:
+                spec = self.orders.symbols.get(job.symbol)
+                if spec is not None:
+                    self.risk.add_symbol(spec)
+        if self.saved is not None:
+            self._reconcile()
+
+        # Bar times are in broker server time, one tick aligns every job's scheduler
+        tick = mt.symbol_info_tick(self.jobs[0].symbol) if self.jobs else None
+        if tick is not None and tick.time:
+            self.server_time = (tick.time, self.broker.time())
+            for job in self.jobs:
+                job.scheduler.sync(tick.time)
+        self.closes_from = self.server_clock()
+        if self.saved is not None:
+            # Positions closed while the bot was stopped are reported too
+            self.closes_from -= time.time() - self.saved['saved']
+        return True
+
+    def evaluate(self, job):
+        """
+        Evaluate the bar that just closed, returns False when the broker has no new bar yet
+        """
+        metrics = self.metrics
+        with metrics.timer('fetch', job.symbol):
+            rates = self.call(self._fetch, job)
+            if rates is None:
+                raise RuntimeError(f"Failed to fetch rates for {job.symbol}")
+        if len(rates) < 2:
+            raise RuntimeError(f"Not enough bars for {job.symbol}")
+        job.last_bar_time = int(rates[-1]['time'])
+        if job.resume is not None:
+            self._resume(job)
+        if not job.scheduler.is_new_bar(job.last_bar_time):
+            metrics.count('stale_bars', job.symbol)
+            return False
+        metrics.count('bars', job.symbol)
+
+        # The bar that just closed is the latest complete one
+        with metrics.timer('indicators', job.symbol):
+            job.strategy.update_indicators(rates, closed_only=True)
+        if self.risk is not None:
+            self._update_risk(job, rates)
+        with metrics.timer('signal', job.symbol):
+            signal = job.strategy.evaluate()
+            sides = job.strategy.exit_sides()
+        self.emit('bar', job, bar_time=job.strategy.bar_time, signal=signal, close_long=sides[0],
+                  close_short=sides[1], magic=job.magic)
+        if signal != 0:
+            order_type = "BUY" if signal == 1 else "SELL"
+            metrics.count('signals', job.symbol)
+            metrics.event('signal', job.symbol, side=order_type, bar_time=job.strategy.bar_time)
+            self.emit('signal', job, side=order_type, bar_time=job.strategy.bar_time, lot_size=job.lot_size,
+                      sl_points=job.sl_points, tp_points=job.tp_points, magic=job.magic)
+            print(f"{job.name}: {order_type} signal at {format_bar_time(job.strategy.bar_time)}")
+            lot_size = job.lot_size
+            if job.trade and self.risk is not None:
+                with metrics.timer('risk', job.symbol):
+                    lot_size, reason = self.risk.check_one(self.account_number, job.symbol,
+                                                           1 if order_type == "BUY" else -1, lot_size)
+                if not lot_size:
+                    metrics.count('risk_rejected', job.symbol)
+                    self.emit('risk_rejected', job, side=order_type, lot_size=job.lot_size, reason=REASONS[reason])
+                    print(f"{job.name}: {order_type} order refused: {REASONS[reason]}")
+            if job.trade and lot_size:
+                with metrics.timer('order_submit', job.symbol):
+                    future = self.orders.submit(job.symbol, order_type, lot_size, job.sl_points,
+                                                job.tp_points, magic=job.magic)
+                future.add_done_callback(lambda done, job=job, order_type=order_type:
+                                         self._order_done(job, order_type, done))
+
+        # Position management, exits are evaluated once for the symbol
+        with metrics.timer('positions', job.symbol):
+            book = self.positions.snapshot(self.positions_max_age)
+            positions = book.to_close(job.symbol, job.strategy, magic=job.magic, sides=sides)
+            if positions:
+                self.emit('exit', job, close_long=sides[0], close_short=sides[1], magic=job.magic,
+                          tickets=[position.ticket for position in positions])
+            for position in positions:
+                print(f"{job.name}: closing position {position.ticket} due to trend reversal")
+                if job.trade:
+                    book.closing(position.ticket)
+                    future = self.orders.submit_close(position)
+                    future.add_done_callback(lambda done, job=job, position=position:
+                                             self._close_done(job, position, done))
+        return True
+
+    def _graph_key(self, job):
+        # Graphs shared through add() by symbol and timeframe, a strategy's own by job
+        graph = job.strategy.engine.graph
+        if self.graphs.get((job.symbol, job.timeframe)) is graph:
+            return (job.symbol, job.timeframe)
+        return job.name
+
+    def _fetch(self, job):
+        # Under the terminal lock, jobs of one symbol and timeframe share the cache
+        if job.cache.refresh(self.source) is None:
+            return None
+        return job.cache.latest(job.strategy.lookback)
+
+    def _resume(self, job):
+        """
+        Continue the job from the checkpoint once its bars were fetched
+        """
+        graph = job.strategy.engine.graph
+        with graph.lock:
+            state, job.resume = job.resume, None
+            key = self._graph_key(job)
+            saved = self.saved_graphs.pop(key, None)
+            if saved is not None:
+                fetch = lambda start, end: self.call(self.source.copy_rates_range, job.symbol, job.timeframe,
+                                                     start, end)
+                self.resumed[key] = checkpoint.resume_graph(graph, saved, self.call(job.cache.latest), fetch)
+                if not self.resumed[key]:
+                    print(f"{job.name}: bars missing since the checkpoint, indicators start cold")
+            if self.resumed.get(key):
+                checkpoint.resume_strategy(job.strategy, job.scheduler, state)
+                print(f"{job.name}: resumed at {format_bar_time(job.strategy.bar_time)}")
+
+    def _reconcile(self):
+        """
+        Diff the checkpoint's position snapshot against the broker's positions
+        """
+        self.positions.load_state(self.saved['positions'])
+        events = self.positions.refresh()
+        for event, position in events:
+            print(f"Position {position.ticket} {position.symbol} {event} while the bot was stopped")
+        if self.risk_listener is not None:
+            # Positions carried over from the checkpoint raised no opened event
+            for position in list(self.positions.by_ticket.values()):
+                self.risk_listener('opened', position)
+
+    def save_checkpoint(self):
+        state = {'account': self.account_number, 'graphs': {}, 'jobs': {}, 'positions': self.positions.state()}
+        for job in self.jobs:
+            if not job.active:
+                continue
+            key = self._graph_key(job)
+            if job.resume is not None:
+                # Not evaluated since the restart yet, keep what was loaded
+                state['jobs'][job.name] = job.resume
+                if key in self.saved_graphs:
+                    state['graphs'][key] = self.saved_graphs[key]
+                    continue
+            else:
+                state['jobs'][job.name] = checkpoint.strategy_state(job.strategy, job.scheduler)
+            if key not in state['graphs']:
+                state['graphs'][key] = job.strategy.engine.graph.state()
+        checkpoint.save(self.checkpoint_path, state)
+
+    def _update_risk(self, job, rates):
+        spec = self.orders.symbols.get(job.symbol)
+        if spec is None:
+            return
+        self.risk.add_symbol(spec)
+        atr = job.graph.value(job.atr) if job.atr is not None else None
+        self.risk.update_market(job.symbol, float(rates[-1]['close']), atr)
+        if self.risk.unpriced() or self.risk.bridged():
+            for currency in self.call(bridge_rates, self.risk, self.broker):
+                if currency not in self.unpriced:
+                    self.unpriced.add(currency)
+                    print(f"No {self.risk.currency} rate for {currency}: add a pair that prices it, "
+                          f"orders on its symbols are refused")
+
+    def _close_done(self, job, position, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            result = None
+            print(f"{job.name}: closing position {position.ticket} failed: {e}")
+        if result is not None and result.retcode == self.broker.TRADE_RETCODE_DONE:
+            self.metrics.count('positions_closed', job.symbol)
+            self._closes_due()
+            print(f"{job.name}: closed position {position.ticket}")
+        else:
+            self.positions.close_failed(position.ticket)
+
+    def _position_event(self, event, position):
+        self.metrics.event(f"position_{event}", position.symbol, ticket=position.ticket, type=position.type,
+                           volume=position.volume, price_open=position.price_open, sl=position.sl, tp=position.tp)
+        self.emit(f"position_{event}", symbol=position.symbol, ticket=position.ticket, type=position.type,
+                  volume=position.volume, price_open=position.price_open, sl=position.sl, tp=position.tp,
+                  profit=position.profit)
+        if event == 'closed':
+            self._closes_due()
+
+    def _closes_due(self):
+        self.closes_due = True
+        with self.wakeup:
+            self.wakeup.notify()
+
+    def record_closes(self):
+        """
+        Emit a close event for every position closed since the last scan, with the realized
+        profit and close time of its deals, so positions that opened and closed between two
+        snapshots are not missed
+        """
+        self.closes_due = False
+        broker = self.broker
+        now = self.server_clock()
+        start = now if self.closes_from is None else self.closes_from
+        # An hour each side covers an offset still off by its 30 minute rounding
+        deals = self.call(broker.history_deals_get, int(start) - 3600, int(now) + 3600)
+        if deals is None:
+            return
+        self.closes_from = now
+        closed = set()
+        for deal in deals:
+            if deal.entry == broker.DEAL_ENTRY_OUT and deal.ticket not in self.seen_deals:
+                self.seen_deals[deal.ticket] = deal.time
+                closed.add(deal.position_id)
+        self.seen_deals = {ticket: when for ticket, when in self.seen_deals.items() if when >= start - 7200}
+
+        for position_id in sorted(closed):
+            history = self.call(broker.history_deals_get, position=position_id) or ()
+            entries = [deal for deal in history if deal.entry == broker.DEAL_ENTRY_IN]
+            exits = [deal for deal in history if deal.entry == broker.DEAL_ENTRY_OUT]
+            opened = sum(deal.volume for deal in entries)
+            volume = sum(deal.volume for deal in exits)
+            if not entries or volume < opened - 1e-9:
+                # Partly closed, the deal that closes the rest brings it back
+                continue
+            last = max(exits, key=lambda deal: deal.time_msc)
+            self.emit('close', symbol=last.symbol, ticket=position_id, time=last.time, type=entries[0].type,
+                      volume=volume, price_open=sum(deal.price * deal.volume for deal in entries) / opened,
+                      price=sum(deal.price * deal.volume for deal in exits) / volume, reason=last.reason,
+                      profit=sum(deal.profit + deal.commission + deal.swap + deal.fee for deal in history))
+
+    def _order_done(self, job, order_type, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"{job.name}: order failed: {e}")
+            self.emit('order', job, side=order_type, filled=False, comment=str(e))
+            return
+        filled = bool(result) and result.retcode == self.broker.TRADE_RETCODE_DONE
+        requested = slippage = None
+        if result:
+            request = result.request
+            requested = request.get('price') if isinstance(request, dict) else getattr(request, 'price', None)
+            spec = self.orders.symbols.get(job.symbol)
+            if filled and requested and spec is not None:
+                # Positive when the fill was worse than the request
+                slippage = (1 if order_type == "BUY" else -1) * (result.price - requested) / spec.point
+        self.emit('order', job, side=order_type, filled=filled, retcode=result.retcode if result else None,
+                  ticket=result.order if result else None, volume=result.volume if result else None,
+                  requested=requested, price=result.price if result else None, slippage=slippage,
+                  comment=result.comment if result else 'Unknown error')
+        if filled:
+            if self.risk is not None:
+                self.risk.on_fill(self.account_number, job.symbol, 1 if order_type == "BUY" else -1, result.volume,
+                                  result.price, result.order)
+            print(f"{job.name}: {order_type} order placed successfully: {result.order}")
+        else:
+            print(f"{job.name}: order failed: {result.comment if result else 'Unknown error'}")
+
+    def _run_job(self, job):
+        try:
+            self._evaluate_job(job)
+        finally:
+            with self.in_flight_lock:
+                self.in_flight -= 1
+
+    def _evaluate_job(self, job):
+        if not job.active:
+            return
+        try:
+            with self.metrics.timer('cycle', job.symbol):
+                self.evaluate(job)
+            due = job.scheduler.next_wakeup(job.last_bar_time)
+            job.failures = 0
+            job.last_error = None
+        except Exception as e:
+            # One failing symbol backs off and retries, the others keep running
+            job.failures += 1
+            job.last_error = str(e)
+            self.metrics.count('errors', job.symbol)
+            self.metrics.event('error', job.symbol, error=job.last_error, failures=job.failures)
+            self.emit('error', job, error=job.last_error, failures=job.failures)
+            print(f"{job.name}: error ({job.failures} in a row): {e}")
+            due = self.broker.time() + min(TIMEFRAME_SECONDS[job.timeframe], 5 * 2 ** job.failures)
+        self._schedule(job, due)
+
+    def _schedule(self, job, due):
+        with self.wakeup:
+            heapq.heappush(self.queue, (due, job.index, job))
+            self.wakeup.notify()
+
+    def run(self, connect=True):
+        """
+        Connect and evaluate the jobs until stop(), connect=False when connect() already succeeded
+        """
+        if connect and not self.connect():
+            return
+        self.running = True
+        for job in self.jobs:
+            self._schedule(job, self.broker.time())
+
+        next_report = self.broker.time() + self.report_every
+        next_checkpoint = self.broker.time() + self.checkpoint_every
+        next_closes = self.broker.time() + self.closes_every
+        try:
+            with ThreadPoolExecutor(self.workers) as pool:
+                while not self.stop_event.is_set():
+                    if self.broker.time() >= next_report:
+                        self._refresh_equity()
+                        self.metrics.report()
+                        self.metrics.flush()
+                        next_report += self.report_every
+                    # Between evaluations, so every job's strategy matches its graph
+                    if self.checkpoint_path and self.broker.time() >= next_checkpoint and not self.in_flight:
+                        with self.metrics.timer('checkpoint'):
+                            self.save_checkpoint()
+                        next_checkpoint = self.broker.time() + self.checkpoint_every
+                    if self.closes_due or self.broker.time() >= next_closes:
+                        self.record_closes()
+                        next_closes = self.broker.time() + self.closes_every
+                    with self.wakeup:
+                        if not self.queue or self.queue[0][0] > self.broker.time():
+                            timeout = self.queue[0][0] - self.broker.time() if self.queue else 1
+                            self.wakeup.wait(min(max(timeout, 0), 1))
+                            continue
+                        _, _, job = heapq.heappop(self.queue)
+                    if job.active:
+                        with self.in_flight_lock:
+                            self.in_flight += 1
+                        pool.submit(self._run_job, job)
+        except KeyboardInterrupt:
+            print("\nBot stopped by user")
+        finally:
+            self.running = False
+            self.stop_event.set()
+            self.orders.join()
+            self.orders.stop()
+            self.record_closes()
+            self.caches.flush()
+            if self.checkpoint_path:
+                self.save_checkpoint()
+            self.broker.shutdown()
+            print("MetaTrader 5 connection closed")
+            self.metrics.report()
+            self.metrics.close()
+
+    def _refresh_equity(self):
+        if self.risk is None:
+            return
+        info = self.call(self.broker.account_info)
+        if info is not None:
+            self.risk.set_account(self.account_number, info.equity, info.leverage)
+
+    def stop(self):
+        self.stop_event.set()
+        with self.wakeup:
+            self.wakeup.notify()
+
+
+def add_risk_arguments(parser):
+    parser.add_argument('--risk-per-trade', type=float,
+                        help="percent of equity lost at the ATR stop, sizes every order from the ATR")
+    parser.add_argument('--max-exposure', type=float, help="largest open exposure per currency, deposit currency")
+    parser.add_argument('--max-lots', type=float, default=1.0, help="largest volume of one order")
+    parser.add_argument('--deposit-currency', default='USD')
+
+
+def risk_engine(args):
+    """
+    The RiskEngine the add_risk_arguments() options ask for, None without any of them
+    """
+    if args.risk_per_trade is None and args.max_exposure is None:
+        return None
+    return RiskEngine(args.deposit_currency, risk_per_trade=(args.risk_per_trade or 1) / 100,
+                      max_lots=args.max_lots, max_exposure=args.max_exposure)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run PipBot on many symbols from one terminal session")
+    parser.add_argument('jobs', nargs='+', help="SYMBOL[:STRATEGY[:TIMEFRAME]], e.g. GBPUSD:trend:H1")
+    parser.add_argument('--lot-size', type=float, default=0.01)
+    parser.add_argument('--sl-points', type=float, default=100)
+    parser.add_argument('--tp-points', type=float, default=200)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--cache-dir', help="keep the bar caches here across restarts")
+    parser.add_argument('--dry-run', action='store_true', help="print signals without sending orders")
+    parser.add_argument('--checkpoint', help="save indicator and strategy state here and resume from it")
+    parser.add_argument('--journal', help="record bars, signals, orders and closes in this SQLite file")
+    parser.add_argument('--metrics-log', help="append timing and order events to this JSON lines file")
+    parser.add_argument('--report-every', type=float, default=60, help="minutes between timing reports")
+    parser.add_argument('--resample', action='store_true',
+                        help="build every timeframe from one M1 feed per symbol instead of fetching each")
+    add_risk_arguments(parser)
+    args = parser.parse_args()
+
+    risk = risk_engine(args)
+    runner = BotRunner(int(os.getenv("ACCOUNT_NUMBER")), os.getenv("PASSWORD"), workers=args.workers,
+                       cache_dir=args.cache_dir, metrics=Metrics(args.metrics_log),
+                       report_every=args.report_every * 60, resample=args.resample, risk=risk,
+                       checkpoint_path=args.checkpoint)
+    for spec in args.jobs:
+        symbol, strategy, timeframe = (spec.split(':') + ['crossover', 'M15'])[:3]
+        runner.add(symbol, strategy, getattr(Broker, f"TIMEFRAME_{timeframe}"),
+                   lot_size=None if args.risk_per_trade else args.lot_size,
+                   sl_points=args.sl_points, tp_points=args.tp_points, trade=not args.dry_run)
+    journal = None
+    if args.journal:
+        journal = Journal(args.journal)
+        journal.start()
+        runner.listeners.append(journal.record)
+    try:
+        runner.run()
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+if __name__ == '__main__':
+    main()
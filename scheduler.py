@@ -0,0 +1,88 @@
+import math
+import time
+
+from rates import TIMEFRAME_SECONDS
+
+
+class BarScheduler:
+    """
+    Wakes the bot just after each bar closes instead of polling on a fixed sleep
+    Bar times are broker server time, the offset to the local clock comes from a tick
+    time passed to sync() or from the forming bar itself. A tick can be stale (weekend,
+    illiquid symbol), so an offset that puts the server clock before the forming bar's
+    open is replaced by one taken from the bar.
+    """
+
+    def __init__(self, timeframe, close_delay=1.0, max_retry=60, clock=time.time, sleep=time.sleep):
+        self.bar_seconds = TIMEFRAME_SECONDS[timeframe]
+        self.close_delay = close_delay
+        self.max_retry = min(max_retry, self.bar_seconds)
+        self.clock = clock
+        self.sleep = sleep
+        self.server_offset = None
+        self.last_bar_time = None
+        self.misses = 0
+
+    def sync(self, server_time):
+        """
+        Align with the broker clock from a server timestamp (symbol_info_tick(symbol).time)
+        Brokers run on whole or half hour offsets from UTC, so the offset is rounded to 30 minutes
+        """
+        self.server_offset = round((server_time - self.clock()) / 1800) * 1800
+
+    def sync_bar(self, bar_time):
+        """
+        Align with the broker clock from the open time of the forming bar
+        It opened less than one bar ago in server time. Bars of 30 minutes or less pin the
+        offset down, longer ones only bound it, so the smallest offset they allow is taken:
+        a too small offset would wake after the close, a too large one only retries early.
+        """
+        if self.bar_seconds <= 1800:
+            self.sync(bar_time + self.bar_seconds / 2)
+        else:
+            self.server_offset = math.ceil((bar_time - self.clock()) / 1800) * 1800
+
+    def is_new_bar(self, bar_time):
+        """
+        True the first time a forming bar with this open time is seen
+        """
+        bar_time = int(bar_time)
+        if self.last_bar_time is not None and bar_time <= self.last_bar_time:
+            self.misses += 1
+            return False
+        self.last_bar_time = bar_time
+        self.misses = 0
+        return True
+
+    def next_wakeup(self, bar_time):
+        """
+        Local clock time just after the bar that opened at bar_time closes
+        When that moment has already passed (broker lag, market closed) retry with backoff
+        """
+        bar_time = int(bar_time)
+        if self.server_offset is None or self.clock() + self.server_offset < bar_time:
+            self.sync_bar(bar_time)
+        wakeup = bar_time + self.bar_seconds - self.server_offset + self.close_delay
+        now = self.clock()
+        if wakeup <= now:
+            wakeup = now + min(self.max_retry, max(self.close_delay, 1) * 2 ** self.misses)
+        return wakeup
+
+    def wait(self, bar_time):
+        """
+        Sleep until just after the bar that opened at bar_time closes
+        """
+        self.sleep(max(0, self.next_wakeup(bar_time) - self.clock()))
+
+    def wait_for_tick(self, get_tick, last_tick, latency=0.5):
+        """
+        Poll get_tick every latency seconds until the quote differs from last_tick
+        """
+        while True:
+            self.sleep(latency)
+            tick = get_tick()
+            if tick is None:
+                continue
+            if last_tick is None or (tick.time_msc, tick.bid, tick.ask) != \
+                    (last_tick.time_msc, last_tick.bid, last_tick.ask):
+                return tick
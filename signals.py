@@ -0,0 +1,153 @@
+import numpy as np
+
+
+def analyze_trend_strength(row):
+    strength = 0
+    
+    # EMA alignment check (trend structure)
+    if row['EMA_10'] > row['EMA_20'] > row['EMA_50']:
+        strength += 1  # Bullish alignment
+    elif row['EMA_10'] < row['EMA_20'] < row['EMA_50']:
+        strength -= 1  # Bearish alignment
+    
+    # RSI trend check
+    if row['RSI'] > 50:
+        strength += 0.5
+    elif row['RSI'] < 50:
+        strength -= 0.5
+    
+    # MACD confirmation
+    if row['MACD'] > row['Signal_Line']:
+        strength += 0.5
+    elif row['MACD'] < row['Signal_Line']:
+        strength -= 0.5
+    
+    return strength
+
+def generate_signal(current_strength, prev_strength):
+    """
+    Generate trading signals based on trend strength and confirmations
+    """
+    # Check for strong trend confirmation
+    if current_strength >= 1.5 and prev_strength < 1.5:
+        return 1  # Strong bullish signal
+    elif current_strength <= -1.5 and prev_strength > -1.5:
+        return -1  # Strong bearish signal
+    return 0
+
+def validate_trend(prices, trend_type='bullish', trend_period=5, trend_ratio=0.6):
+    """
+    Validates trend direction without requiring strict monotonic behavior
+    Allows for small retracements while maintaining overall direction
+    """
+    prices = prices[-trend_period:]
+    moves = [current - previous for previous, current in zip(prices, prices[1:])]
+    
+    if trend_type == 'bullish':
+        # Check if general direction is upward
+        price_change = prices[-1] - prices[0]
+        
+        # Calculate how many periods are moving in desired direction
+        positive_moves = sum(1 for move in moves if move > 0)
+        
+        # Return True if price has overall increased and majority of moves are positive
+        return price_change > 0 and positive_moves >= trend_period * trend_ratio
+    
+    else:  # bearish
+        price_change = prices[-1] - prices[0]
+        
+        # Calculate how many periods are moving in desired direction
+        negative_moves = sum(1 for move in moves if move < 0)
+        
+        # Return True if price has overall decreased and majority of moves are negative
+        return price_change < 0 and negative_moves >= trend_period * trend_ratio
+
+def crossover_signal(fast, slow):
+    """
+    1 when the fast EMA crosses above the slow EMA on the latest bar, -1 when it crosses below
+    fast and slow hold at least the previous and the latest value
+    """
+    if len(fast) < 2 or len(slow) < 2:
+        return 0
+    if fast[-2] < slow[-2] and fast[-1] > slow[-1]:
+        return 1  # Bullish
+    if fast[-2] > slow[-2] and fast[-1] < slow[-1]:
+        return -1  # Bearish
+    return 0
+
+def trend_strength(data):
+    """
+    Vectorized analyze_trend_strength over whole columns
+    data is anything indexable by column name (DataFrame, dict of arrays, structured array),
+    columns can be 1-D per symbol or 2-D (symbols x bars) for a batch of symbols
+    NaN indicators score 0, same as the row-wise version
+    """
+    ema_10 = np.asarray(data['EMA_10'], dtype=float)
+    ema_20 = np.asarray(data['EMA_20'], dtype=float)
+    ema_50 = np.asarray(data['EMA_50'], dtype=float)
+    rsi = np.asarray(data['RSI'], dtype=float)
+    macd = np.asarray(data['MACD'], dtype=float)
+    signal_line = np.asarray(data['Signal_Line'], dtype=float)
+    
+    # EMA alignment check (trend structure)
+    strength = ((ema_10 > ema_20) & (ema_20 > ema_50)).astype(float)
+    strength -= (ema_10 < ema_20) & (ema_20 < ema_50)
+    
+    # RSI trend check
+    strength += 0.5 * (rsi > 50)
+    strength -= 0.5 * (rsi < 50)
+    
+    # MACD confirmation
+    strength += 0.5 * (macd > signal_line)
+    strength -= 0.5 * (macd < signal_line)
+    return strength
+
+def generate_signals(strength):
+    """
+    Vectorized generate_signal, each bar is compared with the previous one along the last axis
+    The first bar has no previous strength and never signals
+    """
+    strength = np.asarray(strength, dtype=float)
+    current = strength[..., 1:]
+    previous = strength[..., :-1]
+    
+    signals = np.zeros(strength.shape, dtype=np.int8)
+    signals[..., 1:][(current >= 1.5) & (previous < 1.5)] = 1  # Strong bullish signal
+    signals[..., 1:][(current <= -1.5) & (previous > -1.5)] = -1  # Strong bearish signal
+    return signals
+
+def crossover_signals(fast, slow):
+    """
+    Vectorized crossover_signal for every bar of the fast and slow EMA arrays
+    """
+    fast = np.asarray(fast, dtype=float)
+    slow = np.asarray(slow, dtype=float)
+    signals = np.zeros(fast.shape, dtype=np.int8)
+    signals[..., 1:][(fast[..., :-1] < slow[..., :-1]) & (fast[..., 1:] > slow[..., 1:])] = 1  # Bullish
+    signals[..., 1:][(fast[..., :-1] > slow[..., :-1]) & (fast[..., 1:] < slow[..., 1:])] = -1  # Bearish
+    return signals
+
+def validate_trends(prices, trend_type='bullish', trend_period=5, trend_ratio=0.6):
+    """
+    Vectorized validate_trend on the trend_period values ending at every bar
+    Bars without a full window are never valid, nor is any bar with a trend_period of 1
+    (a single price never changes, as in validate_trend)
+    """
+    prices = np.asarray(prices, dtype=float)
+    valid = np.zeros(prices.shape, dtype=bool)
+    if trend_period <= 1 or prices.shape[-1] < trend_period:
+        return valid
+    
+    moves = np.diff(prices, axis=-1)
+    wanted = moves > 0 if trend_type == 'bullish' else moves < 0
+    counts = np.cumsum(wanted, axis=-1)
+    counts = np.concatenate([np.zeros(counts.shape[:-1] + (1,), dtype=counts.dtype), counts], axis=-1)
+    # Moves inside each window are the trend_period - 1 diffs ending at the bar
+    window_moves = counts[..., trend_period - 1:] - counts[..., :-(trend_period - 1)]
+    price_change = prices[..., trend_period - 1:] - prices[..., :-(trend_period - 1)]
+    
+    if trend_type == 'bullish':
+        valid[..., trend_period - 1:] = (price_change > 0) & (window_moves >= trend_period * trend_ratio)
+    else:
+        valid[..., trend_period - 1:] = (price_change < 0) & (window_moves >= trend_period * trend_ratio)
+    return valid
@@ -0,0 +1,179 @@
+from indicators import crossover_engine, trend_engine
+from signals import analyze_trend_strength, crossover_signal, generate_signal, validate_trend
+
+
+class CrossoverStrategy:
+    """
+    EMA_Close_10 / EMA_Median_23 crossover confirmed by validate_trend, from refinedmain.py
+    Strategies given the same indicators.IndicatorGraph share the indicators they have in common
+    """
+
+    lookback = 60
+    # What checkpoint.py saves besides the indicators
+    state_fields = ('latest', 'bar_time', 'signal', 'raw_signal', 'recent_ema')
+
+    def __init__(self, fast_span=10, slow_span=23, trend_period=5, trend_ratio=0.6, graph=None):
+        self.fast_name = f"EMA_Close_{fast_span}"
+        self.slow_name = f"EMA_Median_{slow_span}"
+        self.trend_period = trend_period
+        self.trend_ratio = trend_ratio
+        self.engine = crossover_engine(fast_span=fast_span, slow_span=slow_span, graph=graph)
+        self.latest = None
+        self.bar_time = None
+        self.signal = 0
+        self.raw_signal = 0
+        self.recent_ema = []
+
+    def update(self, rates, closed_only=False):
+        """
+        Update the indicators with a copy_rates_from_pos array and return the validated signal
+        The last bar is still forming, it is only peeked unless closed_only evaluates the
+        last closed bar instead
+        """
+        self.update_indicators(rates, closed_only)
+        return self.evaluate()
+
+    def update_indicators(self, rates, closed_only=False):
+        """
+        The indicator half of update(), returns the values of the evaluated bar
+        """
+        self.engine.update_many(rates[:-1])
+        if closed_only:
+            self.latest = None
+            self.bar_time = int(rates[-2]['time'])
+        else:
+            self.latest = self.engine.peek(rates[-1])
+            self.bar_time = int(rates[-1]['time'])
+        return self.values()
+
+    def evaluate(self):
+        """
+        The signal half of update(), on the indicators of the last update_indicators()
+        """
+        ema_close = self.engine.series(self.fast_name, self.trend_period + 1, self.latest)
+        ema_slow = self.engine.series(self.slow_name, 2, self.latest)
+        self.recent_ema = ema_close[-self.trend_period:]
+
+        # Generate signals based on EMA crossover, then validate the trend after it
+        self.raw_signal = crossover_signal(ema_close[-2:], ema_slow)
+        self.signal = 0
+        if self.raw_signal != 0 and len(ema_close) >= self.trend_period + 1:
+            trend_type = 'bullish' if self.raw_signal == 1 else 'bearish'
+            if validate_trend(ema_close, trend_type, self.trend_period, self.trend_ratio):
+                self.signal = self.raw_signal
+        return self.signal
+
+    def values(self):
+        """
+        Indicator values of the bar the last update evaluated
+        """
+        return self.latest if self.latest is not None else self.engine.last_values()
+
+    def exit_sides(self):
+        """
+        (close longs, close shorts): longs close when the trend turns bearish, shorts when it turns bullish
+        """
+        return (validate_trend(self.recent_ema, 'bearish', self.trend_period, self.trend_ratio),
+                validate_trend(self.recent_ema, 'bullish', self.trend_period, self.trend_ratio))
+
+    def should_close(self, position):
+        """
+        Close a long position when the trend turns bearish and a short one when it turns bullish
+        """
+        if position.type not in (0, 1):
+            return False
+        return self.exit_sides()[position.type]
+
+
+class TrendStrengthStrategy:
+    """
+    EMA alignment, RSI and MACD trend strength with pullback confirmation, from newtest.py
+    """
+
+    lookback = 100
+    state_fields = ('latest', 'bar_time', 'signal', 'raw_signal', 'strength', 'previous', 'highs', 'lows')
+
+    def __init__(self, graph=None):
+        self.engine = trend_engine(graph=graph)
+        self.latest = None
+        self.bar_time = None
+        self.signal = 0
+        self.raw_signal = 0
+        self.strength = 0
+        self.previous = {}
+        self.highs = []
+        self.lows = []
+
+    def update(self, rates, closed_only=False):
+        """
+        Update the indicators with a copy_rates_from_pos array and return the confirmed signal
+        """
+        self.update_indicators(rates, closed_only)
+        return self.evaluate()
+
+    def update_indicators(self, rates, closed_only=False):
+        """
+        The indicator half of update(), returns the values of the evaluated bar
+        """
+        self.engine.update_many(rates[:-1])
+        if closed_only:
+            self.latest = self.engine.last_values()
+            self.previous = {name: values[-2] for name, values in self.engine.history.items() if len(values) > 1}
+            self.highs = self.engine.series('high', 5)
+            self.lows = self.engine.series('low', 5)
+            self.bar_time = int(rates[-2]['time'])
+        else:
+            self.latest = self.engine.peek(rates[-1])
+            self.previous = self.engine.last_values()
+            self.highs = self.engine.series('high', 5, self.latest)
+            self.lows = self.engine.series('low', 5, self.latest)
+            self.bar_time = int(rates[-1]['time'])
+        return self.latest
+
+    def evaluate(self):
+        """
+        The signal half of update(), on the indicators of the last update_indicators()
+        """
+        # Calculate trend strength for the latest and the previous candle
+        self.strength = analyze_trend_strength(self.latest)
+        prev_strength = analyze_trend_strength(self.previous) if self.previous else 0
+        self.raw_signal = generate_signal(self.strength, prev_strength)
+
+        # Additional trend confirmation
+        self.signal = 0
+        if self.raw_signal != 0:
+            latest = self.latest
+            price_range = max(self.highs) - min(self.lows)
+            atr = latest['ATR']
+            if self.raw_signal == 1:  # Check for pullback completion
+                if latest['close'] > latest['EMA_10'] and latest['RSI'] > 40 and price_range < atr * 2:
+                    self.signal = 1
+            elif latest['close'] < latest['EMA_10'] and latest['RSI'] < 60 and price_range < atr * 2:
+                self.signal = -1
+        return self.signal
+
+    def values(self):
+        """
+        Indicator values of the bar the last update evaluated
+        """
+        return self.latest
+
+    def exit_sides(self):
+        """
+        (close longs, close shorts) once the trend strength turns significantly against them
+        """
+        return self.strength < -1, self.strength > 1
+
+    def should_close(self, position):
+        """
+        Close a position when the trend strength turns significantly against it
+        """
+        if position.type not in (0, 1):
+            return False
+        return self.exit_sides()[position.type]
+
+
+STRATEGIES = {
+    'crossover': CrossoverStrategy,
+    'trend': TrendStrengthStrategy,
+}
@@ -0,0 +1,87 @@
+import numpy as np
+
+from bar_cache import BarCache
+from rates import RATES_DTYPE
+
+
+def synthetic_rates(count):
+    rates = np.zeros(count, dtype=RATES_DTYPE)
+    rates['time'] = 1704067200 + 900 * np.arange(count)
+    rates['close'] = 1.25 + 0.0001 * np.arange(count)
+    rates['open'] = rates['close'] - 0.00005
+    rates['high'] = rates['close'] + 0.0002
+    rates['low'] = rates['open'] - 0.0002
+    rates['tick_volume'] = np.arange(count) + 100
+    return rates
+
+
+def test_extend_wraps_around():
+    rates = synthetic_rates(40)
+    cache = BarCache('EURUSD', 15, capacity=10)
+    assert cache.extend(rates[:7]) == 7
+    # 7 more bars go past the end of the buffer and push the oldest 4 out
+    assert cache.extend(rates[7:14]) == 7
+    assert len(cache) == 10
+    assert cache.start == 4
+    np.testing.assert_array_equal(cache.latest(), rates[4:14])
+    np.testing.assert_array_equal(cache.latest(3), rates[11:14])
+    assert cache.last_time == rates[13]['time']
+
+
+def test_extend_longer_than_capacity():
+    rates = synthetic_rates(40)
+    cache = BarCache('EURUSD', 15, capacity=10)
+    cache.extend(rates[:3])
+    assert cache.extend(rates[3:30]) == 10
+    np.testing.assert_array_equal(cache.latest(), rates[20:30])
+
+
+def test_extend_replaces_the_forming_bar():
+    rates = synthetic_rates(40)
+    cache = BarCache('EURUSD', 15, capacity=10)
+    cache.extend(rates[:12])
+    forming = rates[11:13].copy()
+    forming[0]['close'] += 0.01
+    # The overlap up to the last cached bar is dropped, the last one is updated in place
+    assert cache.extend(np.concatenate([rates[5:11], forming])) == 2
+    latest = cache.latest()
+    assert len(latest) == 10
+    assert latest[-2]['close'] == forming[0]['close']
+    np.testing.assert_array_equal(latest[-1], rates[12])
+    np.testing.assert_array_equal(latest[:-2], rates[3:11])
+
+
+def test_refresh_fetches_only_from_the_last_bar():
+    rates = synthetic_rates(40)
+
+    class Source:
+        available = 20
+        calls = []
+
+        def copy_rates_from_pos(self, symbol, timeframe, start, count):
+            self.calls.append('from_pos')
+            return rates[:self.available][-count:]
+
+        def copy_rates_range(self, symbol, timeframe, date_from, date_to):
+            self.calls.append('range')
+            shown = rates[:self.available]
+            return shown[(shown['time'] >= date_from) & (shown['time'] <= date_to)]
+
+    source = Source()
+    cache = BarCache('EURUSD', 15, capacity=10)
+    assert cache.refresh(source) == 10
+    source.available = 33
+    # The last cached bar updated, then the 13 new ones trimmed to the capacity
+    assert cache.refresh(source) == 11
+    assert source.calls == ['from_pos', 'range']
+    np.testing.assert_array_equal(cache.latest(), rates[23:33])
+
+
+def test_persisted_cache_survives_reopen(tmp_path):
+    rates = synthetic_rates(40)
+    path = str(tmp_path / 'EURUSD_15.npy')
+    cache = BarCache('EURUSD', 15, capacity=10, path=path)
+    cache.extend(rates[:15])
+    cache.flush()
+    reopened = BarCache('EURUSD', 15, capacity=10, path=path)
+    np.testing.assert_array_equal(reopened.latest(), rates[5:15])
@@ -0,0 +1,115 @@
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import bot_api
+from broker import SimulatedBroker
+from journal import Journal
+from rates import synthetic_rates
+from runner import BotRunner
+
+ACCOUNT = 7
+
+
+def signal_start(rates):
+    """
+    A start bar where the crossover job signals on its first evaluation
+    """
+    for start in range(100, len(rates) - 1):
+        broker = SimulatedBroker({'EURUSD': rates}, start=start)
+        runner = BotRunner(ACCOUNT, None, broker=broker)
+        events = []
+        runner.listeners.append(events.append)
+        job = runner.add('EURUSD', 'crossover')
+        runner.connect()
+        runner.evaluate(job)
+        runner.orders.stop()
+        if any(event['event'] == 'signal' for event in events):
+            return start
+    raise AssertionError("No crossover in the synthetic bars")
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    rates = synthetic_rates(400, seed=2)
+    start = signal_start(rates)
+    manager = bot_api.BotManager(bot_api.hub, broker_factory=lambda account: SimulatedBroker({'EURUSD': rates},
+                                                                                             start=start))
+    monkeypatch.setattr(bot_api, 'manager', manager)
+    monkeypatch.setattr(bot_api, 'journal', Journal(str(tmp_path / 'journal.db')))
+    with TestClient(bot_api.app) as client:
+        yield client
+
+
+def start_bot(client, **fields):
+    return client.post('/bots', json=dict(dict(account=ACCOUNT, symbol='EURUSD'), **fields))
+
+
+def test_start_and_stop(client):
+    response = start_bot(client)
+    assert response.status_code == 201
+    key = bot_api.manager.key(ACCOUNT, 'EURUSD')
+    assert response.json() == {'bot': key}
+    assert start_bot(client).status_code == 409
+    assert start_bot(client, symbol='GBPUSD', strategy='unknown').status_code == 400
+    assert [bot['bot'] for bot in client.get('/bots').json()] == [key]
+
+    assert client.delete(f'/bots/{ACCOUNT}/EURUSD').json() == {'stopped': key}
+    assert client.get('/bots').json() == []
+    assert bot_api.manager.runners == {}
+    assert client.delete(f'/bots/{ACCOUNT}/EURUSD').status_code == 404
+
+
+def test_signal_reaches_the_websocket_and_fills(client):
+    with client.websocket_connect('/ws') as websocket:
+        assert start_bot(client, dry_run=False).status_code == 201
+        events = []
+        while not any(event['event'] == 'order' for event in events):
+            events.append(websocket.receive_json())
+    signal, = [event for event in events if event['event'] == 'signal']
+    order, = [event for event in events if event['event'] == 'order']
+    assert (signal['account'], signal['symbol'], order['side']) == (ACCOUNT, 'EURUSD', signal['side'])
+    assert order['filled']
+
+    indicators = client.get(f'/bots/{ACCOUNT}/EURUSD/indicators').json()
+    assert indicators['bar_time'] == signal['bar_time']
+    assert indicators['signal'] == (1 if signal['side'] == 'BUY' else -1)
+    assert set(indicators['values']) >= {'EMA_Close_10', 'EMA_Median_23'}
+    position, = client.get(f'/bots/{ACCOUNT}/EURUSD/positions').json()
+    assert (position['ticket'], position['symbol'], position['type']) == (order['ticket'], 'EURUSD',
+                                                                           0 if order['side'] == 'BUY' else 1)
+    assert client.get(f'/bots/{ACCOUNT}/GBPUSD/positions').status_code == 404
+    client.delete(f'/bots/{ACCOUNT}/EURUSD')
+
+
+def test_login_does_not_hold_up_the_other_accounts():
+    rates = synthetic_rates(400, seed=2)
+    logging_in, release = threading.Event(), threading.Event()
+
+    class SlowBroker(SimulatedBroker):
+        def login(self, login=None, password=None, server=None):
+            logging_in.set()
+            release.wait(5)
+            return super().login(login, password, server)
+
+    manager = bot_api.BotManager(bot_api.hub, broker_factory=lambda account: (SlowBroker if account == 1 else
+                                                                              SimulatedBroker)({'EURUSD': rates}))
+    slow = threading.Thread(target=manager.start, args=(bot_api.BotConfig(account=1, symbol='EURUSD'),))
+    slow.start()
+    try:
+        assert logging_in.wait(5)
+        # Served while account 1 is logging in, a second bot of account 1 has to wait for it
+        assert manager.start(bot_api.BotConfig(account=2, symbol='EURUSD')) == manager.key(2, 'EURUSD')
+        with pytest.raises(KeyError):
+            manager.start(bot_api.BotConfig(account=1, symbol='GBPUSD'))
+    finally:
+        release.set()
+        slow.join(5)
+    assert sorted(manager.runners) == [1, 2]
+
+    runner = manager.runners[1]
+    manager.start(bot_api.BotConfig(account=1, symbol='EURUSD', strategy='trend'))
+    manager.stop(manager.key(1, 'EURUSD'))
+    assert [job.name for job in runner.jobs] == ['EURUSD/TrendStrengthStrategy/15']
+    manager.stop_all()
@@ -0,0 +1,175 @@
+import numpy as np
+import pytest
+
+from broker import Broker, MT5Broker, SimulatedBroker
+from rates import synthetic_rates
+
+POINT = 0.00001
+
+
+@pytest.fixture
+def rates():
+    return synthetic_rates(200, seed=4)
+
+
+def request(side, volume=0.1, price=None, deviation=20, sl=0.0, tp=0.0, filling=Broker.ORDER_FILLING_IOC):
+    return dict(action=Broker.TRADE_ACTION_DEAL, symbol='EURUSD', volume=volume, price=price,
+                type=Broker.ORDER_TYPE_BUY if side == 'BUY' else Broker.ORDER_TYPE_SELL,
+                deviation=deviation, sl=sl, tp=tp, magic=234000, comment='test',
+                type_filling=filling)
+
+
+def test_forming_bar_shows_only_its_open(rates):
+    broker = SimulatedBroker({'EURUSD': rates}, start=100)
+    bars = broker.copy_rates_from_pos('EURUSD', Broker.TIMEFRAME_M15, 0, 10)
+    assert len(bars) == 10
+    np.testing.assert_array_equal(bars[:-1], rates[91:100])
+    assert bars[-1]['time'] == rates[100]['time']
+    assert bars[-1]['close'] == bars[-1]['high'] == bars[-1]['low'] == rates[100]['open']
+    broker.step()
+    bars = broker.copy_rates_from_pos('EURUSD', Broker.TIMEFRAME_M15, 1, 1)
+    np.testing.assert_array_equal(bars, rates[100:101])
+    assert broker.copy_rates_from_pos('EURUSD', Broker.TIMEFRAME_H1, 0, 10) is None
+
+
+def test_copy_rates_range_stops_at_the_clock(rates):
+    broker = SimulatedBroker({'EURUSD': rates}, start=100)
+    bars = broker.copy_rates_range('EURUSD', Broker.TIMEFRAME_M15, rates[95]['time'], rates[150]['time'])
+    assert list(bars['time']) == list(rates['time'][95:101])
+
+
+def test_market_orders_fill_at_the_quote(rates):
+    broker = SimulatedBroker({'EURUSD': rates}, start=100, slippage=3)
+    tick = broker.symbol_info_tick('EURUSD')
+    assert tick.bid == rates[100]['open']
+    assert tick.ask == pytest.approx(tick.bid + 10 * POINT)
+
+    result = broker.order_send(request('BUY', price=tick.ask))
+    assert result.retcode == Broker.TRADE_RETCODE_DONE
+    assert result.price == pytest.approx(tick.ask + 3 * POINT)
+    position, = broker.positions_get(symbol='EURUSD')
+    assert (position.ticket, position.type, position.volume, position.magic) == (result.order, 0, 0.1, 234000)
+
+    sell = broker.order_send(request('SELL', price=tick.bid))
+    assert sell.price == pytest.approx(tick.bid - 3 * POINT)
+    assert len(broker.positions_get()) == 2
+
+
+def test_requote_beyond_the_deviation(rates):
+    broker = SimulatedBroker({'EURUSD': rates}, start=100, slippage=30)
+    tick = broker.symbol_info_tick('EURUSD')
+    result = broker.order_send(request('BUY', price=tick.ask, deviation=20))
+    assert result.retcode == Broker.TRADE_RETCODE_REQUOTE
+    assert broker.positions_get() == ()
+    assert broker.order_send(request('BUY', price=tick.ask, deviation=40)).retcode == Broker.TRADE_RETCODE_DONE
+    assert broker.order_send(dict(request('BUY'), symbol='XXXYYY')).retcode == Broker.TRADE_RETCODE_INVALID
+
+
+def test_stop_loss_and_take_profit(rates):
+    rates = rates.copy()
+    rates['spread'] = 0
+    price = rates[100]['open']
+    # Bar 103 reaches the take profit of the buy, bar 105 the one of the sell
+    rates['high'][100:106] = price + 0.0005
+    rates['low'][100:106] = price - 0.0005
+    rates['high'][103] = price + 0.0030
+    rates['low'][105] = price - 0.0030
+    broker = SimulatedBroker({'EURUSD': rates}, start=100)
+    buy = broker.order_send(request('BUY', sl=price - 0.0040, tp=price + 0.0020))
+    sell = broker.order_send(request('SELL', sl=price + 0.0040, tp=price - 0.0020))
+    balance = broker.balance
+
+    broker.advance(3 * 900)
+    assert len(broker.positions) == 2
+    broker.advance(900)
+    assert list(broker.positions) == [sell.order]
+    assert broker.deals[-1]['entry'] == 'tp'
+    assert broker.deals[-1]['price'] == pytest.approx(price + 0.0020)
+    assert broker.balance == pytest.approx(balance + 0.0020 * 0.1 * 100000)
+
+    broker.advance(2 * 900)
+    assert broker.positions == {}
+    assert broker.deals[-1]['ticket'] == sell.order
+    assert broker.deals[-1]['entry'] == 'tp'
+    assert broker.balance == pytest.approx(balance + 2 * 0.0020 * 0.1 * 100000)
+    assert buy.order != sell.order
+
+
+def test_stop_loss_first_when_both_are_in_one_bar(rates):
+    rates = rates.copy()
+    rates['spread'] = 0
+    price = rates[100]['open']
+    rates['high'][100] = price + 0.0050
+    rates['low'][100] = price - 0.0050
+    broker = SimulatedBroker({'EURUSD': rates}, start=100)
+    broker.order_send(request('BUY', sl=price - 0.0010, tp=price + 0.0010))
+    broker.step()
+    assert broker.positions == {}
+    assert broker.deals[-1]['entry'] == 'sl'
+    assert broker.deals[-1]['price'] == pytest.approx(price - 0.0010)
+
+
+def test_account_info_and_close(rates):
+    broker = SimulatedBroker({'EURUSD': rates}, start=100, balance=5000, leverage=50)
+    result = broker.order_send(request('BUY', volume=1.0))
+    info = broker.account_info()
+    assert info.margin == pytest.approx(result.price * 100000 / 50)
+    assert info.equity == pytest.approx(5000 + info.profit)
+    broker.step()
+    closed = broker.positions_close(result.order)
+    assert closed.retcode == Broker.TRADE_RETCODE_DONE
+    assert broker.positions_get() == ()
+    assert broker.balance == pytest.approx(5000 + (closed.price - result.price) * 100000)
+    assert broker.positions_close(result.order).retcode == Broker.TRADE_RETCODE_POSITION_CLOSED
+
+
+def test_live_close_sends_an_opposite_deal(rates):
+    terminal = SimulatedBroker({'EURUSD': rates}, start=100)
+    # MT5Broker over a stand-in for the MetaTrader5 package, which has no positions_close
+    broker = MT5Broker.__new__(MT5Broker)
+    broker.mt = terminal
+    opened = terminal.order_send(request('SELL'))
+    terminal.step()
+    closed = broker.positions_close(opened.order)
+    assert closed.retcode == Broker.TRADE_RETCODE_DONE
+    assert closed.request['type'] == Broker.ORDER_TYPE_BUY
+    assert (closed.request['position'], closed.request['volume']) == (opened.order, 0.1)
+    assert closed.request['comment'] == 'PipBot close'
+    assert closed.price == pytest.approx(terminal.symbol_info_tick('EURUSD').ask)
+    assert terminal.positions_get() == ()
+    assert broker.positions_close(opened.order) is None
+
+
+@pytest.mark.parametrize('filling_mode, allowed', [
+    (Broker.SYMBOL_FILLING_IOC, Broker.ORDER_FILLING_IOC),
+    (Broker.SYMBOL_FILLING_FOK, Broker.ORDER_FILLING_FOK),
+    (0, Broker.ORDER_FILLING_RETURN),
+])
+def test_filling_mode_refuses_other_types(rates, filling_mode, allowed):
+    broker = SimulatedBroker({'EURUSD': rates}, start=100, filling_mode=filling_mode)
+    for filling in (Broker.ORDER_FILLING_FOK, Broker.ORDER_FILLING_IOC, Broker.ORDER_FILLING_RETURN):
+        result = broker.order_send(request('BUY', filling=filling))
+        expected = Broker.TRADE_RETCODE_DONE if filling == allowed else Broker.TRADE_RETCODE_INVALID_FILL
+        assert result.retcode == expected
+    position, = broker.positions_get()
+    # The close picks the filling type the symbol allows
+    assert broker.positions_close(position.ticket).retcode == Broker.TRADE_RETCODE_DONE
+
+
+def test_history_deals_of_a_position_and_a_range(rates):
+    broker = SimulatedBroker({'EURUSD': rates}, start=100)
+    buy = broker.order_send(dict(request('BUY'), comment='intent 7'))
+    broker.step()
+    sell = broker.order_send(request('SELL'))
+    broker.positions_close(buy.order)
+
+    entry, out = broker.history_deals_get(position=buy.order)
+    assert (entry.entry, entry.type, entry.comment, entry.magic) == (Broker.DEAL_ENTRY_IN, Broker.DEAL_TYPE_BUY,
+                                                                     'intent 7', 234000)
+    assert (out.entry, out.type, out.reason) == (Broker.DEAL_ENTRY_OUT, Broker.DEAL_TYPE_SELL,
+                                                 Broker.DEAL_REASON_EXPERT)
+    assert out.profit == pytest.approx(broker.balance - 10000.0)
+    assert entry.ticket != out.ticket and entry.position_id == out.position_id == buy.order
+    later = broker.history_deals_get(rates[101]['time'], rates[101]['time'])
+    assert [(deal.position_id, deal.entry) for deal in later] == [(sell.order, Broker.DEAL_ENTRY_IN),
+                                                                 (buy.order, Broker.DEAL_ENTRY_OUT)]
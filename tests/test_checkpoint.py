@@ -0,0 +1,134 @@
+import os
+import pickle
+
+import pytest
+
+import checkpoint
+from broker import SimulatedBroker, TradePosition
+from indicators import trend_engine
+from positions import PositionBook
+from rates import synthetic_rates
+from scheduler import BarScheduler
+from strategies import CrossoverStrategy
+
+
+@pytest.fixture
+def rates():
+    return synthetic_rates(300, seed=8)
+
+
+def run(strategy, scheduler, rates, start, end):
+    # Evaluate every bar close the way the runner does, the forming bar last
+    for close in range(start, end):
+        window = rates[max(0, close - strategy.lookback):close + 1]
+        strategy.update_indicators(window, closed_only=True)
+        strategy.evaluate()
+        scheduler.is_new_bar(int(window[-1]['time']))
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'bot.ckpt')
+    assert checkpoint.load(path) is None
+    checkpoint.save(path, {'graph': {'last_time': 5}})
+    state = checkpoint.load(path)
+    assert state['graph'] == {'last_time': 5}
+    assert state['version'] == checkpoint.VERSION
+    assert os.listdir(tmp_path) == ['bot.ckpt']
+
+    with open(path, 'wb') as f:
+        pickle.dump({'version': checkpoint.VERSION + 1}, f)
+    assert checkpoint.load(path) is None
+    with open(path, 'wb') as f:
+        f.write(b'not a pickle')
+    assert checkpoint.load(path) is None
+
+
+def test_resume_graph_feeds_the_missed_bars(rates):
+    engine = trend_engine()
+    engine.update_many(rates[:150])
+    state = engine.graph.state()
+    engine.update_many(rates[150:200])
+
+    restored = trend_engine()
+    # The cache reaches back past the checkpoint, rates[200] is still forming
+    assert checkpoint.resume_graph(restored.graph, state, rates[120:201])
+    assert restored.last_time == rates[199]['time']
+    assert restored.last_values() == engine.last_values()
+
+
+def test_resume_graph_with_a_gap_starts_cold(rates):
+    engine = trend_engine()
+    engine.update_many(rates[:150])
+    state = engine.graph.state()
+
+    restored = trend_engine()
+    assert not checkpoint.resume_graph(restored.graph, state, rates[160:201])
+    assert restored.last_time is None
+    assert not checkpoint.resume_graph(restored.graph, trend_engine().graph.state(), rates[:201])
+    # The terminal's history does not reach back to the checkpoint either
+    assert not checkpoint.resume_graph(restored.graph, state, rates[160:201], lambda start, end: rates[155:201])
+    assert restored.last_time is None
+
+
+def test_resume_graph_fetches_the_bars_the_cache_lost(rates):
+    engine = trend_engine()
+    engine.update_many(rates[:150])
+    state = engine.graph.state()
+    engine.update_many(rates[150:200])
+    broker = SimulatedBroker({'EURUSD': rates}, start=200)
+    asked = []
+
+    def fetch(start, end):
+        asked.append((start, end))
+        return broker.copy_rates_range('EURUSD', broker.timeframe, start, end)
+
+    restored = trend_engine()
+    # Down longer than the cache holds, the bars in between come from the terminal
+    assert checkpoint.resume_graph(restored.graph, state, rates[160:201], fetch)
+    assert asked == [(rates[149]['time'], rates[200]['time'])]
+    assert restored.last_time == rates[199]['time']
+    assert restored.last_values() == engine.last_values()
+
+
+def test_resume_strategy_matches_a_bot_that_kept_running(tmp_path, rates):
+    path = str(tmp_path / 'bot.ckpt')
+    strategy, scheduler = CrossoverStrategy(), BarScheduler(15)
+    run(strategy, scheduler, rates, 60, 150)
+    checkpoint.save(path, checkpoint.capture(strategy, scheduler))
+    run(strategy, scheduler, rates, 150, 250)
+
+    restored, restored_scheduler = CrossoverStrategy(), BarScheduler(15)
+    state = checkpoint.load(path)
+    # Down for 20 bars, the bar cache still holds the bars since the checkpoint
+    assert checkpoint.resume(state, restored, restored_scheduler, rates[100:171])
+    assert restored_scheduler.last_bar_time == rates[149]['time']
+    assert (restored.bar_time, restored.signal) == (state['strategy']['bar_time'], state['strategy']['signal'])
+    run(restored, restored_scheduler, rates, 170, 250)
+    assert restored.values() == strategy.values()
+    assert (restored.bar_time, restored.signal, restored.recent_ema) == (strategy.bar_time, strategy.signal,
+                                                                          strategy.recent_ema)
+
+
+def test_resume_reports_position_changes(rates):
+    def position(ticket, tp=1.3):
+        return TradePosition(ticket, 0, 0, 0, 0, 234000, ticket, 0.1, 1.25, 1.2, tp, 1.25, 0.0, 0.0, 'EURUSD', '')
+
+    class Broker:
+        positions = (position(1), position(2))
+
+        def positions_get(self):
+            return self.positions
+
+    broker = Broker()
+    book = PositionBook(broker)
+    book.refresh()
+    strategy, scheduler = CrossoverStrategy(), BarScheduler(15)
+    run(strategy, scheduler, rates, 60, 100)
+    state = checkpoint.capture(strategy, scheduler, book)
+
+    broker.positions = (position(2, tp=1.35), position(3))
+    restarted = PositionBook(broker)
+    # A cold start still reconciles the positions
+    assert not checkpoint.resume(state, CrossoverStrategy(), BarScheduler(15), rates[150:201], restarted)
+    assert sorted((event, p.ticket) for event, p in restarted.refresh()) == [('closed', 1), ('modified', 2),
+                                                                              ('opened', 3)]
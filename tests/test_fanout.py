@@ -0,0 +1,49 @@
+import time
+
+from broker import Broker, SimulatedBroker
+from fanout import FanoutSupervisor, _execute
+from orders import SymbolCache, place_market_order
+from positions import PositionBook
+from rates import synthetic_rates
+
+
+def intent(kind, **fields):
+    return dict(fields, id=1, kind=kind, symbol='EURUSD', tag='PipBot 1:1', magic=7, signal_time=time.time())
+
+
+def test_worker_opens_with_the_magic_and_closes_only_its_positions():
+    broker = SimulatedBroker({'EURUSD': synthetic_rates(300)}, start=200)
+    book = PositionBook(broker)
+    retcode, ticket = _execute(broker, SymbolCache(broker), book, {'login': 1},
+                               intent('open', side='BUY', lots={1: 0.1}, sl_points=300, tp_points=300))
+    assert retcode == Broker.TRADE_RETCODE_DONE
+    position, = broker.positions_get()
+    assert (position.ticket, position.magic, position.comment) == (ticket, 7, 'PipBot 1:1')
+    other = place_market_order(broker, 'EURUSD', 'BUY', 0.1, 300, 300, magic=8).order
+    short = place_market_order(broker, 'EURUSD', 'SELL', 0.1, 300, 300, magic=7).order
+
+    assert _execute(broker, None, book, {'login': 1}, intent('exit', close_long=True, close_short=False)) == \
+        (Broker.TRADE_RETCODE_DONE, [ticket])
+    assert sorted(position.ticket for position in broker.positions_get()) == [other, short]
+
+
+def test_exits_go_out_only_while_an_account_holds_the_side():
+    supervisor = FanoutSupervisor([{'login': 1}, {'login': 2}])
+    published = []
+    supervisor.publish = lambda kind, symbol, **fields: published.append((kind, symbol, fields))
+
+    def bar(close_long, close_short, magic=7):
+        supervisor.on_event(dict(event='bar', symbol='EURUSD', magic=magic, close_long=close_long,
+                                 close_short=close_short))
+
+    bar(True, True)
+    assert published == []
+    supervisor._handle(('heartbeat', 2, time.time(), 1000.0, 100, (('EURUSD', 7, 0), ('EURUSD', 8, 1))))
+    bar(False, True)
+    bar(True, False, magic=8)
+    assert published == []
+    bar(True, False)
+    assert published == [('exit', 'EURUSD', dict(close_long=True, close_short=False, magic=7))]
+    # Not again until a heartbeat shows the position still open
+    bar(True, False)
+    assert len(published) == 1
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicators import ATR, EMA, MACD, RSI, IndicatorEngine, RollingMean
+
+BAR = np.dtype([('time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8')])
+
+
+@pytest.fixture
+def rates():
+    rng = np.random.default_rng(7)
+    bars = np.zeros(300, dtype=BAR)
+    close = 1.25 * np.exp(np.cumsum(rng.normal(0, 0.0004, len(bars))))
+    bars['time'] = 1704067200 + 900 * np.arange(len(bars))
+    bars['open'] = np.concatenate([[1.25], close[:-1]])
+    bars['close'] = close
+    wick = np.abs(rng.normal(0, 0.0002, (2, len(bars))))
+    bars['high'] = np.maximum(bars['open'], close) + wick[0]
+    bars['low'] = np.minimum(bars['open'], close) - wick[1]
+    return bars
+
+
+def stream(indicator, rates):
+    return np.array([indicator.update(bar) for bar in rates], dtype=float)
+
+
+def stream_values(indicator, values):
+    return np.array([indicator.update_value(float(x)) for x in values], dtype=float)
+
+
+def test_ema_matches_pandas(rates):
+    close = pd.Series(rates['close'])
+    for span in (10, 23, 50):
+        expected = close.ewm(span=span, adjust=False).mean().to_numpy()
+        np.testing.assert_allclose(stream(EMA(span), rates), expected, rtol=1e-12)
+
+
+def test_rolling_mean_matches_pandas(rates):
+    close = pd.Series(rates['close'])
+    expected = close.rolling(20).mean().to_numpy()
+    np.testing.assert_allclose(stream_values(RollingMean(20), close), expected, rtol=1e-10, equal_nan=True)
+
+
+def test_rsi_matches_pandas(rates):
+    close = pd.Series(rates['close'])
+    delta = close.diff()
+    gain = delta.where(delta > 0, 0).rolling(14).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(14).mean()
+    expected = (100 - 100 / (1 + gain / loss)).to_numpy()
+    np.testing.assert_allclose(stream(RSI(14), rates), expected, rtol=1e-8, equal_nan=True)
+
+
+def test_macd_matches_pandas(rates):
+    close = pd.Series(rates['close'])
+    macd = close.ewm(span=12, adjust=False).mean() - close.ewm(span=26, adjust=False).mean()
+    signal = macd.ewm(span=9, adjust=False).mean()
+    indicator = MACD()
+    values = np.array([indicator.update(bar) for bar in rates])
+    np.testing.assert_allclose(values[:, 0], macd.to_numpy(), rtol=1e-10, atol=1e-15)
+    np.testing.assert_allclose(values[:, 1], signal.to_numpy(), rtol=1e-10, atol=1e-15)
+
+
+def test_atr_matches_pandas(rates):
+    expected = (pd.Series(rates['high']) - pd.Series(rates['low'])).rolling(14).mean().to_numpy()
+    np.testing.assert_allclose(stream(ATR(14), rates), expected, rtol=1e-10, equal_nan=True)
+
+
+def test_peek_leaves_state_alone(rates):
+    engine = IndicatorEngine({'EMA_10': EMA(10), 'RSI': RSI(14), ('MACD', 'Signal_Line'): MACD()})
+    engine.update_many(rates[:-1])
+    before = engine.last_values()
+    peeked = engine.peek(rates[-1])
+    assert engine.last_values() == before
+    assert engine.update(rates[-1]) == peeked
+
+
+def test_engine_skips_bars_already_seen(rates):
+    engine = IndicatorEngine({'EMA_10': EMA(10)})
+    assert engine.update_many(rates[:200]) == 200
+    assert engine.update_many(rates[150:250]) == 50
+    expected = pd.Series(rates['close'][:250]).ewm(span=10, adjust=False).mean().iloc[-1]
+    assert engine.last_values()['EMA_10'] == pytest.approx(expected, rel=1e-12)
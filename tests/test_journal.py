@@ -0,0 +1,125 @@
+import random
+import sqlite3
+
+import pytest
+
+from broker import SimulatedBroker
+from journal import DAY, Journal
+from rates import synthetic_rates
+from runner import BotRunner
+
+START = 1704067200
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = Journal(str(tmp_path / 'journal.db'))
+    journal.start()
+    yield journal
+    journal.close()
+
+
+def close(ticket, time, profit, account=1, symbol='EURUSD'):
+    return dict(event='close', account=account, ticket=ticket, symbol=symbol, time=time, type=0, volume=0.1,
+                price_open=1.25, price=1.26, profit=profit, reason=3)
+
+
+def order(time, slippage, account=1, symbol='EURUSD', filled=True):
+    return dict(event='order', account=account, symbol=symbol, job='job', time=time, side='BUY', volume=0.1,
+                requested=1.25, price=1.25, slippage=slippage, filled=filled, retcode=10009, ticket=None,
+                comment='done')
+
+
+def daily(journal, table):
+    connection = sqlite3.connect(journal.path)
+    try:
+        return connection.execute(f"SELECT * FROM {table} ORDER BY account, symbol, day").fetchall()
+    finally:
+        connection.close()
+
+
+def test_triggers_keep_daily_totals(journal):
+    journal.record(close(1, START + 100, 10.0))
+    journal.record(close(2, START + 200, -4.0))
+    journal.record(close(3, START + DAY + 5, 3.0, symbol='GBPUSD'))
+    journal.record(dict(event='position_opened', account=1, time=START))
+    journal.flush()
+    assert daily(journal, 'closes_daily') == [(1, 'EURUSD', START, 2, 1, 1, 6.0, 10.0, -4.0),
+                                              (1, 'GBPUSD', START + DAY, 1, 1, 0, 3.0, 3.0, 0.0)]
+    assert journal.written == 3
+
+
+def test_close_seen_again_moves_its_totals(journal):
+    journal.record(close(1, START + 100, 10.0))
+    journal.flush()
+    # A later deal closed the rest on the next day with a different realized profit
+    journal.record(close(1, START + DAY + 100, -2.0))
+    journal.record(close(1, START + DAY + 100, -2.0))
+    journal.flush()
+    assert daily(journal, 'closes_daily') == [(1, 'EURUSD', START, 0, 0, 0, 0.0, 0.0, 0.0),
+                                              (1, 'EURUSD', START + DAY, 1, 0, 1, -2.0, 0.0, -2.0)]
+    assert journal.pnl(account=1) == [{'trades': 1, 'profit': -2.0, 'gross_profit': 0, 'gross_loss': -2.0}]
+
+
+def test_range_queries_match_the_rows(journal):
+    rng = random.Random(5)
+    closes = [close(ticket, START + rng.randrange(10 * DAY), round(rng.uniform(-10, 10), 2),
+                    account=rng.choice([1, 2]), symbol=rng.choice(['EURUSD', 'GBPUSD']))
+              for ticket in range(500)]
+    for event in closes:
+        journal.record(event)
+    journal.flush()
+
+    for start, end in ((None, None), (START + 3 * DAY, START + 7 * DAY), (START + 5000, START + 4 * DAY + 700),
+                       (START + DAY + 10, START + DAY + 20000), (None, START + 2 * DAY + 1)):
+        inside = [event for event in closes
+                  if (start is None or event['time'] >= start) and (end is None or event['time'] < end)]
+        total, = journal.pnl(start=start, end=end)
+        assert total['trades'] == len(inside)
+        assert total['profit'] == pytest.approx(sum(event['profit'] for event in inside))
+        rows = journal.hit_rate(start=start, end=end, by='symbol')
+        for row in rows:
+            mine = [event for event in inside if (event['account'], event['symbol']) == (row['account'],
+                                                                                          row['symbol'])]
+            assert row['trades'] == len(mine)
+            assert row['wins'] == sum(event['profit'] > 0 for event in mine)
+
+
+def test_slippage_totals(journal):
+    journal.record(order(START + 10, 2.0))
+    journal.record(order(START + 20, None, filled=False))
+    journal.record(order(START + DAY + 30, 5.0))
+    journal.record(dict(event='risk_rejected', account=1, symbol='EURUSD', job='job', time=START + 40, side='BUY',
+                        lot_size=0.1, reason='not enough free margin'))
+    journal.flush()
+    assert daily(journal, 'orders_daily') == [(1, 'EURUSD', START, 3, 1, 1, 2.0, 2.0),
+                                              (1, 'EURUSD', START + DAY, 1, 1, 1, 5.0, 5.0)]
+    assert journal.slippage() == [{'orders': 4, 'filled': 2, 'slippage_max': 5.0, 'slippage_mean': 3.5}]
+    assert journal.slippage(start=START + 15, end=START + DAY + 10) == [
+        {'orders': 2, 'filled': 0, 'slippage_max': 0, 'slippage_mean': 0.0}]
+
+
+def test_runner_journals_every_close_from_the_deals(journal):
+    bars = {f"C{n}USD": synthetic_rates(400, seed=n) for n in range(4)}
+    broker = SimulatedBroker(bars, start=300)
+    runner = BotRunner(0, None, broker=broker)
+    runner.listeners.append(journal.record)
+    for symbol in bars:
+        runner.add(symbol, 'crossover', sl_points=30, tp_points=30)
+    runner.connect()
+    for step in range(90):
+        broker.step()
+        for job in runner.jobs:
+            runner.evaluate(job)
+        runner.orders.join()
+        if step % 30 == 29:
+            runner.record_closes()
+    runner.record_closes()
+    runner.orders.stop()
+    journal.flush()
+
+    # Positions stopped out between two snapshots are there too, with their deal profit
+    closed = {deal['ticket'] for deal in broker.deals if deal['entry'] != 'in'}
+    total, = journal.pnl(account=0)
+    assert closed and total['trades'] == len(closed)
+    assert total['profit'] == pytest.approx(sum(deal['profit'] for deal in broker.deals))
@@ -0,0 +1,116 @@
+import pytest
+
+from broker import Broker, OrderSendResult, SymbolInfo, Tick
+from orders import OrderExecutor, SymbolCache, filling_type, magic_number, send_market_order
+
+POINT = 0.00001
+
+
+class ScriptedBroker(Broker):
+    """
+    Quotes one ask per order_send and answers with the scripted retcodes
+    """
+
+    def __init__(self, asks, retcodes, filling_mode=Broker.SYMBOL_FILLING_IOC):
+        self.filling_mode = filling_mode
+        self.asks = list(asks)
+        self.retcodes = list(retcodes)
+        self.requests = []
+        self.info_calls = 0
+
+    def symbol_info(self, symbol):
+        self.info_calls += 1
+        return SymbolInfo(symbol, POINT, 5, 10, 100000, self.filling_mode, 0.01, 100.0, 0.01,
+                          symbol[:3], symbol[3:], symbol[:3])
+
+    def symbol_info_tick(self, symbol):
+        ask = self.asks[min(len(self.requests), len(self.asks) - 1)]
+        return Tick(0, ask - 10 * POINT, ask, 0.0, 0, 0, 0, 0.0)
+
+    def order_send(self, request):
+        self.requests.append(request)
+        retcode = self.retcodes.pop(0)
+        return OrderSendResult(retcode, 1, 1, request['volume'], request['price'], 0.0, 0.0, '', 0, request)
+
+
+def spec_of(broker):
+    return SymbolCache(broker).get('EURUSD')
+
+
+def test_requote_resends_with_the_deviation_left():
+    asks = [1.25000, 1.25005, 1.25012]
+    broker = ScriptedBroker(asks, [Broker.TRADE_RETCODE_REQUOTE, Broker.TRADE_RETCODE_PRICE_CHANGED,
+                                   Broker.TRADE_RETCODE_DONE])
+    report = {}
+    result = send_market_order(broker, 'EURUSD', 'BUY', 0.1, 30, 60, spec_of(broker), deviation=20, report=report)
+    assert result.retcode == Broker.TRADE_RETCODE_DONE
+    assert [request['price'] for request in broker.requests] == asks
+    assert [request['deviation'] for request in broker.requests] == [20, 15, 8]
+    assert report['requested'] == asks[0]
+    assert report['attempts'] == 3
+    assert broker.requests[-1]['sl'] == pytest.approx(asks[-1] - 30 * POINT)
+
+
+@pytest.mark.parametrize('filling_mode, expected', [
+    (Broker.SYMBOL_FILLING_IOC | Broker.SYMBOL_FILLING_FOK, Broker.ORDER_FILLING_IOC),
+    (Broker.SYMBOL_FILLING_IOC, Broker.ORDER_FILLING_IOC),
+    (Broker.SYMBOL_FILLING_FOK, Broker.ORDER_FILLING_FOK),
+    (0, Broker.ORDER_FILLING_RETURN),
+])
+def test_filling_type_follows_the_symbol(filling_mode, expected):
+    assert filling_type(Broker, filling_mode) == expected
+    broker = ScriptedBroker([1.25000], [Broker.TRADE_RETCODE_DONE], filling_mode)
+    send_market_order(broker, 'EURUSD', 'BUY', 0.1, 30, 60, spec_of(broker))
+    assert broker.requests[0]['type_filling'] == expected
+
+
+def test_no_resend_once_the_quote_left_the_deviation():
+    broker = ScriptedBroker([1.25000, 1.25025], [Broker.TRADE_RETCODE_REQUOTE, Broker.TRADE_RETCODE_DONE])
+    result = send_market_order(broker, 'EURUSD', 'BUY', 0.1, 30, 60, spec_of(broker), deviation=20)
+    assert result.retcode == Broker.TRADE_RETCODE_REQUOTE
+    assert len(broker.requests) == 1
+
+
+def test_retries_stop_at_max_retries_and_on_other_retcodes():
+    broker = ScriptedBroker([1.25000], [Broker.TRADE_RETCODE_REQUOTE] * 5)
+    result = send_market_order(broker, 'EURUSD', 'SELL', 0.1, 30, 60, spec_of(broker), max_retries=2)
+    assert result.retcode == Broker.TRADE_RETCODE_REQUOTE
+    assert len(broker.requests) == 3
+
+    broker = ScriptedBroker([1.25000], [Broker.TRADE_RETCODE_REJECT, Broker.TRADE_RETCODE_DONE])
+    assert send_market_order(broker, 'EURUSD', 'SELL', 0.1, 30, 60, spec_of(broker)).retcode == \
+        Broker.TRADE_RETCODE_REJECT
+    assert len(broker.requests) == 1
+
+
+def test_executor_records_fills_and_caches_the_symbol():
+    broker = ScriptedBroker([1.25000, 1.25003, 1.25003], [Broker.TRADE_RETCODE_REQUOTE, Broker.TRADE_RETCODE_DONE,
+                                                          Broker.TRADE_RETCODE_DONE])
+    executor = OrderExecutor(broker)
+    try:
+        assert executor.submit('EURUSD', 'BUY', 0.1, 30, 60).result().retcode == Broker.TRADE_RETCODE_DONE
+        executor.submit('EURUSD', 'BUY', 0.1, 30, 60).result()
+    finally:
+        executor.stop()
+    assert broker.info_calls == 1
+    first, second = executor.records
+    assert (first['attempts'], first['filled']) == (2, True)
+    assert first['slippage'] == pytest.approx(3)
+    assert second['attempts'] == 1
+    stats = executor.stats()
+    assert (stats['orders'], stats['filled'], stats['retried']) == (2, 2, 1)
+
+
+def test_executor_sends_the_magic_number():
+    magic = magic_number('EURUSD/TrendStrengthStrategy/15')
+    broker = ScriptedBroker([1.25000], [Broker.TRADE_RETCODE_DONE] * 2)
+    executor = OrderExecutor(broker)
+    try:
+        executor.submit('EURUSD', 'BUY', 0.1, 30, 60).result()
+        executor.submit('EURUSD', 'SELL', 0.1, 30, 60, magic=magic).result()
+    finally:
+        executor.stop()
+    assert [request['magic'] for request in broker.requests] == [234000, magic]
+    # The same for a bot after a restart, different for another one
+    assert magic_number('EURUSD/TrendStrengthStrategy/15') == magic
+    assert magic_number('EURUSD/CrossoverStrategy/15') != magic
@@ -0,0 +1,97 @@
+from broker import TradePosition
+from positions import PositionBook
+
+
+def position(ticket, symbol='EURUSD', type=0, magic=234000, volume=0.1, sl=1.2, tp=1.3, profit=0.0):
+    return TradePosition(ticket, 0, 0, 0, type, magic, ticket, volume, 1.25, sl, tp, 1.25, 0.0, profit, symbol,
+                         'PipBot')
+
+
+class Broker:
+    def __init__(self):
+        self.positions = ()
+        self.calls = 0
+
+    def positions_get(self):
+        self.calls += 1
+        return self.positions
+
+
+def test_refresh_diffs_snapshots():
+    broker = Broker()
+    book = PositionBook(broker)
+    seen = []
+    book.listeners.append(lambda event, position: seen.append((event, position.ticket)))
+
+    broker.positions = (position(1), position(2, 'GBPUSD', type=1))
+    assert [(event, p.ticket) for event, p in book.refresh()] == [('opened', 1), ('opened', 2)]
+
+    # Profit moves on every tick and is not a modification, sl, tp and volume are
+    broker.positions = (position(1, profit=5.0), position(2, 'GBPUSD', type=1, sl=1.4), position(3))
+    assert sorted((event, p.ticket) for event, p in book.refresh()) == [('modified', 2), ('opened', 3)]
+
+    broker.positions = (position(2, 'GBPUSD', type=1, sl=1.4, volume=0.05),)
+    assert sorted((event, p.ticket) for event, p in book.refresh()) == [('closed', 1), ('closed', 3),
+                                                                         ('modified', 2)]
+    assert book.refresh() == []
+    assert seen == [('opened', 1), ('opened', 2), ('modified', 2), ('opened', 3), ('modified', 2),
+                    ('closed', 1), ('closed', 3)]
+    assert [p.ticket for p in book.for_symbol('GBPUSD')] == [2]
+    assert book.for_symbol('EURUSD') == ()
+
+
+def test_failed_snapshot_keeps_the_last_one():
+    broker = Broker()
+    book = PositionBook(broker)
+    broker.positions = (position(1),)
+    book.refresh()
+    broker.positions = None
+    assert book.refresh() == []
+    assert list(book.by_ticket) == [1]
+
+
+def test_snapshot_is_shared_while_fresh():
+    broker = Broker()
+    now = [0.0]
+    book = PositionBook(broker, clock=lambda: now[0])
+    book.snapshot(max_age=1.0)
+    now[0] = 0.5
+    book.snapshot(max_age=1.0)
+    assert broker.calls == 1
+    now[0] = 1.5
+    book.snapshot(max_age=1.0)
+    assert broker.calls == 2
+
+
+def test_to_close_skips_pending_tickets():
+    class Strategy:
+        def exit_sides(self):
+            return True, False
+
+    broker = Broker()
+    book = PositionBook(broker)
+    broker.positions = (position(1), position(2), position(3, type=1), position(4, magic=1))
+    book.refresh()
+    book.closing(2)
+    assert [p.ticket for p in book.to_close('EURUSD', Strategy(), magic=234000)] == [1]
+    book.close_failed(2)
+    assert [p.ticket for p in book.to_close('EURUSD', Strategy(), magic=234000)] == [1, 2]
+    # A snapshot without the ticket ends its pending close
+    book.closing(1)
+    broker.positions = (position(2),)
+    book.refresh()
+    assert book.pending_close == set()
+
+
+def test_state_round_trip_reports_changes_while_stopped():
+    broker = Broker()
+    book = PositionBook(broker)
+    broker.positions = (position(1), position(2))
+    book.refresh()
+    saved = book.state()
+
+    restarted = PositionBook(broker)
+    restarted.load_state(saved)
+    broker.positions = (position(2, tp=1.35), position(5))
+    events = sorted((event, p.ticket) for event, p in restarted.refresh())
+    assert events == [('closed', 1), ('modified', 2), ('opened', 5)]
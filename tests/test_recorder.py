@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+import pytest
+
+from broker import SimulatedBroker
+from rates import synthetic_rates
+from recorder import ChunkedColumns, MarketRecorder, MarketStore, TICK_DTYPE
+
+
+def test_append_skips_rows_already_stored(tmp_path):
+    rates = synthetic_rates(30)
+    store = ChunkedColumns(str(tmp_path), rates.dtype, chunk_rows=100)
+    assert store.append(rates[:20]) == 20
+    assert store.append(rates[10:25]) == 5
+    assert len(store) == 25
+    assert store.last_time == rates[24]['time']
+    np.testing.assert_array_equal(store.records(), rates[:25])
+
+
+def test_full_chunks_roll_over_and_compress(tmp_path):
+    rates = synthetic_rates(100)
+    store = ChunkedColumns(str(tmp_path), rates.dtype, chunk_rows=10, keep_raw=2)
+    for start in range(0, 95, 5):
+        store.append(rates[start:start + 5])
+    assert len(store) == 95
+    # 9 full chunks and the open one, all but the newest 2 sealed ones compressed
+    assert len(store.index) == 10
+    assert list(store.index[:, 3]) == [1] * 7 + [0] * 3
+    assert sorted(os.listdir(tmp_path))[:8] == [f"{number:06d}.npz" for number in range(7)] + ['000007']
+    assert list(store.index[:, 2]) == [10] * 9 + [5]
+    np.testing.assert_array_equal(store.records(), rates[:95])
+
+
+def test_read_back_ranges(tmp_path):
+    rates = synthetic_rates(100)
+    store = ChunkedColumns(str(tmp_path), rates.dtype, chunk_rows=10, keep_raw=2)
+    store.append(rates[:95])
+    times = rates['time']
+    for lo, hi in ((0, 94), (3, 8), (15, 55), (81, 88), (90, 94)):
+        part = store.read(times[lo], times[hi], columns=['time', 'close'])
+        np.testing.assert_array_equal(part['time'], times[lo:hi + 1])
+        np.testing.assert_array_equal(part['close'], rates['close'][lo:hi + 1])
+    # Inside one raw chunk the columns are views on the files
+    assert isinstance(store.read(times[81], times[88])['close'].base, np.memmap)
+    assert len(store.read(times[-1] + 1)['time']) == 0
+    assert [len(chunk['time']) for chunk in store.chunks(times[15], times[34])] == [5, 10, 5]
+
+
+def test_reopen_continues_the_open_chunk(tmp_path):
+    rates = synthetic_rates(40)
+    store = ChunkedColumns(str(tmp_path), rates.dtype, chunk_rows=16, keep_raw=1)
+    store.append(rates[:20])
+    store.flush()
+    reopened = ChunkedColumns(str(tmp_path), rates.dtype, chunk_rows=16, keep_raw=1)
+    assert reopened.last_time == rates[19]['time']
+    assert reopened.append(rates[:40]) == 20
+    np.testing.assert_array_equal(reopened.records(), rates)
+
+
+def test_recorder_writes_closed_bars_and_ticks(tmp_path):
+    rates = synthetic_rates(300)
+    broker = SimulatedBroker({'EURUSD': rates}, start=200)
+    store = MarketStore(str(tmp_path), bar_chunk_rows=64)
+    recorder = MarketRecorder(broker, store, ['EURUSD'], timeframes=(15,))
+    recorder.record_once()
+    for _ in range(5):
+        broker.step()
+        recorder.record_once()
+    # The forming bar is left out until it closes
+    np.testing.assert_array_equal(store.bars('EURUSD', 15).records(), rates[:205])
+    ticks = store.ticks('EURUSD').records()
+    assert ticks.dtype == TICK_DTYPE
+    assert list(ticks['time_msc']) == [int(time) * 1000 for time in rates['time'][200:206]]
+    assert list(store.frame('EURUSD', 15, columns=['close'])['close'][-3:]) == list(rates['close'][202:205])
+
+
+def test_recorder_catches_up_after_a_long_gap(tmp_path):
+    rates = synthetic_rates(1600)
+    broker = SimulatedBroker({'EURUSD': rates}, start=100)
+    store = MarketStore(str(tmp_path))
+    recorder = MarketRecorder(broker, store, ['EURUSD'], timeframes=(15,))
+    recorder.record_once()
+    # Down for longer than one copy_rates_from_pos request covers
+    broker.advance(1400 * 900)
+    recorder.record_once()
+    np.testing.assert_array_equal(store.bars('EURUSD', 15).records(), rates[:1500])
+
+
+def test_crash_while_compressing_keeps_the_chunk(tmp_path, monkeypatch):
+    rates = synthetic_rates(40)
+    store = ChunkedColumns(str(tmp_path), rates.dtype, chunk_rows=10, keep_raw=1)
+
+    def crash(path):
+        raise OSError("killed")
+
+    monkeypatch.setattr('shutil.rmtree', crash)
+    with pytest.raises(OSError):
+        store.append(rates[:25])
+    monkeypatch.undo()
+    # The archive and the index were written before the raw files went
+    reopened = ChunkedColumns(str(tmp_path), rates.dtype, chunk_rows=10, keep_raw=1)
+    assert reopened.index[0, 3] == 1
+    assert not os.path.exists(tmp_path / '000000')
+    reopened.append(rates[:40])
+    np.testing.assert_array_equal(reopened.records(), rates)
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from broker import Broker, SimulatedBroker
+from rates import TIMEFRAME_SECONDS, synthetic_rates
+from resample import TIMEFRAME_M1, BarResampler, resample
+
+# Starts at 22:37 so the first H1, H4 and D1 buckets are only partly covered
+START = 1262304000 + 22 * 3600 + 37 * 60
+
+
+@pytest.fixture
+def minutes():
+    rates = synthetic_rates(3 * 1440, seed=6, start=START, timeframe=TIMEFRAME_M1)
+    # Minutes without ticks have no bar
+    keep = np.ones(len(rates), dtype=bool)
+    keep[np.random.default_rng(6).choice(len(rates), 300, replace=False)] = False
+    return rates[keep]
+
+
+def expected(minutes, timeframe):
+    frame = pd.DataFrame(minutes)
+    bar_seconds = TIMEFRAME_SECONDS[timeframe]
+    grouped = frame.groupby(frame['time'] // bar_seconds * bar_seconds, sort=True)
+    return grouped.agg(open=('open', 'first'), high=('high', 'max'), low=('low', 'min'), close=('close', 'last'),
+                       tick_volume=('tick_volume', 'sum'), spread=('spread', 'min'),
+                       real_volume=('real_volume', 'sum'))
+
+
+@pytest.mark.parametrize('timeframe', [Broker.TIMEFRAME_M15, Broker.TIMEFRAME_H1, Broker.TIMEFRAME_H4,
+                                       Broker.TIMEFRAME_D1])
+def test_resample_matches_grouped_aggregation(minutes, timeframe):
+    bars = resample(minutes, timeframe)
+    reference = expected(minutes, timeframe)
+    assert list(bars['time']) == list(reference.index)
+    assert (bars['time'] % TIMEFRAME_SECONDS[timeframe] == 0).all()
+    for name in reference.columns:
+        np.testing.assert_array_equal(bars[name], reference[name].to_numpy(), err_msg=name)
+
+
+def test_resample_buckets_on_server_time():
+    minutes = synthetic_rates(6 * 60, start=START, timeframe=TIMEFRAME_M1)
+    assert list(resample(minutes, Broker.TIMEFRAME_H4)['time']) == [1262304000 + hours * 3600
+                                                                      for hours in (20, 24, 28)]
+    day, = resample(minutes[:60], Broker.TIMEFRAME_D1)
+    assert day['time'] == 1262304000
+    assert (day['open'], day['close']) == (minutes[0]['open'], minutes[59]['close'])
+    assert len(resample(minutes[:0], Broker.TIMEFRAME_H1)) == 0
+
+
+def test_resampler_follows_the_m1_feed(minutes):
+    broker = SimulatedBroker({'EURUSD': minutes}, timeframe=TIMEFRAME_M1, start=200)
+    resampler = BarResampler('EURUSD', (Broker.TIMEFRAME_H1, Broker.TIMEFRAME_H4))
+    for _ in range(600):
+        assert resampler.refresh(broker)
+        broker.step()
+    assert resampler.refresh(broker)
+
+    shown = broker.copy_rates_from_pos('EURUSD', TIMEFRAME_M1, 0, len(minutes))
+    for timeframe in (Broker.TIMEFRAME_H1, Broker.TIMEFRAME_H4):
+        bar_seconds = TIMEFRAME_SECONDS[timeframe]
+        # Every bucket after the first M1 bar, the forming one last
+        direct = resample(shown, timeframe)
+        first = -(-int(minutes['time'][0]) // bar_seconds) * bar_seconds
+        direct = direct[direct['time'] >= first]
+        np.testing.assert_array_equal(resampler.rates(timeframe), direct)
+        np.testing.assert_array_equal(resampler.copy_rates_from_pos('EURUSD', timeframe, 1, 2), direct[-3:-1])
+    assert resampler.copy_rates_from_pos('GBPUSD', Broker.TIMEFRAME_H1, 0, 1) is None
+
+
+class NoRangeBroker(SimulatedBroker):
+    """
+    A terminal without copy_rates_range, its native bars of every timeframe resampled from M1
+    """
+
+    def copy_rates_range(self, symbol, timeframe, date_from, date_to):
+        return None
+
+    def copy_rates_from_pos(self, symbol, timeframe, start_pos, count):
+        if timeframe == TIMEFRAME_M1:
+            return super().copy_rates_from_pos(symbol, timeframe, start_pos, count)
+        bars = resample(super().copy_rates_from_pos(symbol, TIMEFRAME_M1, 0, len(self.bars[symbol])), timeframe)
+        end = max(0, len(bars) - start_pos)
+        return bars[max(0, end - count):end]
+
+
+@pytest.mark.parametrize('broker_class', [SimulatedBroker, NoRangeBroker])
+def test_resampler_after_a_gap_longer_than_its_m1_buffer(minutes, broker_class):
+    broker = broker_class({'EURUSD': minutes}, timeframe=TIMEFRAME_M1, start=200)
+    resampler = BarResampler('EURUSD', (Broker.TIMEFRAME_H1, Broker.TIMEFRAME_H4))
+    assert resampler.refresh(broker)
+    # Down for a day and a half, five times what the M1 buffer holds
+    broker.advance(36 * 3600)
+    assert resampler.refresh(broker)
+
+    shown = broker.copy_rates_from_pos('EURUSD', TIMEFRAME_M1, 0, len(minutes))
+    for timeframe in (Broker.TIMEFRAME_H1, Broker.TIMEFRAME_H4):
+        bar_seconds = TIMEFRAME_SECONDS[timeframe]
+        direct = resample(shown, timeframe)
+        if broker_class is SimulatedBroker:
+            # Built from M1 only, from the first bucket M1 covers whole
+            first = -(-int(minutes['time'][0]) // bar_seconds) * bar_seconds
+            direct = direct[direct['time'] >= first]
+        np.testing.assert_array_equal(resampler.rates(timeframe), direct)
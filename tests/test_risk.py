@@ -0,0 +1,153 @@
+import numpy as np
+import pytest
+
+from orders import SymbolSpec
+from broker import Tick
+from risk import APPROVED, EXPOSURE, MARGIN, NO_PRICE, TOO_SMALL, UNKNOWN, RiskEngine, bridge_rates
+
+LOGIN = 1
+
+
+def spec(name, volume_max=100.0):
+    return SymbolSpec(name, 0.00001, 5, 2, 0.01, volume_max, 0.01, 100000, name[:3], name[3:])
+
+
+def engine(**kwargs):
+    risk = RiskEngine('USD', **kwargs)
+    risk.set_account(LOGIN, 10000.0, 100)
+    for name in ('EURUSD', 'USDJPY', 'GBPUSD'):
+        risk.add_symbol(spec(name))
+    risk.update_market('EURUSD', 1.1, atr=0.0050)
+    risk.update_market('USDJPY', 150.0, atr=0.5)
+    return risk
+
+
+def test_atr_sizing_risks_a_share_of_equity():
+    risk = engine(risk_per_trade=0.01, atr_multiple=2.0)
+    # 2 ATRs of EURUSD lose 1000 USD per lot, 1% of 10000 is 100
+    assert risk.check_one(LOGIN, 'EURUSD', 1) == (pytest.approx(0.1), APPROVED)
+    # A JPY loss is valued through USDJPY: 2 * 0.5 * 100000 / 150 per lot
+    assert risk.check_one(LOGIN, 'USDJPY', -1) == (pytest.approx(0.15), APPROVED)
+    lots, reasons = risk.check([LOGIN, LOGIN], ['EURUSD', 'USDJPY'], [1, -1])
+    np.testing.assert_allclose(lots, [0.1, 0.15])
+    assert list(reasons) == [APPROVED, APPROVED]
+
+
+def test_volume_limits_and_missing_prices():
+    risk = engine(max_lots=0.5)
+    assert risk.check_one(LOGIN, 'EURUSD', 1, 2.0) == (0.5, APPROVED)
+    assert risk.check_one(LOGIN, 'EURUSD', 1, 0.037)[0] == pytest.approx(0.03)
+    assert risk.check_one(LOGIN, 'EURUSD', 1, 0.004) == (0.0, TOO_SMALL)
+    risk.update_market('EURUSD', 1.1, atr=50.0)
+    assert risk.check_one(LOGIN, 'EURUSD', 1) == (0.0, TOO_SMALL)
+    assert risk.check_one(LOGIN, 'GBPUSD', 1, 0.1) == (0.0, NO_PRICE)
+    lots, reasons = risk.check([LOGIN] * 3, ['EURUSD', 'GBPUSD', 'EURUSD'], [1, 1, 1], [0.004, 0.1, 0.2])
+    assert list(lots) == [0.0, 0.0, 0.2]
+    assert list(reasons) == [TOO_SMALL, NO_PRICE, APPROVED]
+
+
+def test_unknown_accounts_and_symbols_are_refused():
+    risk = engine(max_exposure=150000)
+    assert risk.check_one(2, 'EURUSD', 1, 0.1) == (0.0, UNKNOWN)
+    assert risk.check_one(LOGIN, 'EURGBP', 1, 0.1) == (0.0, UNKNOWN)
+    lots, reasons = risk.check([2, LOGIN, LOGIN, LOGIN], ['EURUSD', 'EURGBP', 'EURUSD', 'EURUSD'], [1] * 4,
+                               [1.0] * 4)
+    assert list(reasons) == [UNKNOWN, UNKNOWN, APPROVED, EXPOSURE]
+    assert list(lots) == [0.0, 0.0, 1.0, 0.0]
+
+
+def test_exposure_limit_clips_the_batch_in_order():
+    risk = engine(max_exposure=150000)
+    # One lot of EURUSD is 110000 USD of EUR, the second one in the batch goes over
+    lots, reasons = risk.check([LOGIN] * 3, ['EURUSD'] * 3, [1, 1, -1], [1.0, 1.0, 1.0])
+    assert list(reasons) == [APPROVED, EXPOSURE, APPROVED]
+    assert list(lots) == [1.0, 0.0, 1.0]
+
+    risk.on_fill(LOGIN, 'EURUSD', 1, 1.0, ticket=10)
+    assert risk.exposures(LOGIN) == {'USD': pytest.approx(-110000), 'EUR': pytest.approx(110000)}
+    assert risk.check_one(LOGIN, 'EURUSD', 1, 1.0) == (0.0, EXPOSURE)
+    # Reducing an exposure over the limit is always allowed
+    assert risk.check_one(LOGIN, 'EURUSD', -1, 0.5) == (0.5, APPROVED)
+    risk.on_close(LOGIN, 10)
+    assert risk.exposures(LOGIN) == {}
+    assert risk.check_one(LOGIN, 'EURUSD', 1, 1.0) == (1.0, APPROVED)
+
+
+def test_margin_limit_counts_fills_and_earlier_intents():
+    risk = engine(max_lots=10.0, max_margin_ratio=0.5)
+    # 1100 USD of margin per lot at 1:100, half of the 10000 equity may be used
+    risk.on_fill(LOGIN, 'EURUSD', 1, 4.0, ticket=1)
+    assert risk.margin[0] == pytest.approx(4400)
+    assert risk.check_one(LOGIN, 'EURUSD', -1, 1.0) == (0.0, MARGIN)
+    lots, reasons = risk.check([LOGIN] * 2, ['USDJPY', 'USDJPY'], [1, 1], [0.5, 0.5])
+    assert list(reasons) == [APPROVED, MARGIN]
+    risk.on_close(LOGIN, 1)
+    assert risk.margin[0] == pytest.approx(0)
+    assert risk.check_one(LOGIN, 'EURUSD', -1, 1.0) == (1.0, APPROVED)
+
+
+def test_listener_follows_position_snapshots():
+    from broker import TradePosition
+
+    risk = engine()
+    listener = risk.listener(LOGIN)
+    position = TradePosition(5, 0, 0, 0, 0, 234000, 5, 1.0, 1.1, 0, 0, 1.1, 0, 0, 'EURUSD', '')
+    listener('opened', position)
+    assert risk.exposures(LOGIN)['EUR'] == pytest.approx(110000)
+    listener('modified', position._replace(volume=0.4))
+    assert risk.exposures(LOGIN)['EUR'] == pytest.approx(44000)
+    listener('closed', position)
+    assert risk.exposures(LOGIN) == {}
+
+
+@pytest.mark.parametrize('pricing', ['EURUSD', 'USDJPY'])
+def test_cross_rates_through_either_leg(pricing):
+    risk = RiskEngine('USD')
+    risk.set_account(LOGIN, 10000.0, 100)
+    for name in ('EURJPY', 'EURUSD', 'USDJPY'):
+        risk.add_symbol(spec(name))
+    risk.update_market('EURJPY', 165.0, atr=0.5)
+    assert risk.unpriced() == ['EUR', 'JPY']
+    assert risk.check_one(LOGIN, 'EURJPY', 1, 0.1) == (0.0, NO_PRICE)
+    # EURUSD values EUR and then JPY through EURJPY, USDJPY values JPY and then EUR
+    risk.update_market(pricing, 1.1 if pricing == 'EURUSD' else 150.0)
+    assert risk.unpriced() == []
+    eur, jpy = risk.fx[risk.currencies['EUR']], risk.fx[risk.currencies['JPY']]
+    assert eur == pytest.approx(1.1)
+    assert jpy == pytest.approx(1 / 150)
+    assert risk.check_one(LOGIN, 'EURJPY', 1) == (pytest.approx(0.15), APPROVED)
+    lots, reasons = risk.check([LOGIN], ['EURJPY'], [1])
+    assert (lots[0], reasons[0]) == (pytest.approx(0.15), APPROVED)
+
+
+def test_bridge_rates_from_pairs_not_traded():
+    class Broker:
+        def symbol_info_tick(self, symbol):
+            bids = {'USDJPY': 150.0, 'EURUSD': 1.1}
+            return Tick(0, bids[symbol], bids[symbol], 0, 0, 0, 0, 0) if symbol in bids else None
+
+    risk = RiskEngine('USD')
+    risk.set_account(LOGIN, 10000.0, 100)
+    risk.add_symbol(spec('EURJPY'))
+    risk.add_symbol(spec('CHFNOK'))
+    risk.update_market('EURJPY', 165.0)
+    assert bridge_rates(risk, Broker()) == ['CHF', 'NOK']
+    assert risk.bridged() == ['EUR', 'JPY']
+    assert risk.fx[risk.currencies['JPY']] == pytest.approx(1 / 150)
+    assert risk.fx[risk.currencies['EUR']] == pytest.approx(1.1)
+    assert risk.check_one(LOGIN, 'EURJPY', 1, 0.1) == (0.1, APPROVED)
+
+
+def test_fill_without_a_value_keeps_margin_finite():
+    risk = engine()
+    risk.add_symbol(spec('CHFNOK'))
+    # A position opened by hand on a pair with no USD value
+    risk.on_fill(LOGIN, 'CHFNOK', 1, 1.0, price=11.0, ticket=7)
+    risk.on_fill(LOGIN, 'EURUSD', 1, 1.0, ticket=8)
+    assert risk.margin[0] == pytest.approx(1100)
+    risk.update_market('CHFNOK', 11.0)
+    risk.set_rate('NOK', 0.1)
+    # Closing takes off the margin the fill added, not a revalued one
+    risk.on_close(LOGIN, 7)
+    assert risk.margin[0] == pytest.approx(1100)
+    assert risk.check_one(LOGIN, 'EURUSD', 1, 1.0) == (1.0, APPROVED)
@@ -0,0 +1,57 @@
+import pytest
+
+from broker import SimulatedBroker
+from orders import place_market_order
+from rates import synthetic_rates
+from runner import BotRunner
+
+
+class ExitStrategy:
+    """
+    Never signals and closes both sides on every bar
+    """
+    lookback = 50
+    signal = 0
+    bar_time = None
+
+    def update_indicators(self, rates, closed_only=False):
+        self.bar_time = int(rates[-2 if closed_only else -1]['time'])
+
+    def evaluate(self):
+        return 0
+
+    def exit_sides(self):
+        return True, True
+
+
+class OtherExitStrategy(ExitStrategy):
+    pass
+
+
+def test_jobs_on_one_symbol_close_only_their_own_positions():
+    broker = SimulatedBroker({'EURUSD': synthetic_rates(400)}, start=300)
+    runner = BotRunner(0, None, broker=broker)
+    job = runner.add('EURUSD', ExitStrategy())
+    other = runner.add('EURUSD', OtherExitStrategy(), trade=False)
+    assert job.magic != other.magic
+    with pytest.raises(ValueError):
+        runner.add('EURUSD', ExitStrategy())
+    assert runner.add('EURUSD', ExitStrategy(), magic=5).magic == 5
+    events = []
+    runner.listeners.append(events.append)
+    runner.connect()
+    tickets = {magic: place_market_order(broker, 'EURUSD', 'BUY', 0.1, 300, 300, magic=magic).order
+               for magic in (job.magic, other.magic, 234000)}
+
+    broker.step()
+    runner.evaluate(job)
+    runner.orders.join()
+    broker.step()
+    runner.evaluate(job)
+    runner.orders.stop()
+    # Exits are published while the job has positions to close, every bar reports its exit sides
+    exits = [event for event in events if event['event'] == 'exit']
+    assert [(event['tickets'], event['magic']) for event in exits] == [([tickets[job.magic]], job.magic)]
+    assert [event['close_long'] for event in events if event['event'] == 'bar'] == [True, True]
+    assert sorted(position.ticket for position in broker.positions_get()) == [tickets[other.magic],
+                                                                              tickets[234000]]
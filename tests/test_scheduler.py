@@ -0,0 +1,114 @@
+from collections import namedtuple
+
+import pytest
+
+from scheduler import BarScheduler
+
+M15, H4 = 15, 16388
+# Local clock of the tests, the broker runs two hours ahead of it
+NOW = 1_700_000_000
+OFFSET = 7200
+
+Tick = namedtuple('Tick', ['time_msc', 'bid', 'ask'])
+
+
+class Clock:
+    def __init__(self, now=NOW):
+        self.now = now
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def forming_bar(now, bar_seconds=900, offset=OFFSET):
+    return (now + offset) // bar_seconds * bar_seconds
+
+
+def test_sync_rounds_to_half_hours():
+    clock = Clock()
+    scheduler = BarScheduler(M15, clock=clock)
+    scheduler.sync(NOW + OFFSET + 7)
+    assert scheduler.server_offset == OFFSET
+    scheduler.sync(NOW - 1790)
+    assert scheduler.server_offset == -1800
+
+
+def test_wakes_just_after_the_close():
+    clock = Clock()
+    scheduler = BarScheduler(M15, close_delay=2, clock=clock)
+    scheduler.sync(NOW + OFFSET)
+    bar_time = forming_bar(NOW)
+    assert scheduler.next_wakeup(bar_time) == bar_time + 900 - OFFSET + 2
+
+
+def test_offset_from_the_forming_bar_without_a_tick():
+    clock = Clock()
+    scheduler = BarScheduler(M15, close_delay=1, clock=clock)
+    bar_time = forming_bar(NOW)
+    assert scheduler.next_wakeup(bar_time) == bar_time + 900 - OFFSET + 1
+    assert scheduler.server_offset == OFFSET
+
+
+def test_stale_tick_is_replaced_by_the_forming_bar():
+    clock = Clock()
+    scheduler = BarScheduler(M15, close_delay=1, clock=clock)
+    # Friday's last tick seen on Monday, three days behind the server clock
+    scheduler.sync(NOW + OFFSET - 3 * 86400)
+    bar_time = forming_bar(NOW)
+    assert scheduler.next_wakeup(bar_time) == bar_time + 900 - OFFSET + 1
+    assert scheduler.server_offset == OFFSET
+
+
+def test_long_bars_only_bound_the_offset():
+    clock = Clock()
+    scheduler = BarScheduler(H4, close_delay=1, clock=clock)
+    bar_time = forming_bar(NOW, 4 * 3600)
+    scheduler.sync_bar(bar_time)
+    # The smallest offset that still has the bar open, never one that wakes after the close
+    assert scheduler.server_offset <= OFFSET
+    assert clock.now + scheduler.server_offset >= bar_time
+    assert scheduler.next_wakeup(bar_time) >= bar_time + 4 * 3600 - OFFSET + 1
+
+
+def test_late_wakeups_back_off_up_to_max_retry():
+    clock = Clock()
+    scheduler = BarScheduler(M15, close_delay=1, max_retry=10, clock=clock)
+    scheduler.sync(NOW + OFFSET)
+    # The bar that should have closed already, the broker has not sent the next one
+    closed = forming_bar(NOW) - 900
+    assert scheduler.is_new_bar(closed)
+    waits = []
+    for _ in range(6):
+        assert not scheduler.is_new_bar(closed)
+        waits.append(scheduler.next_wakeup(closed) - clock.now)
+    assert waits == [2, 4, 8, 10, 10, 10]
+    assert scheduler.is_new_bar(closed + 900)
+    assert scheduler.misses == 0
+
+
+def test_wait_sleeps_until_the_wakeup():
+    clock = Clock()
+    scheduler = BarScheduler(M15, close_delay=1, clock=clock, sleep=clock.sleep)
+    scheduler.sync(NOW + OFFSET)
+    bar_time = forming_bar(NOW)
+    scheduler.wait(bar_time)
+    assert clock.now == bar_time + 900 - OFFSET + 1
+
+
+def test_wait_for_tick_returns_a_changed_quote():
+    clock = Clock()
+    scheduler = BarScheduler(M15, clock=clock, sleep=clock.sleep)
+    last = Tick(1, 1.1, 1.2)
+    ticks = iter([None, last, Tick(2, 1.1, 1.2)])
+    assert scheduler.wait_for_tick(lambda: next(ticks), last, latency=0.5) == Tick(2, 1.1, 1.2)
+    assert clock.slept == [0.5, 0.5, 0.5]
+
+
+def test_unknown_timeframe():
+    with pytest.raises(KeyError):
+        BarScheduler(7)
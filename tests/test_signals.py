@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from signals import (analyze_trend_strength, crossover_signal, crossover_signals, generate_signal,
+                     generate_signals, trend_strength, validate_trend, validate_trends)
+
+
+@pytest.fixture
+def prices():
+    rng = np.random.default_rng(3)
+    return 1.25 + np.cumsum(rng.normal(0, 0.001, 400))
+
+
+def test_trend_strength_matches_row_wise():
+    rng = np.random.default_rng(1)
+    frame = pd.DataFrame(rng.normal(0, 1, (500, 6)),
+                         columns=['EMA_10', 'EMA_20', 'EMA_50', 'RSI', 'MACD', 'Signal_Line'])
+    frame['RSI'] = 50 + 10 * frame['RSI']
+    frame.iloc[::17] = np.nan
+    expected = frame.apply(analyze_trend_strength, axis=1).to_numpy()
+    np.testing.assert_array_equal(trend_strength(frame), expected)
+
+
+def test_generate_signals_matches_per_bar():
+    rng = np.random.default_rng(2)
+    strength = rng.choice([-2, -1.5, -1, -0.5, 0, 0.5, 1, 1.5, 2], 1000)
+    expected = [0] + [generate_signal(strength[i], strength[i - 1]) for i in range(1, len(strength))]
+    np.testing.assert_array_equal(generate_signals(strength), expected)
+    # A batch of symbols signals the same as each on its own
+    batch = strength.reshape(4, 250)
+    np.testing.assert_array_equal(generate_signals(batch), [generate_signals(row) for row in batch])
+
+
+def test_crossover_signals_matches_per_bar(prices):
+    fast = pd.Series(prices).ewm(span=10, adjust=False).mean().to_numpy()
+    slow = pd.Series(prices).ewm(span=23, adjust=False).mean().to_numpy()
+    expected = [0] + [crossover_signal(fast[:i + 1], slow[:i + 1]) for i in range(1, len(prices))]
+    np.testing.assert_array_equal(crossover_signals(fast, slow), expected)
+
+
+@pytest.mark.parametrize('trend_type', ['bullish', 'bearish'])
+@pytest.mark.parametrize('trend_period', [1, 2, 5, 8])
+def test_validate_trends_matches_per_bar(prices, trend_type, trend_period):
+    expected = [i + 1 >= trend_period and validate_trend(list(prices[:i + 1]), trend_type, trend_period)
+                for i in range(len(prices))]
+    np.testing.assert_array_equal(validate_trends(prices, trend_type, trend_period), expected)
+
+
+def test_validate_trends_short_and_batched(prices):
+    assert not validate_trends(prices[:3], trend_period=5).any()
+    batch = prices[:300].reshape(3, 100)
+    np.testing.assert_array_equal(validate_trends(batch), [validate_trends(row) for row in batch])